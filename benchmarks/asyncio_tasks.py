@@ -0,0 +1,99 @@
+"""Benchmark of asyncio tasks running coroutines of virtual machine.
+
+A number of tasks (10k by default) are created at once, and each of them
+awaits `asyncio.sleep(0)` before returning. Time spent on running them in
+virtual machine is compared with the time spent by the same code executed
+natively.
+
+    $ python benchmarks/asyncio_tasks.py [--tasks N] [--repeat N] [--history FILE]
+
+With `--history`, the result is appended to FILE as a line of JSON, so that
+the ratio of both can be tracked over time.
+"""
+
+import argparse, json, os, platform, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bytefall import get_vm
+
+
+SOURCE = """\
+import asyncio
+
+async def work(i):
+    await asyncio.sleep(0)
+    return i
+
+async def main(n):
+    tasks = [asyncio.ensure_future(work(i)) for i in range(n)]
+    return sum(await asyncio.gather(*tasks))
+
+loop = asyncio.new_event_loop()
+result = loop.run_until_complete(main(N))
+loop.close()
+"""
+
+
+def run_native(code, n):
+    globs = {'N': n}
+    exec(code, globs)
+    return globs['result']
+
+
+def run_vm(code, n):
+    globs = {'N': n}
+    get_vm().run_code(code, f_globals=globs)
+    return globs['result']
+
+
+def measure(run, code, n, repeat):
+    """Get the shortest time of running given code `repeat` times."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run(code, n)
+        elapsed = time.perf_counter() - start
+        assert result == sum(range(n))
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=10000,
+                        help='Number of concurrent tasks. (default: 10000)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of runs, the shortest one is taken.')
+    parser.add_argument('--history', default=None,
+                        help='File which the result is appended to.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    code = compile(SOURCE, '<asyncio_tasks>', 'exec')
+
+    native = measure(run_native, code, args.tasks, args.repeat)
+    vm = measure(run_vm, code, args.tasks, args.repeat)
+    ratio = vm / native
+
+    print('tasks: %d' % args.tasks)
+    print('native: %.3fs' % native)
+    print('bytefall: %.3fs' % vm)
+    print('ratio: %.2f' % ratio)
+
+    if args.history:
+        record = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'tasks': args.tasks,
+            'native': native,
+            'bytefall': vm,
+            'ratio': ratio,
+        }
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,8 @@ from ._internal.exceptions import *
 from ._internal.utils import get_vm
 from . import vm
 from . import ops
+from . import specialize
 
 
-__all__ = ['get_vm', 'vm', 'ops']
+__all__ = ['get_vm', 'vm', 'ops', 'specialize']
 __all__.extend(exceptions.__all__)
@@ -17,6 +17,40 @@ def main():
                         help=('Enable tracing mode at the level of bytecode '
                         'instruction. (use `pdb.set_trace()` to determine the '
                         'entry)'))
+    parser.add_argument('--recursion_limit', type=int,
+                        default=CLIConfig.DEFAULTS['recursion_limit'],
+                        help=('Maximum depth of frames of virtual machine. '
+                        '(default: %(default)s)'))
+    parser.add_argument('--no_closure_tier', action='store_false',
+                        dest='closure_tier',
+                        help=('Disable compiling hot functions into closures, '
+                        'all instructions are executed by the interpreter.'))
+    parser.add_argument('--closure_threshold', type=int,
+                        default=CLIConfig.DEFAULTS['closure_threshold'],
+                        help=('Number of calls of a function before it is '
+                        'compiled into closures. (default: %(default)s)'))
+    parser.add_argument('--no_register_tier', action='store_false',
+                        dest='register_tier',
+                        help=('Compile hot functions into closures instead of '
+                        'translating them into register-based IR.'))
+    parser.add_argument('--no_codegen_tier', action='store_false',
+                        dest='codegen_tier',
+                        help=('Disable translating hot functions into Python '
+                        'source.'))
+    parser.add_argument('--codegen_threshold', type=int,
+                        default=CLIConfig.DEFAULTS['codegen_threshold'],
+                        help=('Number of calls of a function before it is '
+                        'translated into Python source. (default: %(default)s)'))
+    parser.add_argument('--no_trace_jit', action='store_false',
+                        dest='trace_jit',
+                        help='Disable recording hot loops into traces.')
+    parser.add_argument('--trace_threshold', type=int,
+                        default=CLIConfig.DEFAULTS['trace_threshold'],
+                        help=('Number of iterations of a loop before it is '
+                        'recorded into a trace. (default: %(default)s)'))
+    parser.add_argument('--no_osr', action='store_false', dest='osr',
+                        help=('Disable moving frames running hot loops which '
+                        'can not be traced to the compiled tiers.'))
     parser.add_argument('prog')
     parser.add_argument('args', nargs=REMAINDER)
 
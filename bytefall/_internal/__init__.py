@@ -1,7 +1,8 @@
 from . import base
 from . import cache
 from . import exceptions
+from . import pystate
 from . import tracer
 from . import utils
 
-__all__ = ['base', 'cache', 'exceptions', 'tracer', 'utils']
+__all__ = ['base', 'cache', 'exceptions', 'pystate', 'tracer', 'utils']
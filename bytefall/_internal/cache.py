@@ -1,22 +1,41 @@
-from .base import Singleton
+import weakref
 
 
-class GlobalCache(metaclass=Singleton):
-    _instance = None
+class CodeObjectCache(object):
+    """A cache keyed by the identity of code objects.
+
+    Code objects are hashed by value, and hashing one of them walks through
+    `co_code`, `co_consts` (including nested code objects) and so on. Since
+    lookups of this cache happen on every frame creation, we key the entries
+    by `id()` instead and drop them through a weak reference once the code
+    object is collected.
+    """
     def __init__(self):
         self._content = {}
 
-    def __str__(self):
-        return str(self._content)
+    def __len__(self):
+        return len(self._content)
+
+    def get(self, code, default=None):
+        entry = self._content.get(id(code))
+        if entry is None or entry[0]() is not code:
+            return default
+        return entry[1]
 
-    def get(self, *args):
-        return self._content.get(*args)
+    def set(self, code, value):
+        key = id(code)
+        content = self._content
 
-    def pop(self, *args):
-        return self._content.pop(*args)
+        def remove(ref):
+            # Make sure the entry is not replaced by another code object
+            # allocated at the same address.
+            entry = content.get(key)
+            if entry is not None and entry[0] is ref:
+                del content[key]
 
-    def set(self, key, value):
-        self._content.update({key: value})
+        content[key] = (weakref.ref(code, remove), value)
 
-    def delete(self, key):
-        del self._content[key]
+    def delete(self, code):
+        entry = self._content.get(id(code))
+        if entry is not None and entry[0]() is code:
+            del self._content[id(code)]
@@ -0,0 +1,48 @@
+"""Incomplete Python implemented "pystate.c".
+
+Here we just implement the part of thread state used by the evaluation loop
+of our vm.
+"""
+
+__all__ = ['ThreadState']
+
+
+class ThreadState(object):
+    """State of the thread running the virtual machine. (PyThreadState)
+
+    Members are named after the values they replace, and the corresponding
+    members in CPython are listed below:
+
+    - return_value: value returned by `RETURN_VALUE`, `YIELD_VALUE`, ...
+        (`retval` in `ceval.c::_PyEval_EvalFrameDefault`)
+    - last_exception: exception to be raised, None if there is no error
+        (`tstate->curexc_type`, `curexc_value`, `curexc_traceback`)
+    - new_exception: exception being handled
+        (`tstate->exc_info`)
+    - tracing: whether trace function is being called
+    - use_tracing: whether trace function should be called
+    - tracefunc, traceobj: trace function and its argument
+        (`tstate->c_tracefunc`, `tstate->c_traceobj`)
+    - interp: virtual machine running in this thread
+        (`tstate->interp`)
+    """
+    __slots__ = [
+        'return_value', 'last_exception', 'new_exception',
+        'tracing', 'use_tracing', 'tracefunc', 'traceobj', 'interp',
+    ]
+
+    def __init__(self, interp=None):
+        self.interp = interp
+        self.return_value = None
+        self.last_exception = None
+        self.new_exception = (type(None), None, None)
+        self.tracing = False
+        self.use_tracing = False
+        self.tracefunc = None
+        self.traceobj = None
+
+    def fetch_exception(self):
+        """Get the exception to be raised and clear it. (PyErr_Fetch)"""
+        exc = self.last_exception
+        self.last_exception = None
+        return (type(None), None, None) if exc is None else exc
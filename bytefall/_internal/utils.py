@@ -17,11 +17,19 @@ def get_operations():
     return cls_inst()
 
 
+_vm_class = None
+
+
 def get_vm_class():
-    from bytefall import vm  # locally lazy-import to avoid circular reference
+    # Class is looked up once, since `get_vm()` is called for every call of
+    # functions run by virtual machine (e.g. coroutines started by asyncio).
+    global _vm_class
+    if _vm_class is None:
+        from bytefall import vm  # locally lazy-import to avoid circular reference
 
-    name = 'VirtualMachinePy%s' % get_python_version_string()
-    return getattr(vm, name, None)
+        name = 'VirtualMachinePy%s' % get_python_version_string()
+        _vm_class = getattr(vm, name, None)
+    return _vm_class
 
 
 def get_vm(config=None):
@@ -37,19 +45,6 @@ def check_line_number(co, lasti):
 
     See also: cython/Objects/codeobject.c::_PyCode_CheckLineNumber
     """
-    lnotab = co.co_lnotab
-    addr_offsets, line_offsets = lnotab[::2], lnotab[1::2]
-    size = len(lnotab)//2
-    addr, lb, ub, i = 0, 0, 0, 0
-    line = co.co_firstlineno
-
-    while size > 0:
-        if addr + addr_offsets[i] > lasti: break
-        addr += addr_offsets[i]
-        line += line_offsets[i]
-        lb = addr
-        i += 1
-        size -= 1
-
-    ub = addr + addr_offsets[i] if size > 0 else 32767
-    return line, lb, ub
+    # locally lazy-import to avoid circular reference
+    from bytefall.objects.codeobject import get_line_table
+    return get_line_table(co).bounds(lasti)
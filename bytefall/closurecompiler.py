@@ -0,0 +1,165 @@
+"""
+Closure-compiled execution tier.
+
+Instructions of a hot code object are translated into a chain of closures,
+one for each basic block, with the operations and their operands bound when
+it is compiled. A compiled block runs its instructions without looking up the
+instruction stream and dispatch table, and it returns the same reasons (why)
+as `VirtualMachine.eval_fast`, so that calls, exceptions and the block stack
+are still handled by `VirtualMachine.run`.
+
+Blocks are compiled from the quickened instruction stream (see
+`specialize.quicken`) when they are run at the first time, so that the
+specialized operations and superinstructions are kept. Compiled blocks are
+discarded once a site of instruction in them is rewritten, and they will be
+compiled again with the current operation of that site.
+
+A code object is compiled after it has been called `threshold` times, or
+once a frame of it runs a hot loop which can't be traced. Frames run in the
+instrumented loop instead while tracing is enabled.
+"""
+from ._internal.cache import CodeObjectCache
+from .specialize import Site
+
+
+__all__ = ['ClosureCompiler', 'CompiledCode']
+
+
+# Number of calls of a code object before it is compiled
+DEFAULT_THRESHOLD = 100
+
+# Operations which can change `f_lasti` without having a jump target, a block
+# is ended after them.
+_JUMPING_OPS = {'END_FINALLY', 'YIELD_FROM'}
+
+
+def _ends_block(instr):
+    """Check whether a block should be ended after given instruction.
+
+    Besides jumps, a block is ended after calls. So that a call returning
+    'call' is resumed at the start of a block, and tracing installed by a
+    call is noticed by the loop running blocks before the next instruction.
+    """
+    if instr.jump_target is not None:
+        return True
+    # Name of the last instruction if it's a superinstruction
+    opname = instr.opname.rsplit('__', 1)[-1]
+    return opname in _JUMPING_OPS or opname.startswith('CALL_')
+
+
+def _make_block(steps):
+    """Make a closure running the steps of a basic block. Each step is a
+    tuple of (operation, arguments, next_offset).
+    """
+    def block(frame):
+        for operation, arguments, next_offset in steps:
+            frame.f_lasti = next_offset
+            why = operation(frame, *arguments)
+            if why:
+                return why
+    return block
+
+
+class CompiledCode(dict):
+    """Blocks of a compiled code object, indexed by the offset they start
+    from. Blocks are compiled lazily, and a block starting from any offset
+    can be requested (e.g. resuming a frame jumped by a debugger).
+    """
+    def __init__(self, code, table, dispatch_table):
+        super(CompiledCode, self).__init__()
+        self.table = table
+        self.dispatch_table = dispatch_table
+        self.watched_sites = set()
+
+    def __missing__(self, offset):
+        block = self[offset] = self.compile_block(offset)
+        return block
+
+    def compile_block(self, offset):
+        table, dispatch_table = self.table, self.dispatch_table
+        steps = []
+        while offset < len(table):
+            instr = table[offset]
+            arguments = instr.arguments
+            if arguments and isinstance(arguments[0], Site):
+                self.watch(arguments[0])
+            steps.append((
+                dispatch_table[instr.opcode], arguments, instr.next_offset
+            ))
+            if _ends_block(instr):
+                break
+            offset = instr.next_offset
+        return _make_block(tuple(steps))
+
+    def watch(self, site):
+        if site not in self.watched_sites:
+            self.watched_sites.add(site)
+            site.watchers.append(self.invalidate)
+
+    def invalidate(self, site):
+        """Discard all compiled blocks since `site` is rewritten."""
+        self.clear()
+
+
+class ClosureCompiler(object):
+    """Select hot code objects by counting their calls, and compile them
+    into `blocks`, which is `CompiledCode` or a subclass of it taking the same
+    arguments. (e.g. `registers.RegisterCode`)
+    """
+    def __init__(self, vm, threshold=DEFAULT_THRESHOLD, blocks=CompiledCode):
+        self.vm = vm
+        self.threshold = threshold
+        self.blocks = blocks
+        # [number of calls, compiled code] of each code object, the number is
+        # set to None once it won't be compiled again.
+        self._states = CodeObjectCache()
+
+    def get(self, code):
+        """Count a call of code object, and get its compiled blocks if it's
+        hot enough. Returned value is None if it's not compiled yet.
+        """
+        state = self._states.get(code)
+        if state is None:
+            state = [0, None]
+            self._states.set(code, state)
+        if state[0] is not None:
+            state[0] += 1
+            self.tier_up(code, state)
+        return state[1]
+
+    def tier_up(self, code, state):
+        """Compile given code object if its number of calls in `state`
+        exceeds the threshold.
+        """
+        if state[0] > self.threshold:
+            state[:] = [None, self.compile_code(code)]
+
+    def compile_code(self, code):
+        """Compile a code object into the last tier."""
+        return self.compile_blocks(code)
+
+    def compile_blocks(self, code):
+        """Compile a code object into `blocks`."""
+        return self.blocks(
+            code, self.vm.get_instructions(code), self.vm.dispatch_table
+        )
+
+    def compile(self, code):
+        """Compile a code object regardless of its number of calls, e.g. it's
+        running a hot loop. (see `VirtualMachine.osr`)
+        """
+        state = self._states.get(code)
+        if state is None:
+            state = [0, None]
+            self._states.set(code, state)
+        if state[0] is not None:
+            state[:] = [None, self.compile_code(code)]
+        return state[1]
+
+    def lookup(self, code):
+        """Get the compiled blocks of code object without counting a call."""
+        state = self._states.get(code)
+        return None if state is None else state[1]
+
+    def is_compiled(self, code):
+        return self.lookup(code) is not None
@@ -0,0 +1,629 @@
+"""
+Python-source code generation tier.
+
+Blocks of instructions of a hot code object are translated into the source of
+Python functions, which are compiled by `compile()` of host runtime. Values on
+the value stack become local variables of that function, and operations
+become direct expressions. e.g. `LOAD_FAST a; LOAD_FAST b; BINARY_ADD;
+STORE_FAST c` is translated into:
+
+    t0 = l0 + l1
+    fastlocals[2] = l2 = t0
+
+where `l0`, `l1` and `l2` are the slots of fast locals read by the block.
+
+A block starts from the offset requested by `VirtualMachine.eval_compiled`.
+Forward jumps are followed in the same function, and the target of a
+conditional one is translated into the body of an `if` statement, until
+`MAX_BLOCK_SIZE` instructions are translated. Other jumps leave the function
+with `f_lasti` set to their target, except that a jump back to the start of
+a block becomes a `while` loop in that function.
+
+Instructions which are not translated are executed by their operations in the
+quickened instruction stream (see `specialize.quicken`), after the values
+held in variables are pushed onto the value stack.
+
+Each line of generated source is mapped to the offset following the
+instruction it's translated from, and `f_lasti` is restored from this mapping
+when an exception is raised in a block.
+"""
+import keyword, math, sys
+
+from .closurecompiler import (
+    ClosureCompiler, CompiledCode, DEFAULT_THRESHOLD, _JUMPING_OPS
+)
+from .objects import UNBOUND
+from .objects.codeobject import get_instructions
+from .specialize import Site
+
+
+__all__ = ['CodeGenerator', 'GeneratedCode']
+
+
+# Number of calls of a code object before its source is generated
+DEFAULT_CODEGEN_THRESHOLD = 1000
+
+# Maximum number of instructions translated into a block, including those
+# translated again in branches.
+MAX_BLOCK_SIZE = 256
+
+# Operations which always return a reason (why)
+_LEAVING_OPS = {'RETURN_VALUE', 'RAISE_VARARGS'}
+
+# Returned by translators if a path of block is ended
+_END = object()
+
+CO_VARARGS = 0x0004
+CO_VARKEYWORDS = 0x0008
+
+_UNARY_OPERATORS = {
+    'POSITIVE': '+', 'NEGATIVE': '-', 'NOT': 'not ', 'INVERT': '~',
+}
+
+_BINARY_OPERATORS = {
+    'POWER': '**', 'MULTIPLY': '*', 'TRUE_DIVIDE': '/', 'FLOOR_DIVIDE': '//',
+    'MODULO': '%', 'ADD': '+', 'SUBTRACT': '-', 'LSHIFT': '<<',
+    'RSHIFT': '>>', 'AND': '&', 'XOR': '^', 'OR': '|',
+}
+
+# Operators of `COMPARE_OP` indexed by its argument, exception matching is
+# not translated.
+_COMPARE_OPERATORS = [
+    '<', '<=', '==', '!=', '>', '>=', 'in', 'not in', 'is', 'is not',
+]
+
+_EXHAUSTED = object()
+
+
+def _unbound_local(frame, index):
+    raise UnboundLocalError(
+        "local variable '%s' referenced before assignment"
+        % frame.f_code.co_varnames[index])
+
+def _load_global(frame, name):
+    """Load a name missing in globals, it's called by generated blocks."""
+    if name in frame.f_builtins:
+        return frame.f_builtins[name]
+    raise NameError("name '%s' is not defined" % name)
+
+def _load_name(frame, name):
+    """Load a name missing in locals, it's called by generated blocks."""
+    if name in frame.f_globals:
+        return frame.f_globals[name]
+    return _load_global(frame, name)
+
+def _map_exception(frame, line_offsets):
+    """Restore `f_lasti` of frame for the exception raised in a block."""
+    tb = sys.exc_info()[2]
+    offset = line_offsets.get(tb.tb_lineno)
+    if offset is not None:
+        frame.f_lasti = offset
+
+# Names available in all generated blocks
+_HELPERS = {
+    'UNBOUND': UNBOUND, 'VOID': _EXHAUSTED, 'next': next, 'iter': iter,
+    'unbound_local': _unbound_local, 'load_global': _load_global,
+    'load_name': _load_name,
+    'map_exception': _map_exception,
+}
+
+
+def _is_literal(value):
+    """Check whether a constant can be written in source as it is."""
+    if value is None or value is True or value is False:
+        return True
+    if value.__class__ is float:
+        return math.isfinite(value)
+    return value.__class__ in (int, str, bytes)
+
+
+def _leaves_block(instr):
+    """Check whether a block should be left after given instruction is
+    executed by its operation.
+    """
+    if instr.opname.startswith('SETUP_'):
+        return False
+    if instr.jump_target is not None:
+        return True
+    return instr.opname in _JUMPING_OPS or instr.opname in _LEAVING_OPS
+
+
+class _BlockGenerator(object):
+    """Generate the source of a block starting from given offset."""
+    def __init__(self, generated, start):
+        self.generated = generated
+        self.start = start
+        # Lines of body: (indentation, text, offset mapped for exceptions)
+        self.lines = []
+        # Expressions of values which are not pushed onto the value stack
+        self.stack = []
+        # Variables holding the slots of fast locals
+        self.cached = {}
+        self.bound = set(generated.bound_slots)
+        # Free variables of generated function: {id: (name, value)}
+        self.values = {}
+        self.ntemps = 0
+        self.budget = MAX_BLOCK_SIZE
+        self.depth = 0
+        self.loop = False
+        self.uses = set()
+        self.instr = None
+        # Last expression assigned to a temporary variable
+        self.last_expr = None
+
+    # --- Helpers for emitting source ---
+
+    def emit(self, text, indent=0, mapped=True, offset=None):
+        if offset is None and mapped:
+            offset = self.instr.next_offset
+        self.lines.append((self.depth + indent, text, offset))
+
+    def temp(self):
+        name = 't%d' % self.ntemps
+        self.ntemps += 1
+        return name
+
+    def bind(self, value, prefix):
+        key = id(value)
+        if key not in self.values:
+            self.values[key] = ('%s%d' % (prefix, len(self.values)), value)
+        return self.values[key][0]
+
+    def constant(self, value):
+        if not _is_literal(value):
+            return self.bind(value, 'c')
+        text = repr(value)
+        return '(%s)' % text if value.__class__ in (int, float) else text
+
+    def assign(self, expr):
+        """Assign an expression to a new temporary variable and push it."""
+        name = self.temp()
+        self.emit('%s = %s' % (name, expr))
+        self.last_expr = (name, expr, len(self.lines) - 1)
+        self.stack.append(name)
+
+    def ensure(self, n):
+        """Make sure there are `n` values in variables, the missing ones are
+        popped from the value stack.
+        """
+        missing = n - len(self.stack)
+        if missing <= 0:
+            return
+        self.uses.add('stack')
+        names = [self.temp() for _ in range(missing)]
+        if missing == 1:
+            self.emit('%s = stack.pop()' % names[0], mapped=False)
+        else:
+            self.emit('%s, = stack[-%d:]' % (', '.join(names), missing), mapped=False)
+            self.emit('del stack[-%d:]' % missing, mapped=False)
+        self.stack[:0] = names
+
+    def pop(self):
+        self.ensure(1)
+        return self.stack.pop()
+
+    def popn(self, n):
+        if n == 0:
+            return []
+        self.ensure(n)
+        values = self.stack[-n:]
+        del self.stack[-n:]
+        return values
+
+    def spill(self, values):
+        """Push values in variables onto the value stack."""
+        if not values:
+            return
+        self.uses.add('stack')
+        if len(values) == 1:
+            self.emit('stack.append(%s)' % values[0], mapped=False)
+        else:
+            self.emit('stack.extend((%s))' % ', '.join(values), mapped=False)
+
+    def flush(self):
+        self.spill(self.stack)
+        self.stack = []
+
+    def goto(self, target):
+        if target == self.start:
+            self.loop = True
+            self.emit('continue', mapped=False)
+        else:
+            self.emit('frame.f_lasti = %d' % target, mapped=False)
+            self.emit('return', mapped=False)
+
+    def branch(self, condition, target, values, offset=None, prologue=()):
+        """Jump to target with given values on the stack if condition is
+        true. Instructions from a forward target are translated into the
+        body of `if` statement.
+        """
+        self.emit('if %s:' % condition, offset=offset)
+        self.depth += 1
+        for line in prologue:
+            self.emit(line, mapped=False)
+        if target > self.instr.offset:
+            state = (self.stack, self.cached, self.bound, self.instr)
+            self.stack = list(values)
+            self.cached, self.bound = dict(self.cached), set(self.bound)
+            self.generate(target)
+            self.stack, self.cached, self.bound, self.instr = state
+        else:
+            self.spill(values)
+            self.goto(target)
+        self.depth -= 1
+
+    def fold_condition(self, value):
+        """Get the expression of value if it's assigned by the last line, and
+        remove that line. So that it can be tested directly, and exceptions
+        raised there are mapped to the offset of that expression.
+        """
+        if (self.last_expr is not None and self.last_expr[0] == value and
+            self.last_expr[2] == len(self.lines) - 1 and
+            value not in self.stack):
+            offset = self.lines.pop()[2]
+            return '(%s)' % self.last_expr[1], offset
+        return value, None
+
+    # --- Translation ---
+
+    def generate(self, offset=None):
+        """Translate instructions from given offset until the path is ended
+        by a jump or the budget of instructions runs out.
+        """
+        instructions = self.generated.instructions
+        offset = self.start if offset is None else offset
+        while (self.budget > 0 and offset < len(instructions) and
+               not self.is_exit(offset)):
+            self.budget -= 1
+            self.instr = instr = instructions[offset]
+            result = self.translate(instr)
+            if result is _END:
+                return
+            offset = instr.next_offset if result is None else result
+        self.flush()
+        self.goto(offset)
+
+    def is_exit(self, offset):
+        """Check whether the block should be left at given offset instead of
+        translating the instructions from there.
+        """
+        return False
+
+    def translate(self, instr):
+        """Translate an instruction. Returned value is `_END` if the path is
+        ended by it, an offset to continue from, or None for the next one.
+        """
+        name = instr.opname
+        prefix, _, operator = name.partition('_')
+        if prefix == 'UNARY' and operator in _UNARY_OPERATORS:
+            self.assign('%s%s' % (_UNARY_OPERATORS[operator], self.pop()))
+        elif prefix in ('BINARY', 'INPLACE') and operator in _BINARY_OPERATORS:
+            y = self.pop()
+            x = self.pop()
+            symbol = _BINARY_OPERATORS[operator]
+            if prefix == 'BINARY':
+                self.assign('%s %s %s' % (x, symbol, y))
+            else:
+                result = self.temp()
+                self.emit('%s = %s' % (result, x))
+                self.emit('%s %s= %s' % (result, symbol, y))
+                self.stack.append(result)
+        elif name == 'BINARY_SUBSCR':
+            y = self.pop()
+            self.assign('%s[%s]' % (self.pop(), y))
+        elif name == 'COMPARE_OP' and instr.arg < len(_COMPARE_OPERATORS):
+            y = self.pop()
+            x = self.pop()
+            self.assign('%s %s %s' % (x, _COMPARE_OPERATORS[instr.arg], y))
+        else:
+            translator = getattr(self, name, None)
+            result = NotImplemented if translator is None else translator(instr)
+            if result is NotImplemented:
+                return self.fallback(instr)
+            return result
+        return None
+
+    def fallback(self, instr):
+        """Execute an instruction by its operation."""
+        generated = self.generated
+        self.flush()
+        self.emit('frame.f_lasti = %d' % instr.next_offset, mapped=False)
+
+        entry = generated.table[instr.offset]
+        if entry is None or entry.next_offset != instr.next_offset:
+            # It's fused into a superinstruction
+            entry = instr
+        arguments = entry.arguments
+        if arguments and isinstance(arguments[0], Site):
+            call = '%s.run(frame)' % self.bind(arguments[0], 's')
+        else:
+            operation = generated.dispatch_table[entry.opcode]
+            call = '%s(frame%s)' % (self.bind(operation, 'op'), ''.join(
+                ', ' + self.constant(v) for v in arguments
+            ))
+        self.emit('why = %s' % call, mapped=False)
+        self.check_reason(instr)
+
+        # Slots of fast locals could be changed by operation
+        self.cached.clear()
+        if instr.opname == 'DELETE_FAST':
+            self.bound.discard(instr.arg)
+        if _leaves_block(instr):
+            self.emit('return', mapped=False)
+            return _END
+        return None
+
+    def check_reason(self, instr):
+        """Leave the block if the operation executed by `fallback` returns a
+        reason (why).
+        """
+        if instr.opname.startswith('CALL_'):
+            # Tracing could be enabled by callee
+            self.uses.add('tstate')
+            self.emit('if why or tstate.tracefunc is not None:', mapped=False)
+        else:
+            self.emit('if why:', mapped=False)
+        self.emit('return why', 1, mapped=False)
+
+    # Translators of instructions, their returned values are the same as
+    # `translate`, or `NotImplemented` if the instruction should be executed
+    # by its operation instead.
+
+    def NOP(self, instr):
+        pass
+
+    def POP_TOP(self, instr):
+        if self.stack:
+            self.stack.pop()
+        else:
+            self.uses.add('stack')
+            self.emit('del stack[-1]', mapped=False)
+
+    def ROT_TWO(self, instr):
+        self.ensure(2)
+        s = self.stack
+        s[-1], s[-2] = s[-2], s[-1]
+
+    def ROT_THREE(self, instr):
+        self.ensure(3)
+        s = self.stack
+        s[-1], s[-2], s[-3] = s[-2], s[-3], s[-1]
+
+    def ROT_FOUR(self, instr):
+        self.ensure(4)
+        s = self.stack
+        s[-1], s[-2], s[-3], s[-4] = s[-2], s[-3], s[-4], s[-1]
+
+    def DUP_TOP(self, instr):
+        self.ensure(1)
+        self.stack.append(self.stack[-1])
+
+    def DUP_TOP_TWO(self, instr):
+        self.ensure(2)
+        self.stack.extend(self.stack[-2:])
+
+    def LOAD_CONST(self, instr):
+        self.stack.append(self.constant(instr.argval))
+
+    def LOAD_FAST(self, instr):
+        index = instr.arg
+        if index not in self.cached:
+            name = self.cached[index] = 'l%d' % index
+            self.uses.add('fastlocals')
+            self.emit('%s = fastlocals[%d]' % (name, index), mapped=False)
+            if index not in self.bound:
+                self.emit('if %s is UNBOUND: unbound_local(frame, %d)' % (
+                    name, index
+                ))
+                self.bound.add(index)
+        self.stack.append(self.cached[index])
+
+    def STORE_FAST(self, instr):
+        index = instr.arg
+        value = self.pop()
+        name = 'l%d' % index
+        if name in self.stack:
+            # Keep the value loaded before for the entries of stack
+            temp = self.temp()
+            self.emit('%s = %s' % (temp, name), mapped=False)
+            self.stack = [temp if v == name else v for v in self.stack]
+        self.uses.add('fastlocals')
+        self.emit('fastlocals[%d] = %s = %s' % (index, name, value), mapped=False)
+        self.cached[index] = name
+        self.bound.add(index)
+
+    def LOAD_GLOBAL(self, instr):
+        name = self.temp()
+        self.uses.add('f_globals')
+        self.emit('try:', mapped=False)
+        self.emit('%s = f_globals[%r]' % (name, instr.argval), 1, mapped=False)
+        self.emit('except KeyError:', mapped=False)
+        self.emit('%s = load_global(frame, %r)' % (name, instr.argval), 1)
+        self.stack.append(name)
+
+    def LOAD_NAME(self, instr):
+        # Locals could be a mapping given by `__prepare__`, so that it's
+        # checked by `in` before loading as `ops.py` does.
+        name = self.temp()
+        self.uses.add('f_locals')
+        self.emit('if %r in f_locals:' % instr.argval, mapped=False)
+        self.emit('%s = f_locals[%r]' % (name, instr.argval), 1)
+        self.emit('else:', mapped=False)
+        self.emit('%s = load_name(frame, %r)' % (name, instr.argval), 1)
+        self.stack.append(name)
+
+    def STORE_NAME(self, instr):
+        self.uses.add('f_locals')
+        self.emit('f_locals[%r] = %s' % (instr.argval, self.pop()))
+
+    def LOAD_ATTR(self, instr):
+        if not _is_identifier(instr.argval):
+            return NotImplemented
+        self.assign('%s.%s' % (self.pop(), instr.argval))
+
+    def STORE_ATTR(self, instr):
+        if not _is_identifier(instr.argval):
+            return NotImplemented
+        obj = self.pop()
+        self.emit('%s.%s = %s' % (obj, instr.argval, self.pop()))
+
+    def STORE_SUBSCR(self, instr):
+        subscr = self.pop()
+        obj = self.pop()
+        self.emit('%s[%s] = %s' % (obj, subscr, self.pop()))
+
+    def BUILD_TUPLE(self, instr):
+        values = self.popn(instr.arg)
+        self.assign('(%s)' % ''.join(v + ', ' for v in values))
+
+    def BUILD_LIST(self, instr):
+        self.assign('[%s]' % ', '.join(self.popn(instr.arg)))
+
+    def GET_ITER(self, instr):
+        self.assign('iter(%s)' % self.pop())
+
+    def FOR_ITER(self, instr):
+        name = self.temp()
+        if self.stack:
+            iterator, values = self.stack[-1], self.stack[:-1]
+        else:
+            iterator, values = 'stack[-1]', None
+            self.uses.add('stack')
+        self.emit('%s = next(%s, VOID)' % (name, iterator))
+        if values is None:
+            self.branch('%s is VOID' % name, instr.jump_target, [],
+                        prologue=['del stack[-1]'])
+        else:
+            self.branch('%s is VOID' % name, instr.jump_target, values)
+        self.stack.append(name)
+
+    def JUMP_ABSOLUTE(self, instr):
+        target = instr.jump_target
+        if target > instr.offset:
+            return target
+        self.flush()
+        self.goto(target)
+        return _END
+
+    JUMP_FORWARD = JUMP_ABSOLUTE
+
+    def POP_JUMP_IF_FALSE(self, instr):
+        condition, offset = self.fold_condition(self.pop())
+        self.branch('not %s' % condition, instr.jump_target, self.stack, offset)
+
+    def POP_JUMP_IF_TRUE(self, instr):
+        condition, offset = self.fold_condition(self.pop())
+        self.branch(condition, instr.jump_target, self.stack, offset)
+
+    def JUMP_IF_FALSE_OR_POP(self, instr):
+        value = self.pop()
+        self.branch('not %s' % value, instr.jump_target, self.stack + [value])
+
+    def JUMP_IF_TRUE_OR_POP(self, instr):
+        value = self.pop()
+        self.branch(value, instr.jump_target, self.stack + [value])
+
+    # --- Assembling ---
+
+    def assemble(self):
+        """Get the source of a factory of the block, the free variables of
+        the block, and the mapping from lines to offsets.
+        """
+        free_names = sorted(_HELPERS) + ['line_offsets'] + [
+            name for name, _ in self.values.values()
+        ]
+        head = [
+            'def make_block(%s):' % ', '.join(free_names),
+            '    def block_%d(frame):' % self.start,
+        ]
+        for name, expr in [
+            ('stack', 'frame.stack'), ('fastlocals', 'frame.fastlocals'),
+            ('f_globals', 'frame.f_globals'), ('f_locals', 'frame._f_locals'),
+            ('tstate', 'frame.f_tstate'),
+        ]:
+            if name in self.uses:
+                head.append('        %s = %s' % (name, expr))
+        head.append('        try:')
+        if self.loop:
+            head.append('            while True:')
+        base = 4 if self.loop else 3
+
+        lines = list(head)
+        line_offsets = {}
+        for indent, text, offset in self.lines:
+            lines.append('    ' * (base + indent) + text)
+            if offset is not None:
+                line_offsets[len(lines)] = offset
+        lines.extend([
+            '        except BaseException:',
+            '            map_exception(frame, line_offsets)',
+            '            raise',
+            '    return block_%d' % self.start,
+        ])
+        values = [_HELPERS[name] for name in sorted(_HELPERS)] + [line_offsets]
+        values.extend(value for _, value in self.values.values())
+        return '\n'.join(lines) + '\n', values
+
+
+def _is_identifier(name):
+    return name.isidentifier() and not keyword.iskeyword(name)
+
+
+def _get_bound_slots(code, instructions):
+    """Get the slots of arguments, which are bound before executing a frame
+    and never deleted.
+    """
+    nargs = code.co_argcount + code.co_kwonlyargcount
+    nargs += bool(code.co_flags & CO_VARARGS)
+    nargs += bool(code.co_flags & CO_VARKEYWORDS)
+    deleted = {
+        instr.arg for instr in instructions
+        if instr is not None and instr.opname == 'DELETE_FAST'
+    }
+    return frozenset(range(nargs)) - deleted
+
+
+class GeneratedCode(CompiledCode):
+    """Blocks of a code object generated as Python source, indexed by the
+    offset they start from. Sources of generated blocks are kept in
+    `sources` for inspection.
+    """
+    def __init__(self, code, table, dispatch_table):
+        super(GeneratedCode, self).__init__(code, table, dispatch_table)
+        self.instructions = get_instructions(code)
+        self.bound_slots = _get_bound_slots(code, self.instructions)
+        self.filename = '<bytefall codegen: %s>' % code.co_name
+        self.sources = {}
+
+    def compile_block(self, offset):
+        generator = _BlockGenerator(self, offset)
+        generator.generate()
+        source, values = generator.assemble()
+        namespace = {}
+        exec(compile(source, self.filename, 'exec'), namespace)
+        self.sources[offset] = source
+        return namespace['make_block'](*values)
+
+
+class CodeGenerator(ClosureCompiler):
+    """Select hot code objects by counting their calls. They are compiled
+    into `blocks` after `threshold` calls (skipped if it's None), and their
+    sources are generated after `codegen_threshold` calls.
+    """
+    def __init__(self, vm, threshold=DEFAULT_THRESHOLD,
+                 codegen_threshold=DEFAULT_CODEGEN_THRESHOLD,
+                 blocks=CompiledCode):
+        super(CodeGenerator, self).__init__(vm, threshold, blocks)
+        self.codegen_threshold = codegen_threshold
+
+    def tier_up(self, code, state):
+        if state[0] > self.codegen_threshold:
+            state[:] = [None, self.compile_code(code)]
+        elif (state[1] is None and self.threshold is not None and
+              state[0] > self.threshold):
+            state[1] = self.compile_blocks(code)
+
+    def compile_code(self, code):
+        return GeneratedCode(
+            code, self.vm.get_instructions(code), self.vm.dispatch_table
+        )
@@ -30,6 +30,15 @@ class CLIConfig(BaseConfig):
         'debug': False,
         'show_oparg': False,
         'trace_opcode': False,
+        'recursion_limit': 1000,
+        'closure_tier': True,
+        'closure_threshold': 100,
+        'register_tier': True,
+        'codegen_tier': True,
+        'codegen_threshold': 1000,
+        'trace_jit': True,
+        'trace_threshold': 200,
+        'osr': True,
     }
     def __init__(self, cli_args=None):
         """
@@ -1,4 +1,5 @@
 from .cellobject import *
+from .codeobject import *
 from .frameobject import *
 from .funcobject import *
 from .generatorobject import *
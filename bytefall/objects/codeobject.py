@@ -0,0 +1,222 @@
+"""Decoded instruction streams of code objects.
+
+Bytecode of a code object is decoded once into a table of `Instruction`,
+which is indexed by the offset of each instruction in `co_code`. Entries
+of the table are `None` for those offsets which are not the beginning of
+an instruction (e.g. bytes of argument in Py34 format).
+
+`EXTENDED_ARG` is merged into the instruction following it while decoding,
+so that the merged instruction starts at the offset of its first prefix and
+there is no entry for `EXTENDED_ARG` itself.
+
+Line numbers are also precomputed from `co_lnotab` into a `LineTable`, so
+that looking up the line of an offset does not walk through `co_lnotab`.
+"""
+import dis
+from bisect import bisect_right
+from collections import namedtuple
+from sys import version_info
+
+from bytefall._internal.cache import CodeObjectCache
+
+
+__all__ = [
+    'Instruction', 'get_instructions', 'decode_instruction',
+    'decode_instruction_with_prefix', 'LineTable', 'get_line_table',
+]
+
+
+_Namedtuple_Instruction = namedtuple(
+    'Instruction',
+    'offset, opcode, opname, arg, argval, arguments, next_offset, jump_target'
+)
+
+class Instruction(_Namedtuple_Instruction):
+    """A decoded bytecode instruction.
+
+    - offset: start index of this instruction in `co_code`
+    - opcode, opname: numeric code and name of this operation
+    - arg: numeric argument of this operation, None if it takes no argument
+    - argval: resolved argument, e.g. constant, name or target of jump
+    - arguments: arguments to be passed to the implementation in `ops.py`
+    - next_offset: offset of the instruction right after this one
+    - jump_target: absolute offset to jump to, None if it is not a jump
+    """
+    __slots__ = ()
+
+
+# build a map for opcodes that defined in `dis.hasconst`, `dis.hasfree`, ...
+SPECIAL_COLLECTION = {v: getattr(dis, v) for v in dir(dis) if v[:3] == 'has'}
+SPECIAL_OPCODE = {}
+for name, values in SPECIAL_COLLECTION.items():
+    SPECIAL_OPCODE.update({v: name for v in values})
+
+COLLECTION_PROCESS = {
+    'hasconst': lambda code, int_arg, next_offset: code.co_consts[int_arg],
+    'hasfree': lambda code, int_arg, next_offset: (code.co_cellvars[int_arg]
+        if int_arg < len(code.co_cellvars) else
+        code.co_freevars[int_arg - len(code.co_cellvars)]),
+    'hasname': lambda code, int_arg, next_offset: code.co_names[int_arg],
+    'haslocal': lambda code, int_arg, next_offset: code.co_varnames[int_arg],
+    'hasjrel': lambda code, int_arg, next_offset: next_offset + int_arg,
+}
+
+
+# Number of bits to shift the argument of `EXTENDED_ARG`, it is changed
+# since Py36 because size of argument is reduced to 1 byte.
+EXTENDED_ARG_SHIFT = 16 if version_info < (3, 6) else 8
+
+if version_info < (3, 6):
+    def _read_opcode(co_code, offset):
+        """Read an instruction in the format of Py34 and Py35: 1 byte for
+        opcode, and 2 more bytes (little-endian) for argument if it has.
+        """
+        opcode = co_code[offset]
+        if opcode >= dis.HAVE_ARGUMENT:
+            int_arg = co_code[offset+1] + (co_code[offset+2] << 8)
+            return opcode, int_arg, offset + 3
+        return opcode, None, offset + 1
+else:
+    def _read_opcode(co_code, offset):
+        """Read an instruction in the format of wordcode (since Py36): 1 byte
+        for opcode and 1 byte for argument.
+        """
+        opcode, int_arg = co_code[offset:offset+2]
+        if opcode >= dis.HAVE_ARGUMENT:
+            return opcode, int_arg, offset + 2
+        return opcode, None, offset + 2
+
+
+def decode_instruction(code, offset, arg_offset=0):
+    """Decode the instruction starting at given offset of `code.co_code`."""
+    opcode, int_arg, next_offset = _read_opcode(code.co_code, offset)
+    if int_arg is None:
+        return Instruction(
+            offset, opcode, dis.opname[opcode], None, None, (), next_offset, None
+        )
+
+    int_arg |= arg_offset
+    collection_type = SPECIAL_OPCODE.get(opcode, None)
+    if collection_type and collection_type in COLLECTION_PROCESS:
+        arg = COLLECTION_PROCESS[collection_type](code, int_arg, next_offset)
+    else:
+        arg = int_arg
+
+    # Local variables are accessed by index of slot in frame, so that the
+    # raw argument is passed to operations instead of name of variable.
+    arguments = (int_arg,) if collection_type == 'haslocal' else (arg,)
+
+    if collection_type in ('hasjrel', 'hasjabs'):
+        jump_target = arg
+    else:
+        jump_target = None
+    return Instruction(
+        offset, opcode, dis.opname[opcode], int_arg, arg, arguments,
+        next_offset, jump_target
+    )
+
+
+def decode_instruction_with_prefix(code, offset):
+    """Decode the instruction starting at given offset, and merge the
+    arguments of all leading `EXTENDED_ARG` into it.
+    """
+    co_code = code.co_code
+    start, arg_offset = offset, 0
+    while co_code[offset] == dis.EXTENDED_ARG:
+        _, int_arg, offset = _read_opcode(co_code, offset)
+        arg_offset = (int_arg | arg_offset) << EXTENDED_ARG_SHIFT
+
+    instr = decode_instruction(code, offset, arg_offset)
+    if start != offset:
+        instr = instr._replace(offset=start)
+    return instr
+
+
+def _decode(code):
+    co_code = code.co_code
+    table = [None] * len(co_code)
+    offset = 0
+    while offset < len(co_code):
+        instr = decode_instruction_with_prefix(code, offset)
+        table[offset] = instr
+        offset = instr.next_offset
+    return tuple(table)
+
+
+_instructions_cache = CodeObjectCache()
+
+def get_instructions(code):
+    """Get the decoded instructions of a code object.
+
+    Returned value is a tuple indexed by offset of instruction, and it will
+    be built only at the first time a code object is requested.
+    """
+    table = _instructions_cache.get(code)
+    if table is None:
+        table = _decode(code)
+        _instructions_cache.set(code, table)
+    return table
+
+
+# Upper bound of the last line, `INT_MAX` is used in CPython.
+LAST_LINE_UPPER_BOUND = 32767
+
+class LineTable(object):
+    """Mapping from offset of instruction to line number, built from
+    `co_lnotab`. (see also cpython/Objects/lnotab_notes.txt)
+
+    Instructions are grouped into ranges, and each of them starts where the
+    line number changes. Looking up a range is done by bisection.
+    """
+    __slots__ = ['starts', 'lines']
+
+    def __init__(self, code):
+        # Since Py36, increments of line number are signed bytes.
+        signed = version_info >= (3, 6)
+        lnotab = code.co_lnotab
+        addr, line = 0, code.co_firstlineno
+        starts, lines = [0], [line]
+
+        for addr_incr, line_incr in zip(lnotab[::2], lnotab[1::2]):
+            if signed and line_incr >= 0x80:
+                line_incr -= 0x100
+            addr += addr_incr
+            line += line_incr
+            if line_incr == 0:
+                continue
+            if starts[-1] == addr:
+                lines[-1] = line
+            else:
+                starts.append(addr)
+                lines.append(line)
+
+        self.starts = tuple(starts)
+        self.lines = tuple(lines)
+
+    def lineno(self, offset):
+        """Get line number of the instruction at given offset.
+        (`codeobject.c::PyCode_Addr2Line`)
+        """
+        return self.lines[bisect_right(self.starts, offset) - 1]
+
+    def bounds(self, offset):
+        """Get line number and lower/upper bounds of offsets of instructions
+        in that line. (`codeobject.c::_PyCode_CheckLineNumber`)
+        """
+        i = bisect_right(self.starts, offset)
+        starts = self.starts
+        ub = starts[i] if i < len(starts) else LAST_LINE_UPPER_BOUND
+        return self.lines[i-1], starts[i-1], ub
+
+
+_line_table_cache = CodeObjectCache()
+
+def get_line_table(code):
+    """Get the line table of a code object, and it will be built only at the
+    first time a code object is requested.
+    """
+    table = _line_table_cache.get(code)
+    if table is None:
+        table = LineTable(code)
+        _line_table_cache.set(code, table)
+    return table
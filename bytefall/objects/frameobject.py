@@ -1,11 +1,25 @@
 from collections import namedtuple
 
 from .cellobject import make_cell
-from bytefall._internal.cache import GlobalCache
+from .codeobject import get_line_table
 from bytefall._internal.exceptions import VirtualMachineError
+from bytefall._internal.utils import get_vm
 
 
-__all__ = ['Block', 'Frame']
+__all__ = ['Block', 'Frame', 'UNBOUND']
+
+
+CO_OPTIMIZED = 0x0001
+
+
+class _Unbound(object):
+    """Marker of an unbound slot of local variable."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return '<unbound>'
+
+UNBOUND = _Unbound()
 
 
 _Namedtuple_Block = namedtuple('Block', 'type, handler, level')
@@ -15,12 +29,22 @@ class Block(_Namedtuple_Block):
 
 
 class Frame(object):
-    def __init__(self, f_code, f_globals, f_locals, f_closure, f_back):
+    def __init__(self, f_code, f_globals, f_locals, f_closure, f_back,
+        fastlocals=None):
         self.f_code = f_code
         self.f_globals = f_globals
-        self.f_locals = f_locals
         self.f_back = f_back
-        self.stack = []
+
+        # Value stack. Pushing and popping a single value are the most
+        # frequent operations on it, so that they are bound to the methods
+        # of list directly instead of being wrapped by methods of frame.
+        self.stack = stack = []
+        self.push = stack.append
+        self.pop = stack.pop
+
+        # State of the thread executing this frame, it is shared with the
+        # calling frame. (like `f_tstate` of frame object in CPython 2.x)
+        self.f_tstate = f_back.f_tstate if f_back else get_vm().tstate
 
         if f_back and f_back.f_globals is f_globals:
             # If we share the globals, we share the builtins.
@@ -32,11 +56,38 @@ class Frame(object):
 
         self._f_lineno = f_code.co_firstlineno
         self.f_lasti = 0
+        # Instructions could be rewritten by vm while running, so that they are
+        # requested from vm instead of being decoded from `f_code` directly.
+        self.instructions = self.f_tstate.interp.get_instructions(f_code)
+        # Blocks of closures executed instead if `f_code` is hot enough
+        self.compiled = self.f_tstate.interp.get_compiled(f_code)
+        # Array of registers used by the register-based tier, it's allocated
+        # by that tier after `fastlocals`. (see `registers.py`)
+        self.registers = None
+
+        # Local variables of a function are stored in slots indexed by their
+        # position in `co_varnames`, and `f_locals` is built from them only
+        # when it is requested. (like `f_localsplus` in CPython)
+        # Slots can be filled by caller already, e.g. `Function.__call__`.
+        if f_code.co_flags & CO_OPTIMIZED:
+            if fastlocals is None:
+                fastlocals = [
+                    f_locals.get(name, UNBOUND) for name in f_code.co_varnames
+                ]
+            self.fastlocals = fastlocals
+            self._f_locals = None
+        else:
+            self.fastlocals = None
+            self._f_locals = f_locals
 
         self.cells = {} if f_code.co_cellvars or f_code.co_freevars else None
-        for var in f_code.co_cellvars:
-            # Make a cell for the variable in our locals, or None.
-            self.cells[var] = make_cell(self.f_locals.get(var))
+        if f_code.co_cellvars:
+            if self.fastlocals is not None:
+                f_locals = dict(zip(f_code.co_varnames, self.fastlocals))
+            for var in f_code.co_cellvars:
+                # Make a cell for the variable in our locals, or None.
+                value = f_locals.get(var)
+                self.cells[var] = make_cell(None if value is UNBOUND else value)
 
         # https://github.com/python/cpython/blob/3.4/Python/ceval.c#L3570-L3574
         if f_code.co_freevars:
@@ -65,17 +116,61 @@ class Frame(object):
         else:
             delattr(self, name)
 
+    @property
+    def f_locals(self):
+        self.fast_to_locals()
+        return self._f_locals
+
+    @f_locals.setter
+    def f_locals(self, value):
+        self._f_locals = value
+
+    def fast_to_locals(self):
+        """Update `f_locals` with the values of local variables in slots.
+        (`frameobject.c::PyFrame_FastToLocals`)
+        """
+        if self.fastlocals is None:
+            return
+        if self._f_locals is None:
+            self._f_locals = {}
+
+        f_locals = self._f_locals
+        for name, value in zip(self.f_code.co_varnames, self.fastlocals):
+            if value is UNBOUND:
+                f_locals.pop(name, None)
+            else:
+                f_locals[name] = value
+
+        if self.cells:
+            for name, cell in self.cells.items():
+                try:
+                    f_locals[name] = cell.cell_contents
+                except ValueError:
+                    f_locals.pop(name, None)
+
+    def locals_to_fast(self):
+        """Write the values in `f_locals` back to slots of local variables.
+        (`frameobject.c::PyFrame_LocalsToFast`)
+        """
+        if self.fastlocals is None or self._f_locals is None:
+            return
+
+        f_locals = self._f_locals
+        for i, name in enumerate(self.f_code.co_varnames):
+            if name in f_locals:
+                self.fastlocals[i] = f_locals[name]
+
     def top(self):
         return self.stack[-1]
 
-    def push(self, *vals):
-        self.stack.extend(vals)
-
     def peek(self, i=0):
         return self.stack[-1-i]
 
-    def pop(self, i=0):
-        return self.stack.pop(-1-i)
+    def pushn(self, vals):
+        """Push a number of values onto the value stack, the first value
+        will be the deepest one.
+        """
+        self.stack.extend(vals)
 
     def popn(self, n):
         """Pop a number of values from the value stack.
@@ -83,8 +178,9 @@ class Frame(object):
         A list of `n` values is returned, the deepest value first.
         """
         if n:
-            ret = self.stack[-n:]
-            self.stack[-n:] = []
+            stack = self.stack
+            ret = stack[-n:]
+            del stack[-n:]
             return ret
         else:
             return []
@@ -100,17 +196,15 @@ class Frame(object):
         return self.block_stack.pop()
 
     def unwind_block(self, block):
-        while len(self.stack) > block.level:
-            self.pop()
+        del self.stack[block.level:]
 
     def unwind_except_handler(self, block):
-        while len(self.stack) > block.level + 3:
-            self.pop()
+        del self.stack[block.level + 3:]
         tb, value, exctype = self.popn(3)
-        # NOTE: 'new_exception' denotes the current exception hold by vm.
+        # NOTE: `new_exception` denotes the current exception hold by vm.
         # (like `tstate->exc_type` ... in CPython)
-        # 'last_exception' denotes the exception should be raised.
-        GlobalCache().set('new_exception', (exctype, value, tb))
+        # `last_exception` denotes the exception should be raised.
+        self.f_tstate.new_exception = (exctype, value, tb)
 
     def manage_block_stack(self, why):
         """ Manage a frame's block stack.
@@ -121,7 +215,7 @@ class Frame(object):
 
         block = self.block_stack[-1]
         if block.type == 'loop' and why == 'continue':
-            self.jump(GlobalCache().get('return_value'))
+            self.jump(self.f_tstate.return_value)
             why = None
             return why
 
@@ -143,24 +237,25 @@ class Frame(object):
             self.push_block('except-handler')
 
             # in CPython, we retrieve exception from tstate and push to stack here
-            exctype, value, tb = GlobalCache().get('new_exception', (type(None), None, None))
-            self.push(tb, value, exctype)
+            tstate = self.f_tstate
+            exctype, value, tb = tstate.new_exception
+            self.pushn((tb, value, exctype))
 
             # PyErr_NormalizeException goes here
 
-            # like `PyErr_Fetch`: get last_exception and clear it from GlobalCache
-            exctype, value, tb = GlobalCache().pop('last_exception', (type(None), None, None))
-            self.push(tb, value, exctype)
+            # like `PyErr_Fetch`: get last_exception and clear it from tstate
+            exctype, value, tb = tstate.fetch_exception()
+            self.pushn((tb, value, exctype))
 
             # in CPython, we update the exception in tstate with fetched one
-            GlobalCache().set('new_exception', (exctype, value, tb))
+            tstate.new_exception = (exctype, value, tb)
             why = None
             self.jump(block.handler)
             return why
 
         elif block.type == 'finally':
             if why in ('return', 'continue'):
-                self.push(GlobalCache().get('return_value'))
+                self.push(self.f_tstate.return_value)
             self.push(why)
 
             why = None
@@ -171,24 +266,5 @@ class Frame(object):
 
     @property
     def f_lineno(self):
-        lineno = _get_lineno(self)
-        self._f_lineno = lineno + self.f_code.co_firstlineno
+        self._f_lineno = get_line_table(self.f_code).lineno(self.f_lasti)
         return self._f_lineno
-
-
-def _get_lineno(frame):
-    """ Get current line number where the execution stopping.
-
-    See also cpython/Objects/lnotab_notes.txt for further details.
-    """
-    target = frame.f_lasti
-    lineno = addr = 0
-    lnotab = frame.f_code.co_lnotab
-    for addr_incr, line_incr in zip(lnotab[::2], lnotab[1::2]):
-        addr += addr_incr
-        if addr > target:
-            return lineno
-        if line_incr >= 0x80:
-            line_incr -= 0x100
-        lineno += line_incr
-    return lineno
@@ -1,18 +1,27 @@
-from .frameobject import Frame
+from types import CodeType
+from .frameobject import Frame, UNBOUND
 from .generatorobject import (
-    Generator, Coroutine, AsyncGenerator
+    Generator, IterableCoroutine, Coroutine, AsyncGenerator
 )
 from .methodobject import Method
 from bytefall._internal.utils import get_vm
 
 
-__all__ = ['Function']
+__all__ = ['Function', 'make_iterable_coroutine']
+
+
+CO_VARARGS = 0x0004
+CO_VARKEYWORDS = 0x0008
+CO_GENERATOR = 0x0020
+CO_COROUTINE = 0x0080
+CO_ITERABLE_COROUTINE = 0x0100
+CO_ASYNC_GENERATOR = 0x0200
 
 
 class Function(object):
     __slots__ = [
         '__name__', '__code__', '__globals__', '__defaults__', '__closure__',
-        '__dict__', '__doc__', '__annotations__', '__kwdefaults__',
+        '__dict__', '__doc__', '__annotations__', '__kwdefaults__', '_binder',
     ]
     def __init__(self, code, globs, name, defaults, closure):
         # NOTE: order of arguments is modified to fit the implementation of builtin
@@ -28,6 +37,7 @@ class Function(object):
         self.__doc__ = code.co_consts[0] if code.co_consts else None
         self.__annotations__ = {}
         self.__qualname__ = name
+        self._binder = None
 
     def __repr__(self):
         return '<Function %s at 0x%016X>' % (self.__qualname__, id(self))
@@ -37,74 +47,190 @@ class Function(object):
 
     def __call__(self, *args, **kwargs):
         code = self.__code__
-        argc = code.co_argcount
-        kwargc = code.co_kwonlyargcount
-        # posargc = code.co_posonlyargcount     # TODO: new in Py38
-
-        # NOTE: For both argc, function signature should be either:
-        #   ```def fn(x=1, y=2): ...```, where posargc is 2, kwargc is 0
-        #   ```def fn(*, x=1, y=2): ...```, where posargc is 0, kwargc is 2
-        #   It is impossible that both kwargc and posargc are not 0.
-        # assert kwargc ^ posargc == (kwargc + posargc), \
-        #     "at least one of `kwargc` or `posargc` should be 0"
-
-        varargs = 0 != (code.co_flags & 0x04)   # CO_VARARGS: 0x0004
-        varkws = 0 != (code.co_flags & 0x08)    # CO_VARKEYWORDS: 0x0008
-        params = code.co_varnames[:argc+kwargc+varargs+varkws]
-
-        defaults = self.__defaults__ if self.__defaults__ else ()
-        kwdefaults = self.__kwdefaults__
-        nrequired = -(len(defaults)+int(varkws)) if defaults else argc
-
-        f_locals = dict(zip(params[nrequired:], defaults))
-        f_locals.update(kwdefaults)
-        f_locals.update(dict(zip(params, args)))
-        if varargs:
-            # for the case: ```def foo(*args): ...```
-            f_locals[params[argc]] = args[argc:]
-        elif argc < len(args):
-            raise TypeError(
-                    '%s() takes %d positional arguments but %d %s given'
-                    % (self.__name__, argc,
-                       len(args), 'was' if len(args) == 1 else 'were')
-                )
-
-        if varkws:
-            # for the case: ```def foo(**kwargs): ... ```
-            f_locals[params[-1]] = varkw_dict = {}
-        for kw, value in kwargs.items():
-            if kw in params:
-                f_locals[kw] = value
-            elif varkws:
-                varkw_dict[kw] = value
-            else:
-                raise TypeError('%s() got an unexpected keyword argument %r'
-                                % (self.__name__, kw))
-
-        missing = [v for v in params[slice(0, nrequired)] if v not in f_locals]
-        if missing:
-            raise TypeError("%s() missing %d required positional argument%s: %s"
-                            % (code.co_name,
-                               len(missing), 's' if 1 < len(missing) else '',
-                               ', '.join(map(repr, missing))))
-
         vm = get_vm()
-        frame = Frame(code, self.__globals__, f_locals, self.__closure__, vm.frame)
+        frame = self.make_frame(args, kwargs, vm.frame)
 
         # handling generator
-        CO_GENERATOR = 0x0020
-        CO_COROUTINE = 0x0080
-        CO_ITERABLE_COROUTINE = 0x0100
-        CO_ASYNC_GENERATOR = 0x0200
-
-        if self.__code__.co_flags & (CO_GENERATOR | CO_COROUTINE | CO_ASYNC_GENERATOR):
-            gen = Generator(frame)
-            if self.__code__.co_flags & CO_COROUTINE:
+        if code.co_flags & (CO_GENERATOR | CO_COROUTINE | CO_ASYNC_GENERATOR):
+            if code.co_flags & CO_ITERABLE_COROUTINE:
+                gen = IterableCoroutine(frame)
+            else:
+                gen = Generator(frame)
+            if code.co_flags & CO_COROUTINE:
                 gen = Coroutine(gen)
-            elif self.__code__.co_flags & CO_ASYNC_GENERATOR:
+            elif code.co_flags & CO_ASYNC_GENERATOR:
                 gen = AsyncGenerator(gen)
             frame.generator = gen
             retval = gen
         else:
             retval = vm.run(frame)
         return retval
+
+    def make_frame(self, args, kwargs, f_back):
+        """Create a frame of this function with arguments bound."""
+        code = self.__code__
+
+        # Binder is built again only if `__code__` or `__defaults__` is changed.
+        binder = self._binder
+        if (binder is None or binder.code is not code or
+            binder.defaults is not self.__defaults__):
+            binder = self._binder = ArgumentBinder(code, self.__defaults__)
+        fastlocals = binder.bind(self, args, kwargs)
+
+        return Frame(
+            code, self.__globals__, None, self.__closure__, f_back, fastlocals
+        )
+
+
+def make_iterable_coroutine(func):
+    """Flag the code of a generator function with CO_ITERABLE_COROUTINE, as
+    `types.coroutine` does for native functions. It has to be done before
+    `func` is passed to that decorator (or `asyncio.coroutine`), which just
+    wraps objects other than native functions.
+    """
+    code = func.__code__
+    flags = code.co_flags
+    if not flags & CO_GENERATOR or flags & CO_ITERABLE_COROUTINE:
+        return
+    flags |= CO_ITERABLE_COROUTINE
+    if hasattr(code, 'replace'):
+        func.__code__ = code.replace(co_flags=flags)
+        return
+    func.__code__ = CodeType(
+        code.co_argcount, code.co_kwonlyargcount, code.co_nlocals,
+        code.co_stacksize, flags, code.co_code, code.co_consts,
+        code.co_names, code.co_varnames, code.co_filename, code.co_name,
+        code.co_firstlineno, code.co_lnotab, code.co_freevars,
+        code.co_cellvars,
+    )
+
+
+class ArgumentBinder(object):
+    """Plan to bind arguments of a call to slots of local variables, it is
+    built once for a combination of code object and defaults of function.
+
+    Layout of parameters in `co_varnames` is:
+    [positional, keyword-only, *args, **kwargs, other local variables]
+
+    Slots of parameters with default value are filled in a template, so that
+    a call with positional arguments only is done by copying the template
+    and assigning arguments to it. Other calls go through `bind_general()`.
+    """
+    __slots__ = [
+        'code', 'defaults', 'template', 'argcount', 'nrequired', 'kwonly',
+        'varargs', 'varkws', 'index', 'simple',
+    ]
+
+    def __init__(self, code, defaults):
+        self.code = code
+        self.defaults = defaults
+
+        defaults = defaults if defaults else ()
+        argcount = code.co_argcount
+        total = argcount + code.co_kwonlyargcount
+        posonlyargcount = getattr(code, 'co_posonlyargcount', 0)
+
+        self.argcount = argcount
+        self.nrequired = argcount - len(defaults)
+        self.kwonly = code.co_varnames[argcount:total]
+
+        # Index of slot of `*args` and `**kwargs`, None if it does not exist
+        self.varargs = total if code.co_flags & CO_VARARGS else None
+        self.varkws = (
+            total + (self.varargs is not None)
+            if code.co_flags & CO_VARKEYWORDS else None
+        )
+
+        # Index of slots for parameters which can be passed by keyword
+        self.index = {
+            name: i for i, name in enumerate(code.co_varnames[:total])
+            if i >= posonlyargcount
+        }
+        self.simple = total == argcount and not (
+            code.co_flags & (CO_VARARGS | CO_VARKEYWORDS)
+        )
+
+        self.template = [UNBOUND] * len(code.co_varnames)
+        self.template[self.nrequired:argcount] = defaults
+
+    def bind(self, func, args, kwargs):
+        """Get slots of local variables with arguments bound."""
+        if self.simple and not kwargs:
+            if self.nrequired <= len(args) <= self.argcount:
+                fastlocals = self.template[:]
+                fastlocals[:len(args)] = args
+                return fastlocals
+        return self.bind_general(func, args, kwargs)
+
+    def bind_general(self, func, args, kwargs):
+        """Bind arguments for all kinds of signatures, and check the errors of
+        calling. (`ceval.c::_PyEval_EvalCodeWithName`)
+        """
+        fastlocals = self.template[:]
+        argcount = self.argcount
+        nargs = len(args)
+
+        if nargs > argcount:
+            if self.varargs is None:
+                raise TypeError(
+                    '%s() takes %d positional arguments but %d %s given'
+                    % (func.__name__, argcount,
+                       nargs, 'was' if nargs == 1 else 'were')
+                )
+            fastlocals[:argcount] = args[:argcount]
+            fastlocals[self.varargs] = tuple(args[argcount:])
+            nargs = argcount
+        else:
+            fastlocals[:nargs] = args
+            if self.varargs is not None:
+                fastlocals[self.varargs] = ()
+
+        if self.varkws is not None:
+            varkw_dict = fastlocals[self.varkws] = {}
+        if kwargs:
+            index = self.index
+            for kw, value in kwargs.items():
+                i = index.get(kw)
+                if i is None:
+                    if self.varkws is None:
+                        raise TypeError(
+                            '%s() got an unexpected keyword argument %r'
+                            % (func.__name__, kw))
+                    varkw_dict[kw] = value
+                elif i < nargs:
+                    raise TypeError(
+                        '%s() got multiple values for argument %r'
+                        % (func.__name__, kw))
+                else:
+                    fastlocals[i] = value
+
+        if nargs < self.nrequired:
+            missing = [
+                name for name, value in zip(
+                    self.code.co_varnames[nargs:self.nrequired],
+                    fastlocals[nargs:self.nrequired]
+                ) if value is UNBOUND
+            ]
+            if missing:
+                raise TypeError(
+                    '%s() missing %d required positional argument%s: %s'
+                    % (self.code.co_name,
+                       len(missing), 's' if 1 < len(missing) else '',
+                       ', '.join(map(repr, missing))))
+
+        if self.kwonly:
+            kwdefaults = func.__kwdefaults__ or {}
+            missing = []
+            for i, name in enumerate(self.kwonly, argcount):
+                if fastlocals[i] is UNBOUND:
+                    if name in kwdefaults:
+                        fastlocals[i] = kwdefaults[name]
+                    else:
+                        missing.append(name)
+            if missing:
+                raise TypeError(
+                    '%s() missing %d required keyword-only argument%s: %s'
+                    % (self.code.co_name,
+                       len(missing), 's' if 1 < len(missing) else '',
+                       ', '.join(map(repr, missing))))
+        return fastlocals
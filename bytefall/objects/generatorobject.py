@@ -1,28 +1,30 @@
-import dis, functools, inspect, six, sys, traceback, types, warnings
+import inspect, six, sys, traceback, types, warnings
 from asyncio import futures
 from asyncio.coroutines import _DEBUG
 from asyncio.coroutines import CoroWrapper as _CoroWrapper
 
-# NOTE: in Py37, `collections.abc.Coroutine` and `collections.abc.Awaitable`
-# are import directly. To keep the same implementation for Python > 3.4, we
-# use the try-except block to handle this (which is same as the impl. in
-# module `asyncio.coroutines` for Python 3.4 ~ 3.6)
+# NOTE: in Py37, `collections.abc.Coroutine` is import directly. To keep the
+# same implementation for Python > 3.4, we use the try-except block to handle
+# this (which is same as the impl. in module `asyncio.coroutines` for Python
+# 3.4 ~ 3.6)
 try:
-    from collections.abc import Awaitable as _AwaitableABC
+    from collections.abc import Coroutine as _CoroutineABC
 except ImportError:
-    _AwaitableABC = None
+    _CoroutineABC = None
 
-_is_coroutine = object()
-
-
-from bytefall._internal.cache import GlobalCache
-from bytefall._internal.utils import get_vm
+# NOTE: `_get_running_loop` is available since Py35.3, event loop is not
+# checked for debug mode before that.
+try:
+    from asyncio.events import _get_running_loop
+except ImportError:
+    def _get_running_loop():
+        return None
 
 
 __all__ = [
-    'Generator', 'Coroutine', 'AsyncGenerator', 'AIterWrapper',
-    'AsyncGenWrappedValue', '_gen_yf', '_coro_get_awaitable_iter',
-    'coroutine',
+    'Generator', 'IterableCoroutine', 'Coroutine', 'CoroutineWrapper', 'AsyncGenerator',
+    'AsyncGenASend', 'AIterWrapper', '_gen_yf', '_gen_set_yf',
+    '_coro_get_awaitable_iter',
 ]
 
 
@@ -34,6 +36,14 @@ class Generator(object):
         self.gi_yieldfrom = None       # added in py35
         self._finished = False         # for internal use only
 
+        # Generator delegated by this one through `yield from` (or `await`)
+        # and the one delegating to this, they are linked by `_gen_set_yf`.
+        # `_innermost` is the last delegate found in the chain starting from
+        # this generator, see also `_gen_send_delegated`.
+        self._delegate = None
+        self._delegator = None
+        self._innermost = None
+
     def __iter__(self):
         return self
 
@@ -55,8 +65,7 @@ class Generator(object):
         if self.gi_frame is None or self._finished:
             return
         if self.gi_code and gen_is_coroutine(self) and self.gi_frame.f_lasti == 0:
-            last_exception = GlobalCache().get('last_exception', None)
-            if last_exception is None:
+            if self.gi_frame.f_tstate.last_exception is None:
                 warnings.warn(
                     "coroutine '%s' was never awaited" % self.gi_code.co_name,
                     RuntimeWarning
@@ -66,6 +75,16 @@ class Generator(object):
             pass
 
 
+
+class IterableCoroutine(Generator):
+    """Generator whose code is flagged with CO_ITERABLE_COROUTINE, i.e. it is
+    created by a function decorated by `types.coroutine`. It can be awaited
+    by wrappers of host (e.g. the one made by `asyncio.coroutine`), which
+    recognize native ones by the flag instead.
+    """
+    def __await__(self):
+        return self
+
 def match_exception(x, y):
     if not inspect.isclass(inspect):
         _cls = type(x)
@@ -75,24 +94,93 @@ def match_exception(x, y):
 
 
 def _gen_yf(gen):
-    """Get another generator object.
+    """Get the object delegated by given generator through `yield from` (or
+    `await`), it's None if the generator is not suspended in `YIELD_FROM`.
 
     Corresponding impl.:
     https://github.com/python/cpython/blob/3.5/Objects/genobject.c#L272-L289
     """
-    yf = None
-    f = gen.gi_frame
+    if not isinstance(gen, Generator):
+        gen = gen.gen
+    return gen.gi_yieldfrom
+
+
+def _gen_set_yf(gen, yf):
+    """Set the object delegated by given generator (or the coroutine and async
+    generator wrapping it) through `yield from`, None to clear it.
+
+    If the delegate is also run by virtual machine, both generators are
+    linked, so that values sent to the delegating one can be forwarded to the
+    delegate directly.
+    """
+    if not isinstance(gen, Generator):
+        gen = gen.gen
+    delegate = gen._delegate
+    if delegate is not None:
+        delegate._delegator = None
+        gen._delegate = None
+    gen.gi_yieldfrom = yf
+    if isinstance(yf, Coroutine):
+        yf = yf.gen
+    if isinstance(yf, Generator):
+        yf._delegator = gen
+        gen._delegate = yf
+
+
+class _DelegateResult(object):
+    """Result of a finished delegate, which is put in place of the delegate
+    on the value stack of its delegating frame. `YIELD_FROM` gets the returned
+    value (or the raised exception) from it as from an exhausted iterator.
+    """
+    __slots__ = ['value', 'exc']
+
+    def __init__(self, value=None, exc=None):
+        self.value = value
+        self.exc = exc
+
+    def __next__(self):
+        if self.exc is not None:
+            raise self.exc
+        raise StopIteration(self.value)
+
+
+def _gen_send_delegated(gen, value):
+    """Send a value to the innermost generator delegated by given one through
+    a chain of `yield from` (or `await`), rather than resuming every frame in
+    that chain with `YIELD_FROM`.
+
+    Frames in the chain are resumed only when their delegate finishes, so
+    that the cost of a value passing through is not proportional to the
+    depth of chain.
+    """
+    leaf = gen._innermost
+    if leaf is None or leaf._finished or leaf._delegator is None:
+        leaf = gen
+    while leaf._delegate is not None:
+        leaf = leaf._delegate
+    gen._innermost = leaf
+
+    while leaf is not gen:
+        # NOTE: only the outermost generator of the chain is marked as running
+        # here, sending to the others is rejected by the innermost one.
+        gen.gi_running = True
+        try:
+            return gen_send_ex(leaf, value)
+        except StopIteration as e:
+            result = _DelegateResult(value=e.value)
+        except BaseException as e:
+            result = _DelegateResult(exc=e)
+        finally:
+            gen.gi_running = False
 
-    # XXX: `f_lasti` might exceed the length of `f_code.co_code` here, but it
-    # seems not a possible case in CPython implementation. Maybe we have to
-    # recheck it.
-    if f and f.f_lasti < len(f.f_code.co_code):
-        byte_code = f.f_code.co_code
-        op = byte_code[f.f_lasti]
-        if op != dis.opmap['YIELD_FROM']:
-            return None
-        yf = f.top()
-    return yf
+        # Resume the delegating frame with the result of its delegate, it
+        # continues from `YIELD_FROM` as the delegate is exhausted.
+        parent = leaf._delegator
+        _gen_set_yf(parent, None)
+        parent.gi_frame.stack[-1] = result
+        gen._innermost = leaf = parent
+        value = None
+    return gen_send_ex(gen, value)
 
 
 def gen_send_ex(gen, value=None, exc=None):
@@ -101,18 +189,29 @@ def gen_send_ex(gen, value=None, exc=None):
         raise ValueError('generator already executing')
     if gen._finished:
         raise StopIteration
-    if gen.gi_frame.f_lasti == 0 and value is not None:
+    if gen.gi_yieldfrom is not None:
+        if exc is not None:
+            # Frame leaves `YIELD_FROM` with the exception
+            _gen_set_yf(gen, None)
+        elif (gen._delegate is not None and
+              gen.gi_frame.f_tstate.tracefunc is None):
+            # Frames of the chain are skipped, so it's not taken while
+            # tracing to keep their 'call' and 'return' events.
+            return _gen_send_delegated(gen, value)
+    frame = gen.gi_frame
+    if frame.f_lasti == 0 and value is not None:
         raise TypeError("Can't send non-None value to a just-started generator")
-    gen.gi_frame.stack.append(value)
+    frame.stack.append(value)
 
     # Run frame and get returned value instantly, and `gi_running` is True
     # only in this duration.
     # https://github.com/python/cpython/blob/3.5/Objects/genobject.c#L140-L142
+    # The virtual machine running this frame is taken from its thread state
+    # rather than `get_vm()`, which is looked up by version for every call.
     gen.gi_running = True
     val = None
-    vm = get_vm()
     try:
-        val = vm.resume_frame(gen.gi_frame, exc=exc)
+        val = frame.f_tstate.interp.resume_generator(frame, exc=exc)
     finally:
         gen.gi_running = False
 
@@ -171,11 +270,12 @@ def gen_throw(gen, exctype, val=None, tb=None):
             val = None
             ret = gen.gi_frame.pop()
             assert ret == yf
+            _gen_set_yf(gen, None)
             gen.gi_frame.f_lasti += 1
             ret = gen.send(val)
         return ret
     else:
-        GlobalCache().set('last_exception', (exctype, val, tb))
+        gen.gi_frame.f_tstate.last_exception = (exctype, val, tb)
         try:
             val = gen.send(None, exc=exctype)
         finally:
@@ -199,7 +299,7 @@ def gen_close(gen):
             err = gen_close_iter(yf)
             gen.gi_running = False
         if err == 0:
-            GlobalCache().set('last_exception', (GeneratorExit, None, None))
+            gen.gi_frame.f_tstate.last_exception = (GeneratorExit, None, None)
             exc = GeneratorExit
 
         retval = gen.send(None, exc=exc)
@@ -274,6 +374,9 @@ def _coro_get_awaitable_iter(o):
     if isinstance(o, (Coroutine, CoroWrapper)) or gen_is_iterable_coroutine(o):
         return o
 
+    if isinstance(o, Generator):
+        raise TypeError("object generator can't be used in 'await' expression")
+
     if hasattr(o, '__await__'):
         res = o.__await__()
         if res:
@@ -294,60 +397,6 @@ def _coro_get_awaitable_iter(o):
         )
 
 
-def isfuture(obj):
-    return (hasattr(obj.__class__, '_asyncio_future_blocking') and
-            obj._asyncio_future_blocking is not None)
-
-
-def coroutine(func):
-    """A decorator to mark coroutines, and this implementation is modified
-    from `asyncio.coroutines.coroutine`.
-
-    The reason why this should be done is that the implementation of
-    `asyncio.coroutine` relies on native types and functions (e.g.
-    types.GeneratorType, inspect.isgeneratorfunction, ...). However, some
-    of those native types and functions are re-implemented by us to run in
-    virtual machine. Therefore, this should be used to replace the original
-    one to make `@asyncio.coroutine` work.
-    """
-    # Return directly if given function is a coroutine.
-    if func.__code__.co_flags & 0x0080:
-        return func
-
-    if isinstance(func, Generator):
-        coro = func
-    else:
-        @functools.wraps(func)
-        def coro(*args, **kw):
-            res = func(*args, **kw)
-            if isfuture(res) or isinstance(res, (Generator, CoroWrapper)):
-                res = yield from res
-            elif _AwaitableABC is not None:
-                try:
-                    await_meth = res.__await__
-                except AttributeError:
-                    pass
-                else:
-                    if isinstance(res, _AwaitableABC):
-                        res = yield from await_meth()
-            return res
-
-    if not _DEBUG:
-        wrapper = coro
-    else:
-        @functools.wraps(func)
-        def wrapper(*args, **kwds):
-            w = CoroWrapper(coro(*args, **kwds), func=func)
-            if w._source_traceback:
-                del w._source_traceback[-1]
-            w.__name__ = getattr(func, '__name__', None)
-            w.__qualname__ = getattr(func, '__qualname__', None)
-            return w
-
-    wrapper._is_coroutine = _is_coroutine  # For iscoroutinefunction().
-    return wrapper
-
-
 class Coroutine(object):
     """Coroutine. (PyCoroObject)
 
@@ -361,9 +410,13 @@ class Coroutine(object):
         self.cr_code = self.gen.gi_code
 
     def __await__(self):
-        cw = CoroWrapper(self.gen)
-        cw.cw_coroutine = self
-        return cw
+        # Stack is captured by `CoroWrapper` for the source traceback, which
+        # is shown by asyncio only in debug mode.
+        if _in_debug_mode():
+            cw = CoroWrapper(self.gen)
+            cw.cw_coroutine = self
+            return cw
+        return CoroutineWrapper(self)
 
     @property
     def cr_await(self):
@@ -387,6 +440,49 @@ class Coroutine(object):
         gen_close(self.gen)
 
 
+# Make coroutines accepted by `asyncio.iscoroutine()` (and then `Task`) as
+# native ones without checking their methods.
+if _CoroutineABC is not None:
+    _CoroutineABC.register(Coroutine)
+
+
+class CoroutineWrapper(object):
+    """Iterator returned by `Coroutine.__await__`. (PyCoroWrapper)
+
+    Corresponding impl.:
+    https://github.com/python/cpython/blob/3.6/Objects/genobject.c#L1049-L1146
+    """
+    __slots__ = ['cw_coroutine']
+
+    def __init__(self, coro):
+        self.cw_coroutine = coro
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return gen_send_ex(self.cw_coroutine.gen)
+
+    def send(self, value=None):
+        return gen_send_ex(self.cw_coroutine.gen, value)
+
+    def throw(self, exctype, val=None, tb=None):
+        return gen_throw(self.cw_coroutine.gen, exctype, val=val, tb=tb)
+
+    def close(self):
+        gen_close(self.cw_coroutine.gen)
+
+
+def _in_debug_mode():
+    """Check whether asyncio is running in debug mode, which is enabled by
+    environment (`PYTHONASYNCIODEBUG`, `-X dev`) or by the running event loop.
+    """
+    if _DEBUG:
+        return True
+    loop = _get_running_loop()
+    return loop is not None and loop.get_debug()
+
+
 from enum import Enum
 class AwaitableState(Enum):
     AWAITABLE_STATE_INIT = 0
@@ -394,6 +490,12 @@ class AwaitableState(Enum):
     AWAITABLE_STATE_CLOSED = 3
 del Enum
 
+# Members are looked up by the metaclass of `Enum`, bind them for the
+# awaitables used by every iteration of `async for`.
+_AWAITABLE_STATE_INIT = AwaitableState.AWAITABLE_STATE_INIT
+_AWAITABLE_STATE_ITER = AwaitableState.AWAITABLE_STATE_ITER
+_AWAITABLE_STATE_CLOSED = AwaitableState.AWAITABLE_STATE_CLOSED
+
 
 class AsyncGenerator(object):
     """Async generator. (PyAsyncGenObject)
@@ -410,12 +512,32 @@ class AsyncGenerator(object):
         self.ag_running = self.gen.gi_running
         self.ag_closed = False
 
+        # Whether the value got from `gen` is yielded by this generator rather
+        # than passed through by `await`, it's set by `YIELD_VALUE`. (values
+        # are wrapped by `_PyAsyncGenWrappedValue` in CPython instead)
+        self._yielded = False
+        # Awaitable reused by `GET_ANEXT` for every iteration of `async for`
+        self._asend = None
+
     def __aiter__(self):
         return self
 
     def __anext__(self):
         return AsyncGenASend(self, None)
 
+    def _anext(self):
+        """Get the awaitable of `__anext__()` for `async for` loop in virtual
+        machine, the one of the previous iteration is reset and returned if it
+        is finished already.
+        """
+        asend = self._asend
+        if asend is None or asend.ags_state is not _AWAITABLE_STATE_CLOSED:
+            asend = self._asend = AsyncGenASend(self, None)
+        else:
+            asend.ags_state = _AWAITABLE_STATE_INIT
+            asend.ags_sendval = None
+        return asend
+
     @property
     def ag_await(self):
         return _gen_yf(self)
@@ -449,7 +571,7 @@ class AsyncGenASend(object):
     """
     def __init__(self, gen, sendval):
         self.ags_gen = gen
-        self.ags_state = AwaitableState.AWAITABLE_STATE_INIT
+        self.ags_state = _AWAITABLE_STATE_INIT
         self.ags_sendval = sendval
 
     def __next__(self):
@@ -462,47 +584,55 @@ class AsyncGenASend(object):
         return self
 
     def send(self, value=None):
-        gen = self.ags_gen.gen
-        if self.ags_state == AwaitableState.AWAITABLE_STATE_CLOSED:
+        yielded, result = self._send(value)
+        if yielded:
+            raise StopIteration(result)
+        return result
+
+    def _send(self, value):
+        """Resume the async generator with given value, and get a pair of
+        whether the returned value is yielded by it and that value. Unlike
+        `send()`, StopIteration is not raised for the yielded value.
+        """
+        gen = self.ags_gen
+        state = self.ags_state
+        if state is _AWAITABLE_STATE_CLOSED:
             raise StopIteration(None)
-        if self.ags_state == AwaitableState.AWAITABLE_STATE_INIT:
+        if state is _AWAITABLE_STATE_INIT:
             if value is None:
                 value = self.ags_sendval
-            self.ags_state = AwaitableState.AWAITABLE_STATE_ITER
+            self.ags_state = _AWAITABLE_STATE_ITER
 
-        result, exc = None, None
         try:
-            result = gen_send_ex(gen, value)
-        except (Exception, BaseException) as e:
-            exc = e
-
-        try:
-            result = async_gen_unwrap_value(gen, result, exc=exc)
-        finally:
-            if result is None:
-                self.ags_state = AwaitableState.AWAITABLE_STATE_CLOSED
-        return result
+            result = gen_send_ex(gen.gen, value)
+        except BaseException as e:
+            self.ags_state = _AWAITABLE_STATE_CLOSED
+            async_gen_unwrap_value(gen, None, exc=e)
+        if gen._yielded:
+            gen._yielded = False
+            self.ags_state = _AWAITABLE_STATE_CLOSED
+            return True, result
+        return False, result
 
     def throw(self, *args, **kwargs):
-        gen = self.ags_gen.gen
-        if self.ags_state == AwaitableState.AWAITABLE_STATE_CLOSED:
+        gen = self.ags_gen
+        if self.ags_state is _AWAITABLE_STATE_CLOSED:
             raise StopIteration(None)
 
         result, exc = None, None
         try:
-            result = gen_throw(gen, *args, **kwargs)
-        except (Exception, BaseException) as e:
+            result = gen_throw(gen.gen, *args, **kwargs)
+        except BaseException as e:
             exc = e
 
         try:
-            result = async_gen_unwrap_value(gen, result, exc=exc)
-        finally:
-            if result is None:
-                self.ags_state = AwaitableState.AWAITABLE_STATE_CLOSED
-        return None
+            return async_gen_unwrap_value(gen, result, exc=exc)
+        except BaseException:
+            self.ags_state = _AWAITABLE_STATE_CLOSED
+            raise
 
     def close(self):
-        self.ags_state = AwaitableState.AWAITABLE_STATE_CLOSED
+        self.ags_state = _AWAITABLE_STATE_CLOSED
 
 
 class AsyncGenAThrow(object):
@@ -545,7 +675,7 @@ class AsyncGenAThrow(object):
             if self.agt_args is None:
                 self.agt_gen.ag_closed = True
                 retval = gen_throw(gen, GeneratorExit)
-                if retval is not None and isinstance(retval, AsyncGenWrappedValue):
+                if _async_gen_yielded(self.agt_gen):
                     raise RuntimeError('async generator ignored GeneratorExit')
             else:
                 retval = None
@@ -574,7 +704,7 @@ class AsyncGenAThrow(object):
         if self.agt_args:
             return async_gen_unwrap_value(self.agt_gen, retval)
         else:
-            if retval is not None and isinstance(retval, AsyncGenWrappedValue):
+            if _async_gen_yielded(self.agt_gen):
                 raise RuntimeError('async generator ignored GeneratorExit')
             return retval
 
@@ -588,7 +718,7 @@ class AsyncGenAThrow(object):
         if self.agt_args:
             return async_gen_unwrap_value(self.agt_gen, retval)
         else:
-            if isinstance(retval, AsyncGenWrappedValue):
+            if _async_gen_yielded(self.agt_gen):
                 raise RuntimeError('async generator ignored GeneratorExit')
             return retval
 
@@ -596,18 +726,6 @@ class AsyncGenAThrow(object):
         self.agt_state = AwaitableState.AWAITABLE_STATE_CLOSED
 
 
-class AsyncGenWrappedValue(object):
-    """Async generator value wrapper. (_PyAsyncGenWrappedValue)
-    A wrapper used to wrap value which is directly yielded. (related to bytecode
-    operation `YIELD_VALUE`)
-
-    Corresponding impl.:
-    https://github.com/python/cpython/blob/3.6/Objects/genobject.c#L1764-L1829
-    """
-    def __init__(self, value):
-        self.agw_val = value
-
-
 class AIterWrapper(object):
     """An __aiter__ wrapper.
 
@@ -620,11 +738,29 @@ class AIterWrapper(object):
         raise StopIteration(self.ags_aiter)
 
 
+def _async_gen_yielded(gen):
+    """Check whether the value got from given async generator is yielded by
+    it, and clear that state.
+    """
+    yielded, gen._yielded = gen._yielded, False
+    return yielded
+
+
 def async_gen_unwrap_value(gen, result, exc=None):
-    if result is None:
+    """Get the value passed through by given async generator, or raise a
+    StopIteration with the value yielded by it. `exc` is the exception raised
+    while resuming it, which is raised instead.
+
+    Corresponding impl.:
+    https://github.com/python/cpython/blob/3.6/Objects/genobject.c#L1520-L1544
+    """
+    if exc is not None:
+        if isinstance(exc, StopIteration):
+            # Generator of async generator returns
+            exc = StopAsyncIteration()
         if isinstance(exc, (StopAsyncIteration, GeneratorExit)):
             gen.ag_closed = True
-        raise StopAsyncIteration(None)
-    if isinstance(result, AsyncGenWrappedValue):
-        raise StopIteration(result.agw_val)
+        raise exc
+    if _async_gen_yielded(gen):
+        raise StopIteration(result)
     return result
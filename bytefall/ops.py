@@ -4,16 +4,18 @@ Bytecode operations.
 
 from __future__ import print_function, division
 import dis, operator
+from asyncio import coroutine as asyncio_coroutine
 from inspect import isclass as inspect_isclass
+from types import coroutine as types_coroutine
 
-from .objects import CellType, make_cell, Frame, Function
+from .objects import CellType, make_cell, Frame, Function, Method, UNBOUND
+from .objects.funcobject import make_iterable_coroutine
 from .objects.generatorobject import (
-    Generator, Coroutine, AsyncGenerator, AIterWrapper, AsyncGenWrappedValue,
-    _gen_yf, _coro_get_awaitable_iter, coroutine
+    Generator, Coroutine, AsyncGenerator, AIterWrapper,
+    _gen_yf, _gen_set_yf, _coro_get_awaitable_iter
 )
 
 from ._internal.exceptions import VirtualMachineError
-from ._internal.cache import GlobalCache
 from ._internal.utils import get_vm
 
 # TODO: merge these two modules
@@ -139,38 +141,26 @@ class Operation(metaclass=OperationClass):
         frame.pop()
 
     def ROT_TWO(frame):
-        a, b = frame.popn(2)
-        frame.push(b, a)
+        stack = frame.stack
+        stack[-1], stack[-2] = stack[-2], stack[-1]
 
     def ROT_THREE(frame):
-        a, b, c = frame.popn(3)
-        frame.push(b, c, a)
+        stack = frame.stack
+        stack[-1], stack[-2], stack[-3] = stack[-2], stack[-3], stack[-1]
 
     def DUP_TOP(frame):
-        frame.push(frame.top())
+        frame.push(frame.stack[-1])
 
     def DUP_TOP_TWO(frame):
-        a, b = frame.popn(2)
-        frame.push(a, b, a, b)
+        frame.stack.extend(frame.stack[-2:])
 
     def NOP(frame):
         return
 
-    def unary_operator(frame, op):
-        x = frame.pop()
-        frame.push(UNARY_OPERATORS[op](x))
-
-    def binary_operator(frame, op):
-        x, y = frame.popn(2)
-        frame.push(BINARY_OPERATORS[op](x, y))
-
-    def inplace_operator(frame, op):
-        x, y = frame.popn(2)
-        frame.push(INPLACE_OPERATORS[op](x, y))
-
     def COMPARE_OP(frame, opnum):
-        x, y = frame.popn(2)
-        frame.push(COMPARE_OPERATORS[opnum](x, y))
+        y = frame.pop()
+        stack = frame.stack
+        stack[-1] = COMPARE_OPERATORS[opnum](stack[-1], y)
 
     def STORE_MAP(frame): # TODO: deprecated in py35 (exists only in py <= 34)
         the_map, val, key = frame.popn(3)
@@ -178,12 +168,13 @@ class Operation(metaclass=OperationClass):
         frame.push(the_map)
 
     def STORE_SUBSCR(frame):
-        val, obj, subscr = frame.popn(3)
-        obj[subscr] = val
+        subscr = frame.pop()
+        obj = frame.pop()
+        obj[subscr] = frame.pop()
 
     def DELETE_SUBSCR(frame):
-        obj, subscr = frame.popn(2)
-        del obj[subscr]
+        subscr = frame.pop()
+        del frame.pop()[subscr]
 
     def GET_ITER(frame):
         frame.push(iter(frame.pop()))
@@ -198,12 +189,16 @@ class Operation(metaclass=OperationClass):
     def YIELD_FROM(frame):
         u = frame.pop()
         x = frame.top()
+        if _gen_yf(frame.generator) is not None:
+            _gen_set_yf(frame.generator, None)
         try:
             if isinstance(x, (Generator, Coroutine)):
                 retval = x.send(u)
-            else:
+            elif u is None:
                 retval = next(x)
-            GlobalCache().set('return_value', retval)
+            else:
+                retval = x.send(u)
+            frame.f_tstate.return_value = retval
         except StopIteration as e:
             frame.pop()
             frame.push(e.value)
@@ -211,6 +206,9 @@ class Operation(metaclass=OperationClass):
             # YIELD_FROM decrements f_lasti, so that it will be called
             # repeatedly until a StopIteration is raised.
             frame.jump(frame.f_lasti - CODE_UNIT)
+            # Values sent to this generator are forwarded to the delegate
+            # directly while it is suspended. (see also `_gen_send_delegated`)
+            _gen_set_yf(frame.generator, x)
             # Returning 'yield' prevents the block stack cleanup code
             # from executing, suspending the frame in its current state.
             return 'yield'
@@ -222,20 +220,18 @@ class Operation(metaclass=OperationClass):
         v = w = None
         u = frame.top()
         if u is None:
-            exit_func = frame.pop(1)
+            exit_func = frame.stack.pop(-2)
         elif isinstance(u, str):
             if u in ('return', 'continue'):
-                exit_func = frame.pop(2)
+                exit_func = frame.stack.pop(-3)
             else:
-                exit_func = frame.pop(1)
+                exit_func = frame.stack.pop(-2)
             u = None
         elif issubclass(u, BaseException):
             w, v, u = frame.popn(3)
             tp, exc, tb = frame.popn(3)
             exit_func = frame.pop()
-            frame.push(tp, exc, tb)
-            frame.push(None)
-            frame.push(w, v, u)
+            frame.pushn((tp, exc, tb, None, w, v, u))
             block = frame.pop_block()
             assert block.type == 'except-handler'
             frame.push_block(block.type, block.handler, block.level-1)
@@ -249,7 +245,7 @@ class Operation(metaclass=OperationClass):
             frame.push('silenced')
 
     def RETURN_VALUE(frame):
-        GlobalCache().set('return_value', frame.pop())
+        frame.f_tstate.return_value = frame.pop()
 
         # NOTE: this should be compatiable with `CoroWrapper`
         if frame.generator:
@@ -259,10 +255,10 @@ class Operation(metaclass=OperationClass):
     def IMPORT_STAR(frame):
         mod = frame.pop()
         attrs = {k: getattr(mod, attr) for k in dir(mod) if k[0] != '_'}
-        frame.f_locals.update(attrs)
+        frame._f_locals.update(attrs)
 
     def YIELD_VALUE(frame):
-        GlobalCache().set('return_value', frame.pop())
+        frame.f_tstate.return_value = frame.pop()
         return 'yield'
 
     def POP_BLOCK(frame):
@@ -273,7 +269,7 @@ class Operation(metaclass=OperationClass):
         if isinstance(v, str):
             why = v
             if why in ('return', 'continue'):
-                GlobalCache().set('return_value', frame.pop())
+                frame.f_tstate.return_value = frame.pop()
             if why == 'silenced':
                 block = frame.pop_block()
                 assert block.type == 'except-handler'
@@ -286,7 +282,7 @@ class Operation(metaclass=OperationClass):
             val = frame.pop()
             tb = frame.pop()
             # PyErr_Restore
-            GlobalCache().set('last_exception', (exctype, val, tb))
+            frame.f_tstate.last_exception = (exctype, val, tb)
             why = 'exception'
         else:
             raise VirtualMachineError("Confused END_FINALLY")
@@ -299,14 +295,14 @@ class Operation(metaclass=OperationClass):
         frame.unwind_except_handler(block)
 
     def STORE_NAME(frame, name):
-        frame.f_locals[name] = frame.pop()
+        frame._f_locals[name] = frame.pop()
 
     def DELETE_NAME(frame, name):
-        del frame.f_locals[name]
+        del frame._f_locals[name]
 
     def UNPACK_SEQUENCE(frame, count):
         seq = frame.pop()
-        frame.push(*seq[::-1])
+        frame.pushn(seq[::-1])
 
     def FOR_ITER(frame, jump):
         # NOTE: applied implementation from darius/tailbiter
@@ -339,13 +335,13 @@ class Operation(metaclass=OperationClass):
         vals = seq[argcnt:(-argcntafter if argcntafter else None)]
         after = seq[(-argcntafter if argcntafter else len(seq)):]
 
-        frame.push(*after[::-1])
+        frame.pushn(after[::-1])
         frame.push(vals)
-        frame.push(*before[::-1])
+        frame.pushn(before[::-1])
 
     def STORE_ATTR(frame, name):
-        val, obj = frame.popn(2)
-        setattr(obj, name, val)
+        obj = frame.pop()
+        setattr(obj, name, frame.pop())
 
     def DELETE_ATTR(frame, name):
         obj = frame.pop()
@@ -361,46 +357,36 @@ class Operation(metaclass=OperationClass):
         frame.push(const)
 
     def LOAD_NAME(frame, name):
-        if name in frame.f_locals:   val = frame.f_locals[name]
+        if name in frame._f_locals:   val = frame._f_locals[name]
         elif name in frame.f_globals:  val = frame.f_globals[name]
         elif name in frame.f_builtins: val = frame.f_builtins[name]
         else: raise NameError("name '%s' is not defined" % name)
         frame.push(val)
 
     def BUILD_TUPLE(frame, count):
-        elts = frame.popn(count)
-        frame.push(tuple(elts))
+        frame.push(tuple(frame.popn(count)))
 
     def BUILD_LIST(frame, count):
-        elts = frame.popn(count)
-        frame.push(elts)
+        frame.push(frame.popn(count))
 
     def BUILD_SET(frame, count):
-        elts = frame.popn(count)
-        frame.push(set(elts))
+        frame.push(set(frame.popn(count)))
 
     def BUILD_MAP(frame, size):
         frame.push({})
 
     def LOAD_ATTR(frame, attr):
-        obj = frame.pop()
-        val = getattr(obj, attr)
-        frame.push(val)
+        stack = frame.stack
+        stack[-1] = getattr(stack[-1], attr)
 
     def COMPARE_OP(frame, opnum):
-        x, y = frame.popn(2)
-        frame.push(COMPARE_OPERATORS[opnum](x, y))
+        y = frame.pop()
+        stack = frame.stack
+        stack[-1] = COMPARE_OPERATORS[opnum](stack[-1], y)
 
     def IMPORT_NAME(frame, name):
         level, fromlist = frame.popn(2)
         val = __import__(name, frame.f_globals, frame.f_locals, fromlist, level)
-
-        # XXX: In order to make the decorator `asyncio.coroutine` works normally
-        # in our virtual machine, replace it with our implementation.
-        if name == 'asyncio':
-            val.coroutine = coroutine
-            val.coroutines.coroutine = coroutine
-
         frame.push(val)
 
     def IMPORT_FROM(frame, name):
@@ -441,7 +427,7 @@ class Operation(metaclass=OperationClass):
         frame.push(val)
 
     def CONTINUE_LOOP(frame, dest):
-        GlobalCache().set('return_value', dest)
+        frame.f_tstate.return_value = dest
         return 'continue'
 
     def SETUP_LOOP(frame, dest):
@@ -453,18 +439,24 @@ class Operation(metaclass=OperationClass):
     def SETUP_FINALLY(frame, dest):
         frame.push_block('finally', dest)
 
-    def LOAD_FAST(frame, name):
+    def LOAD_FAST(frame, index):
         # https://github.com/python/cpython/blob/fee552669f21ca294f57fe0df826945edc779090/Python/ceval.c#L1335
-        if name not in frame.f_locals:
+        val = frame.fastlocals[index]
+        if val is UNBOUND:
             raise UnboundLocalError(
-                "local variable '%s' referenced before assignment" % name)
-        frame.push(frame.f_locals[name])
+                "local variable '%s' referenced before assignment"
+                % frame.f_code.co_varnames[index])
+        frame.push(val)
 
-    def STORE_FAST(frame, name):
-        frame.f_locals[name] = frame.pop()
+    def STORE_FAST(frame, index):
+        frame.fastlocals[index] = frame.pop()
 
-    def DELETE_FAST(frame, name):
-        del frame.f_locals[name]
+    def DELETE_FAST(frame, index):
+        if frame.fastlocals[index] is UNBOUND:
+            raise UnboundLocalError(
+                "local variable '%s' referenced before assignment"
+                % frame.f_code.co_varnames[index])
+        frame.fastlocals[index] = UNBOUND
 
     def RAISE_VARARGS(frame, argc):
         assert 2 >= argc >= 0
@@ -536,15 +528,46 @@ class Operation(metaclass=OperationClass):
         frame.stack[-count].add(val)
 
     def MAP_ADD(frame, count):
-        val, key = frame.popn(2)
+        key = frame.pop()
+        val = frame.pop()
         frame.stack[-count][key] = val
 
     def LOAD_CLASSDEREF(frame, name):   # new in py34
         frame.push(frame.cells[name].cell_contents)
 
-    def EXTENDED_ARG(frame, count):
-        GlobalCache().set('oparg', count << 16)
-        return 'extended_arg'
+
+def _make_unary_operation(name, func):
+    def operation(frame):
+        stack = frame.stack
+        stack[-1] = func(stack[-1])
+    operation.__name__ = operation.__qualname__ = name
+    return operation
+
+
+def _make_binary_operation(name, func):
+    def operation(frame):
+        y = frame.pop()
+        stack = frame.stack
+        stack[-1] = func(stack[-1], y)
+    operation.__name__ = operation.__qualname__ = name
+    return operation
+
+
+def _set_arithmetic_operations(cls_op):
+    """Set a specialized implementation for each `UNARY_*`, `BINARY_*` and
+    `INPLACE_*` operation, so that there is no need to look up the operator
+    by name while executing them.
+    """
+    for prefix, operators, factory in [
+        ('UNARY', UNARY_OPERATORS, _make_unary_operation),
+        ('BINARY', BINARY_OPERATORS, _make_binary_operation),
+        ('INPLACE', INPLACE_OPERATORS, _make_binary_operation),
+    ]:
+        for op, func in operators.items():
+            name = '%s_%s' % (prefix, op)
+            setattr(cls_op, name, staticmethod(factory(name, func)))
+
+_set_arithmetic_operations(Operation)
 
 
 class OperationPy34(Operation):
@@ -643,20 +666,18 @@ class OperationPy35(OperationPy34):
         v = w = None
         u = frame.top()
         if u is None:
-            exit_func = frame.pop(1)
+            exit_func = frame.stack.pop(-2)
         elif isinstance(u, str):
             if u in ('return', 'continue'):
-                exit_func = frame.pop(2)
+                exit_func = frame.stack.pop(-3)
             else:
-                exit_func = frame.pop(1)
+                exit_func = frame.stack.pop(-2)
             u = None
         elif issubclass(u, BaseException):
             w, v, u = frame.popn(3)
             tp, exc, tb = frame.popn(3)
             exit_func = frame.pop()
-            frame.push(tp, exc, tb)
-            frame.push(None)
-            frame.push(w, v, u)
+            frame.pushn((tp, exc, tb, None, w, v, u))
             block = frame.pop_block()
             assert block.type == 'except-handler'
             frame.push_block(block.type, block.handler, block.level-1)
@@ -664,7 +685,8 @@ class OperationPy35(OperationPy34):
             raise VirtualMachineError("Confused WITH_CLEANUP")
 
         exit_ret = exit_func(u, v, w)
-        frame.push(*(u, exit_ret))
+        frame.push(u)
+        frame.push(exit_ret)
 
     def WITH_CLEANUP_FINISH(frame):
         u, exit_ret = frame.popn(2)
@@ -674,8 +696,8 @@ class OperationPy35(OperationPy34):
 
     def BUILD_MAP(frame, size):
         # changed in Py35
-        items = [frame.popn(2) for i in range(size)]
-        frame.push(dict(items))
+        elts = frame.popn(2*size)
+        frame.push(dict(zip(elts[::2], elts[1::2])))
 
     def CALL_FUNCTION_VAR(frame, arg):
         # NOTE: this operation is changed in py35, and will be removed in py36,
@@ -697,13 +719,13 @@ class OperationPy35(OperationPy34):
         # NOTE: for case like ```a = [1, 2, 3]; b = [*a]```,
         # which is not allowed in Py34.
         elts = frame.popn(count)
-        frame.push(*elts)
+        frame.pushn(elts)
 
     def BUILD_MAP_UNPACK(frame, count):
         # NOTE: for case like ```a = {'a': 1, 'b': 2}; b = {**a}```,
         # which is not allowed in Py34.
         elts = frame.popn(count)
-        frame.push(*elts)
+        frame.pushn(elts)
 
     def BUILD_MAP_UNPACK_WITH_CALL(frame, oparg):
         num_map, func_location = oparg & 0xff, (oparg >> 8) & 0xff
@@ -721,13 +743,13 @@ class OperationPy35(OperationPy34):
         # NOTE: for case like ```a = (1, 2, 3); b = (*a,)```,
         # which is not allowed in Py34.
         elts = frame.popn(count)
-        frame.push(*elts)
+        frame.pushn(elts)
 
     def BUILD_SET_UNPACK(frame, count):
         # NOTE: for case like ```a = {1, 2, 3}; b = {*a}```,
         # which is not allowed in Py34.
         elts = frame.popn(count)
-        frame.push(*elts)
+        frame.pushn(elts)
 
     def SETUP_ASYNC_WITH(frame, dest):
         res = frame.pop()   # this affect the offset of block to be pushed
@@ -749,9 +771,9 @@ class OperationPy35(OperationPy34):
         vals = seq[argcnt:(-argcntafter if argcntafter else None)]
         after = seq[(-argcntafter if argcntafter else len(seq)):]
 
-        frame.push(*after[::-1])
+        frame.pushn(after[::-1])
         frame.push(vals)
-        frame.push(*before[::-1])
+        frame.pushn(before[::-1])
 
 
 # Mask and values used by FORMAT_VALUE conversion
@@ -773,21 +795,23 @@ class OperationPy36(OperationPy35):
     def YIELD_VALUE(frame):
         retval = frame.pop()
         if frame.f_code.co_flags & 0x0200:    # CO_ASYNC_GENERATOR = 0x0200
-            retval = AsyncGenWrappedValue(retval)
-        GlobalCache().set('return_value', retval)
+            # Mark the value as yielded instead of wrapping it, see also
+            # `async_gen_unwrap_value()`
+            frame.generator._yielded = True
+        frame.f_tstate.return_value = retval
         return 'yield'
 
     def SETUP_ANNOTATIONS(frame):
-        if frame.f_locals is None:
+        if frame._f_locals is None:
             raise SystemError('no locals found when setting up annotations')
-        if '__annotations__' not in frame.f_locals:
-            frame.f_locals['__annotations__'] = {}
+        if '__annotations__' not in frame._f_locals:
+            frame._f_locals['__annotations__'] = {}
 
     def STORE_ANNOTATION(frame, namei):
-        if frame.f_locals is None:
+        if frame._f_locals is None:
             raise SystemError('no locals found when setting up annotations')
 
-        anno_dict = frame.f_locals.get('__annotations__', None)
+        anno_dict = frame._f_locals.get('__annotations__', None)
         if anno_dict is None:
             raise NameError('__annotations__ not found')
         anno_dict[namei] = frame.pop()
@@ -811,8 +835,7 @@ class OperationPy36(OperationPy35):
         kwargs = frame.pop() if oparg & 0x01 else {}
         posargs = frame.pop()
         func = frame.pop()
-        retval = func(*posargs, **kwargs)
-        frame.push(retval)
+        return _call_function(func, frame, list(posargs), kwargs)
 
     def FORMAT_VALUE(frame, flags):
         # FVC_MASK: 0x3, for chosing conversion function
@@ -861,10 +884,6 @@ class OperationPy36(OperationPy35):
             _map.update(elt)
         frame.push(_map)
 
-    def EXTENDED_ARG(frame, count):
-        GlobalCache().set('oparg', count << 8)
-        return 'extended_arg'
-
 
 class OperationPy37(OperationPy36):
     _unsupported_ops = ['STORE_ANNOTATION']
@@ -908,17 +927,19 @@ class OperationPy37(OperationPy36):
         # - https://github.com/python/cpython/blob/3.7/Objects/object.c#L1126-L1197
         if hasattr(meth.__call__, '__self__'):
             # `meth` is not an unbound method
-            frame.push(*(None, meth))
+            frame.push(None)
+            frame.push(meth)
         else:
-            frame.push(*(meth, obj))
+            frame.push(meth)
+            frame.push(obj)
 
     def CALL_METHOD(frame, oparg):
         meth = frame.peek(oparg + 1)
         if meth is None:
-            call_function_kw(frame, oparg, [])
-            frame.pop(1)    # pop out NULL
+            del frame.stack[-oparg-2]   # pop out NULL
+            return call_function_kw(frame, oparg, ())
         else:
-            call_function_kw(frame, oparg+1, [])
+            return call_function_kw(frame, oparg+1, ())
 
 
 class OperationPy38(OperationPy37):
@@ -945,7 +966,7 @@ class OperationPy38(OperationPy37):
         num_stack = len(frame.stack)
         assert block.level + 3 <= num_stack <= block.level + 4
         tb, value, exctype = frame.popn(3)
-        GlobalCache().set('new_exception', (exctype, value, tb))
+        frame.f_tstate.new_exception = (exctype, value, tb)
 
     def MAP_ADD(frame, count):
         # Changed in Py38. Order of key and val is reversed.
@@ -954,8 +975,10 @@ class OperationPy38(OperationPy37):
 
     def ROT_FOUR(frame):
         # related test case: test_with::test_generator_with_context_manager
-        a, b, c, d = frame.popn(4)
-        frame.push(b, c, d, a)
+        stack = frame.stack
+        stack[-1], stack[-2], stack[-3], stack[-4] = (
+            stack[-2], stack[-3], stack[-4], stack[-1]
+        )
 
     def BEGIN_FINALLY(frame):
         frame.push(None)
@@ -966,7 +989,7 @@ class OperationPy38(OperationPy37):
             return
         elif isinstance(exc, int):
             # `exc` should be a line number to jump to
-            last_exception = GlobalCache().get('last_exception', None)
+            last_exception = frame.f_tstate.last_exception
             if exc == 0 and last_exception is not None:
                 return 'exception'
             frame.jump(exc)
@@ -974,7 +997,7 @@ class OperationPy38(OperationPy37):
             assert issubclass(exc, BaseException)
             tb, val = frame.popn(2)
             # PyErr_Restore
-            GlobalCache().set('last_exception', (exc, val, tb))
+            frame.f_tstate.last_exception = (exc, val, tb)
             return 'exception'
 
     def END_ASYNC_FOR(frame):
@@ -990,7 +1013,7 @@ class OperationPy38(OperationPy37):
             return
         else:
             tb, val = frame.popn(2)
-            GlobalCache().set('last_exception', (exc, val, tb))
+            frame.f_tstate.last_exception = (exc, val, tb)
             return 'exception'
 
     def CALL_FINALLY(frame, oparg):
@@ -1009,16 +1032,16 @@ class OperationPy38(OperationPy37):
                 raise SystemError('popped block is not an except handler')
             assert len(frame.stack) == block.level + 3
             tb, value, exctype = frame.popn(3)
-            GlobalCache().set('new_exception', (exctype, value, tb))
+            frame.f_tstate.new_exception = (exctype, value, tb)
         if preserve_tos:
             frame.push(res)
 
 
 def do_raise(frame, exc, cause):
     if exc is None:
-        exc_type, val, tb = GlobalCache().get('new_exception', (type(None), None, None))
+        exc_type, val, tb = frame.f_tstate.new_exception
         # PyErr_Restore
-        GlobalCache().set('last_exception', (exc_type, val, tb))
+        frame.f_tstate.last_exception = (exc_type, val, tb)
         return 'exception' if exc_type is None else 'reraise'
     elif type(exc) == type:
         exc_type = exc
@@ -1037,7 +1060,7 @@ def do_raise(frame, exc, cause):
         val.__cause__ = cause
 
     # PyErr_SetObject (PyErr_Restore)
-    GlobalCache().set('last_exception', (exc_type, val, val.__traceback__))
+    frame.f_tstate.last_exception = (exc_type, val, val.__traceback__)
     return 'exception'
 
 
@@ -1074,13 +1097,23 @@ def _setup_function(frame, argc, func):
 
 def call_function(frame, oparg, varargs, kwargs):
     len_kw, len_pos = divmod(oparg, 256)
-    namedargs = dict([frame.popn(2) for i in range(len_kw)])
-    namedargs.update(kwargs)
-    posargs = frame.popn(len_pos)
+
+    # Arguments are read from the value stack directly, and the layout is:
+    # [func, positional arguments, (key, value) of keyword arguments]
+    stack = frame.stack
+    base = len(stack) - len_pos - 2*len_kw
+    func = stack[base-1]
+    posargs = stack[base:base+len_pos]
     posargs.extend(varargs)
-    func = frame.pop()
+    if len_kw:
+        kw = stack[base+len_pos:]
+        namedargs = dict(zip(kw[::2], kw[1::2]))
+        namedargs.update(kwargs)
+    else:
+        namedargs = kwargs
+    del stack[base-1:]
 
-    frame.push(_call_function(func, frame, *posargs, **namedargs))
+    return _call_function(func, frame, posargs, namedargs)
 
 
 def call_function_kw(frame, oparg, kwnames):
@@ -1090,17 +1123,41 @@ def call_function_kw(frame, oparg, kwnames):
     See also:
     https://github.com/python/cpython/blob/3.6/Python/ceval.c#L4832-L4894
     """
-    nkwargs = len(kwnames)
-    nargs = oparg - nkwargs
-    kwvals = frame.popn(nkwargs)
-    namedargs = dict(zip(kwnames, kwvals))
-    posargs = frame.popn(nargs)
-    func = frame.pop()
-
-    frame.push(_call_function(func, frame, *posargs, **namedargs))
-
+    # Arguments are read from the value stack directly, and the layout is:
+    # [func, positional arguments, values of keyword arguments]
+    stack = frame.stack
+    base = len(stack) - oparg
+    nargs = oparg - len(kwnames)
+    func = stack[base-1]
+    posargs = stack[base:base+nargs]
+    namedargs = dict(zip(kwnames, stack[base+nargs:])) if kwnames else {}
+    del stack[base-1:]
+
+    return _call_function(func, frame, posargs, namedargs)
+
+
+def _call_function(func, frame, posargs, namedargs):
+    """Call a function and push the returned value, or push the frame of
+    callee to the virtual machine if it is a `Function` which is not a
+    generator. In the later case, 'call' is returned to make the loop of
+    virtual machine continue with that frame, and the returned value will
+    be pushed after that frame returns.
+    """
+    if isinstance(func, Method) and isinstance(func.__func__, Function):
+        posargs.insert(0, func.__self__)
+        func = func.__func__
+    if isinstance(func, Function):
+        # CO_GENERATOR | CO_COROUTINE | CO_ASYNC_GENERATOR
+        if not func.__code__.co_flags & 0x02A0:
+            callee = func.make_frame(posargs, namedargs, frame)
+            frame.f_tstate.interp.push_frame(callee)
+            return 'call'
+    elif func is types_coroutine or func is asyncio_coroutine:
+        # These decorators flag the code of native generator functions only,
+        # so it's done here for functions of virtual machine.
+        if posargs and isinstance(posargs[0], Function):
+            make_iterable_coroutine(posargs[0])
 
-def _call_function(func, frame, *posargs, **namedargs):
     # XXX: This is a temporary workaround to skip checking on some builtin
     # functions which may lack `__name__`, e.g. `functools.partial`.
     fn = getattr(func, '__name__', '')
@@ -1113,7 +1170,7 @@ def _call_function(func, frame, *posargs, **namedargs):
         retval = func(frame, *posargs, **namedargs)
     else:
         retval = func(*posargs, **namedargs)
-    return retval
+    frame.push(retval)
 
 
 def build_class(func, name, *bases, **kwds):
@@ -0,0 +1,506 @@
+"""
+Peephole and dataflow passes over decoded instructions.
+
+Before a code object is quickened (see `specialize.quicken`), its copy of the
+decoded instruction stream is rewritten by a pipeline of passes. Like the
+superinstructions (see `superinstructions.py`), the table stays indexed by
+the offsets in `co_code`: a sequence of instructions is replaced by a single
+entry starting at the offset of its first instruction, whose `next_offset`
+skips the others. Entries of the replaced instructions are left in the table,
+so that jumping to them (or setting `f_lasti` by a debugger) still works,
+and `f_lasti` of a frame is always the offset of an instruction in
+`co_code`, which line numbers and tracebacks are looked up by. Frames being
+traced run the decoded instructions instead.
+
+Instructions which are removed are skipped by the instruction falling through
+to them, i.e. its `next_offset` is moved after them, if the line number of
+`f_lasti` after that instruction doesn't change. Otherwise they are replaced
+by a `NOP` skipping all of them.
+
+Built-in passes, in the order they are run:
+
+- fold_constants: unary, binary and comparison operations and `BUILD_TUPLE`
+  on constants are folded into `LOAD_CONST`, and conditional jumps on a
+  constant are folded into a jump or removed.
+- thread_jumps: jumps to an unconditional jump go to its target directly.
+- remove_dead_blocks: instructions which can't be reached from the start of
+  code (e.g. after an unconditional jump) are marked dead. They are ignored
+  by the following passes and not quickened.
+- eliminate_store_load: `STORE_FAST x; LOAD_FAST x` is removed if `x` is not
+  loaded anywhere else.
+- eliminate_tuple_unpack: `BUILD_TUPLE n; UNPACK_SEQUENCE n` is replaced by
+  reversing the top `n` values of stack.
+
+Extra passes can be registered by `register_pass`, and the number of
+instructions removed by each pass is reported by `get_pass_stats`.
+"""
+import dis
+import warnings
+from collections import Counter, namedtuple
+
+from ._internal.cache import CodeObjectCache
+from .objects.codeobject import get_instructions, get_line_table
+
+
+__all__ = [
+    'PassManager', 'PassContext', 'PassStats', 'register_pass',
+    'get_pass_stats', 'optimize', 'PASS_OPS',
+]
+
+
+# Limits of the constants produced by folding, the same as the AST optimizer
+# of CPython 3.7.
+MAX_INT_SIZE = 128
+MAX_COLLECTION_SIZE = 256
+MAX_STR_SIZE = 4096
+
+_FOLDABLE_TYPES = (
+    int, float, complex, bool, str, bytes, type(None), type(Ellipsis),
+)
+
+# Operations after which the execution doesn't go on to the next instruction
+_UNCONDITIONAL_OPS = {
+    'JUMP_ABSOLUTE', 'JUMP_FORWARD', 'RETURN_VALUE', 'RAISE_VARARGS',
+    'BREAK_LOOP', 'CONTINUE_LOOP',
+}
+
+# Operations whose `next_offset` is not moved, because they don't fall
+# through, or `f_lasti` after them is read by other operations. (e.g. the
+# instruction a generator is suspended at)
+_FIXED_NEXT_OPS = _UNCONDITIONAL_OPS | {
+    'END_FINALLY', 'YIELD_VALUE', 'YIELD_FROM', 'CALL_FINALLY', 'POP_FINALLY',
+}
+
+# Jumps whose targets are not threaded, since they are not jumped to directly
+# (e.g. handlers of blocks) or they return to the jumping instruction.
+_UNTHREADED_PREFIXES = ('SETUP_', 'FOR_ITER', 'CALL_FINALLY')
+
+# Names of builtins reading local variables of the calling frame
+_INTROSPECTING_NAMES = {'locals', 'vars', 'dir', 'eval', 'exec', '_getframe'}
+
+# Returned by `_evaluate` if an operation can't be folded
+_NOT_FOLDED = object()
+
+
+def BUILD_TUPLE__UNPACK_SEQUENCE(frame, count):
+    """Reverse the top `count` values of stack, which is the same as packing
+    them into a tuple and unpacking it.
+    """
+    stack = frame.stack
+    stack[-count:] = stack[:-count-1:-1]
+
+
+# Operations appended to the dispatch table after superinstructions.
+PASS_OPS = [
+    ('BUILD_TUPLE__UNPACK_SEQUENCE', BUILD_TUPLE__UNPACK_SEQUENCE),
+]
+
+
+_Namedtuple_PassStats = namedtuple('PassStats', 'name, removed')
+
+class PassStats(_Namedtuple_PassStats):
+    """Result of a pass.
+
+    - name: name the pass is registered with
+    - removed: number of instructions removed from the instruction stream
+    """
+    __slots__ = ()
+
+
+class PassContext(object):
+    """The instruction stream of a code object being rewritten by passes.
+
+    `table` is the copy of decoded instructions to be rewritten, and `dead`
+    is the set of offsets of the instructions which can't be reached. Passes
+    walk through the entries of table by `walk`, and rewrite them by
+    `rewrite` and `remove`, so that the entries being walked follow them.
+    """
+    def __init__(self, code, table, opcodes):
+        self.code = code
+        self.table = table
+        self.opcodes = opcodes
+        self.instructions = get_instructions(code)
+        self.line_table = get_line_table(code)
+        self.dead = set()
+        # Offset of the entry executed before each entry walked, and offset
+        # of the entry covering the one being walked.
+        self._previous = {}
+        self._head = None
+
+    def walk(self):
+        """Iterate over the entries of table in the order of offsets,
+        following `next_offset` of each entry. Dead entries are skipped.
+        """
+        table, dead, previous = self.table, self.dead, self._previous
+        previous.clear()
+        prev, offset, end = None, 0, len(table)
+        while offset < end:
+            if offset in dead:
+                prev, offset = None, table[offset].next_offset
+                continue
+            previous[offset] = prev
+            self._head = offset
+            yield table[offset]
+            prev = self._head
+            offset = table[prev].next_offset
+
+    def previous(self, offset):
+        """Get the entry falling through to the entry at given offset, it's
+        None if that entry follows a dead one or it's the first one.
+        """
+        prev = self._previous.get(offset)
+        if prev is None:
+            return None
+        entry = self.table[prev]
+        return entry if entry.next_offset == offset else None
+
+    def is_original(self, entry):
+        """Check whether an entry is a decoded instruction not rewritten."""
+        return self.instructions[entry.offset] is entry
+
+    def opcode(self, name):
+        opcode = dis.opmap.get(name)
+        return self.opcodes[name] if opcode is None else opcode
+
+    def rewrite(self, offset, name, arguments=(), next_offset=None,
+                jump_target=None, argval=None):
+        """Replace the entry at given offset by operation `name`, and make it
+        skip the entries before `next_offset`.
+        """
+        entry = self.table[offset]
+        self.table[offset] = entry._replace(
+            opcode=self.opcode(name), opname=name, arg=None, argval=argval,
+            arguments=tuple(arguments),
+            next_offset=entry.next_offset if next_offset is None else next_offset,
+            jump_target=jump_target,
+        )
+        self._head = offset
+
+    def remove(self, offset, end):
+        """Remove the entries from given offset up to `end`, and return the
+        number of instructions removed.
+        """
+        table = self.table
+        count, i = 0, offset
+        while i < end:
+            count, i = count + 1, table[i].next_offset
+
+        prev = self.previous(offset)
+        lineno = self.line_table.lineno
+        if (prev is not None and prev.jump_target is None and
+            prev.opname not in _FIXED_NEXT_OPS and
+            lineno(offset) == lineno(end)):
+            table[prev.offset] = prev._replace(next_offset=end)
+            self._head = prev.offset
+            return count
+        self.rewrite(offset, 'NOP', next_offset=end)
+        return count - 1
+
+    def jump_targets(self):
+        """Get offsets which are jumped to by the entries not dead."""
+        targets = set()
+        for entries in (self.table, self.instructions):
+            for entry in entries:
+                if (entry is not None and entry.jump_target is not None and
+                    entry.offset not in self.dead):
+                    targets.add(entry.jump_target)
+        return targets
+
+
+def _is_foldable(value):
+    if isinstance(value, tuple):
+        return (len(value) <= MAX_COLLECTION_SIZE and
+                all(_is_foldable(v) for v in value))
+    if not isinstance(value, _FOLDABLE_TYPES):
+        return False
+    if isinstance(value, int):
+        return value.bit_length() <= MAX_INT_SIZE
+    if isinstance(value, (str, bytes)):
+        return len(value) <= MAX_STR_SIZE
+    return True
+
+
+def _is_cheap(func, operands):
+    """Check whether folding an operation would not take too much time or
+    memory before computing it. (`ast_opt.c::safe_*`)
+    """
+    if len(operands) != 2:
+        return True
+    x, y = operands
+    if func is pow:
+        return not (isinstance(x, int) and isinstance(y, int) and y > 0 and
+                    x.bit_length() * y > MAX_INT_SIZE)
+    if func.__name__ == 'mul':
+        if isinstance(y, int) and isinstance(x, (str, bytes, tuple)):
+            x, y = y, x
+        if isinstance(x, int) and isinstance(y, (str, bytes, tuple)):
+            return x * len(y) <= MAX_STR_SIZE
+    if func.__name__ == 'lshift':
+        return not (isinstance(y, int) and y > MAX_INT_SIZE)
+    if func.__name__ == 'mod':
+        # Formatting could produce anything
+        return not isinstance(x, (str, bytes))
+    return True
+
+
+def _evaluate(func, operands):
+    """Compute an operation on constants, `_NOT_FOLDED` is returned if it's
+    not safe to be done before running the code, or it raises.
+    """
+    if not all(_is_foldable(v) for v in operands) or not _is_cheap(func, operands):
+        return _NOT_FOLDED
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        try:
+            value = func(*operands)
+        except Exception:
+            return _NOT_FOLDED
+    return value if _is_foldable(value) else _NOT_FOLDED
+
+
+def _constants(ctx, entry, count):
+    """Get the entries of `LOAD_CONST` falling through to given entry one
+    after another, or None if there are not `count` of them.
+    """
+    entries = []
+    offset = entry.offset
+    while len(entries) < count:
+        prev = ctx.previous(offset)
+        if prev is None or prev.opname != 'LOAD_CONST':
+            return None
+        entries.append(prev)
+        offset = prev.offset
+    return entries[::-1]
+
+
+def fold_constants(ctx):
+    # locally lazy-import to avoid circular reference
+    from .ops import UNARY_OPERATORS, BINARY_OPERATORS, COMPARE_OPERATORS
+
+    removed = 0
+    for entry in ctx.walk():
+        if not ctx.is_original(entry):
+            continue
+        opname = entry.opname
+        prefix, _, operator = opname.partition('_')
+        if prefix == 'UNARY' and operator in UNARY_OPERATORS:
+            func, count = UNARY_OPERATORS[operator], 1
+        elif prefix == 'BINARY' and operator in BINARY_OPERATORS:
+            func, count = BINARY_OPERATORS[operator], 2
+        elif opname == 'COMPARE_OP' and entry.arg < 10:
+            # All but 'exception match'
+            func, count = COMPARE_OPERATORS[entry.arg], 2
+        elif opname == 'BUILD_TUPLE':
+            func, count = (lambda *values: values), entry.arg
+        elif opname in ('POP_JUMP_IF_FALSE', 'POP_JUMP_IF_TRUE'):
+            removed += _fold_branch(ctx, entry)
+            continue
+        else:
+            continue
+
+        consts = _constants(ctx, entry, count)
+        if consts is None:
+            continue
+        value = _evaluate(func, [c.argval for c in consts])
+        if value is _NOT_FOLDED:
+            continue
+        start = consts[0] if consts else entry
+        ctx.rewrite(start.offset, 'LOAD_CONST', (value,), entry.next_offset,
+                    argval=value)
+        removed += count
+    return removed
+
+
+def _fold_branch(ctx, entry):
+    consts = _constants(ctx, entry, 1)
+    if consts is None or not _is_foldable(consts[0].argval):
+        return 0
+    start = consts[0]
+    taken = bool(start.argval) == (entry.opname == 'POP_JUMP_IF_TRUE')
+    if not taken:
+        return ctx.remove(start.offset, entry.next_offset)
+    target = entry.jump_target
+    if target <= entry.offset:
+        # Backward jumps close loops, they are left to `JUMP_BACKWARD`
+        return 0
+    ctx.rewrite(start.offset, 'JUMP_ABSOLUTE', (target,), entry.next_offset,
+                jump_target=target, argval=target)
+    return 1
+
+
+def thread_jumps(ctx):
+    removed = 0
+    table = ctx.table
+    for entry in ctx.walk():
+        target = entry.jump_target
+        if target is None or entry.opname.startswith(_UNTHREADED_PREFIXES):
+            continue
+        seen = set()
+        while target > entry.offset and target not in seen:
+            seen.add(target)
+            jump = table[target]
+            if jump.opname not in ('JUMP_ABSOLUTE', 'JUMP_FORWARD'):
+                break
+            target = jump.jump_target
+        if target == entry.jump_target or target <= entry.offset:
+            # Backward jumps close loops, they are left to `JUMP_BACKWARD`
+            continue
+        name = entry.opname
+        if name == 'JUMP_FORWARD':
+            name = 'JUMP_ABSOLUTE'
+        ctx.rewrite(entry.offset, name, (target,), jump_target=target,
+                    argval=target)
+        removed += 1
+    return removed
+
+
+def remove_dead_blocks(ctx):
+    table = ctx.table
+    reachable = set()
+    pending = [0]
+    while pending:
+        offset = pending.pop()
+        if offset in reachable or offset >= len(table):
+            continue
+        reachable.add(offset)
+        entry = table[offset]
+        if entry.jump_target is not None:
+            pending.append(entry.jump_target)
+        if entry.opname not in _UNCONDITIONAL_OPS:
+            pending.append(entry.next_offset)
+
+    removed = 0
+    for entry in ctx.walk():
+        if entry.offset not in reachable:
+            removed += 1
+    ctx.dead.update(
+        entry.offset for entry in table
+        if entry is not None and entry.offset not in reachable
+    )
+    return removed
+
+
+def eliminate_store_load(ctx):
+    code = ctx.code
+    if _INTROSPECTING_NAMES.intersection(code.co_names):
+        return 0
+    loads = Counter()
+    for instr in ctx.instructions:
+        if instr is not None and instr.offset not in ctx.dead:
+            if instr.opname in ('LOAD_FAST', 'DELETE_FAST'):
+                loads[instr.arg] += 1
+    targets = ctx.jump_targets()
+
+    removed = 0
+    for entry in ctx.walk():
+        if (entry.opname != 'LOAD_FAST' or loads[entry.arg] != 1 or
+            entry.offset in targets or not ctx.is_original(entry)):
+            continue
+        store = ctx.previous(entry.offset)
+        if (store is None or store.opname != 'STORE_FAST' or
+            store.arg != entry.arg or not ctx.is_original(store)):
+            continue
+        removed += ctx.remove(store.offset, entry.next_offset)
+    return removed
+
+
+def eliminate_tuple_unpack(ctx):
+    removed = 0
+    for entry in ctx.walk():
+        if entry.opname != 'UNPACK_SEQUENCE' or not ctx.is_original(entry):
+            continue
+        build = ctx.previous(entry.offset)
+        if (build is None or build.opname != 'BUILD_TUPLE' or
+            build.arg != entry.arg or not ctx.is_original(build)):
+            continue
+        count = entry.arg
+        if count == 1:
+            removed += ctx.remove(build.offset, entry.next_offset)
+            continue
+        if count == 2:
+            ctx.rewrite(build.offset, 'ROT_TWO', (), entry.next_offset)
+        else:
+            ctx.rewrite(build.offset, 'BUILD_TUPLE__UNPACK_SEQUENCE', (count,),
+                        entry.next_offset, argval=count)
+        removed += 1
+    return removed
+
+
+DEFAULT_PASSES = [
+    ('fold_constants', fold_constants),
+    ('thread_jumps', thread_jumps),
+    ('remove_dead_blocks', remove_dead_blocks),
+    ('eliminate_store_load', eliminate_store_load),
+    ('eliminate_tuple_unpack', eliminate_tuple_unpack),
+]
+
+
+class PassManager(object):
+    """An ordered list of (name, pass) run over the instruction stream of
+    each code object. A pass is a function taking a `PassContext`, and it
+    returns the number of instructions it removes.
+    """
+    def __init__(self, passes=DEFAULT_PASSES):
+        self.passes = list(passes)
+        # Number of instructions removed by each pass in all code objects
+        self.totals = Counter()
+
+    def register(self, func, name=None, before=None):
+        """Add a pass, it's run before the pass named `before`, or at the end
+        if `before` is None. A pass with the same name is replaced.
+        """
+        name = func.__name__ if name is None else name
+        self.unregister(name)
+        names = [n for n, _ in self.passes]
+        index = len(names) if before is None else names.index(before)
+        self.passes.insert(index, (name, func))
+
+    def unregister(self, name):
+        self.passes = [(n, f) for n, f in self.passes if n != name]
+
+    def run(self, code, table, opcodes):
+        """Run all passes over `table`, and return the context they are run
+        with and a list of `PassStats`.
+        """
+        ctx = PassContext(code, table, opcodes)
+        stats = []
+        for name, func in self.passes:
+            removed = func(ctx) or 0
+            self.totals[name] += removed
+            stats.append(PassStats(name, removed))
+        return ctx, stats
+
+
+pass_manager = PassManager()
+
+_stats_cache = CodeObjectCache()
+
+
+def register_pass(func, name=None, before=None):
+    """Add a pass run over code objects quickened from now on. (see
+    `PassManager.register`)
+    """
+    pass_manager.register(func, name, before)
+
+
+def optimize(code, table, opcodes):
+    """Rewrite the copy of decoded instructions of a code object in place,
+    and return the set of offsets of dead instructions.
+
+    `opcodes` maps the names of operations which are not in `dis.opmap` to
+    their opcodes.
+    """
+    ctx, stats = pass_manager.run(code, table, opcodes)
+    _stats_cache.set(code, stats)
+    return ctx.dead
+
+
+def get_pass_stats(code=None):
+    """Get a list of `PassStats` for the passes run over given code object,
+    it's empty if that code object has not been executed yet. If `code` is
+    None, the numbers of all code objects are summed up.
+    """
+    if code is not None:
+        return list(_stats_cache.get(code, []))
+    totals = pass_manager.totals
+    return [PassStats(name, totals[name]) for name, _ in pass_manager.passes]
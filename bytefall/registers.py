@@ -0,0 +1,584 @@
+"""
+Register-based execution tier.
+
+Blocks of instructions of a hot code object are translated into a register
+based intermediate representation (IR), in which each instruction names the
+slots of its operands and result in a flat array of registers of frame,
+instead of passing values through the value stack. The array of registers is
+laid out as:
+
+    [fast locals | constants | temporaries]
+
+where the slots of fast locals are `frame.fastlocals` itself, so that the
+operations which are not translated still see the same values. (like
+`f_localsplus` in CPython) Loading a local or a constant doesn't produce an
+instruction, its slot is used by the instructions consuming it directly, and
+a result stored into a local is written to its slot by the instruction
+producing it. e.g. `LOAD_FAST a; LOAD_FAST b; BINARY_ADD; STORE_FAST c` is
+translated into a single instruction:
+
+    _binary(frame, 2, operator.add, 0, 1)
+
+Values which are not consumed yet are kept in temporaries, they are pushed
+onto the value stack before the operations which are not translated, and
+before a conditional jump or the end of block. Those operations are executed
+as they are in the quickened instruction stream. (see `specialize.quicken`)
+
+A block starts from the offset requested by `VirtualMachine.eval_compiled`,
+forward jumps are followed in the same block and a conditional jump not
+taken continues in it. `f_lasti` is set to the offset following the
+instruction each IR instruction is translated from before running it, so that
+line numbers and jumps of operations are the same as interpreted ones. When
+an exception is raised by an IR instruction, the values held in temporaries
+are pushed back onto the value stack, so that the frame is left in the same
+state as the interpreter leaves it.
+"""
+from .closurecompiler import CompiledCode, _JUMPING_OPS
+from .codegen import _get_bound_slots, _load_global, _unbound_local
+from .objects import UNBOUND
+from .objects.codeobject import get_instructions
+from .specialize import Site, find_loop
+
+
+__all__ = ['RegisterCode']
+
+
+# Maximum number of instructions translated into a block
+MAX_BLOCK_SIZE = 256
+
+# Operations which always return a reason (why)
+_LEAVING_OPS = {'RETURN_VALUE', 'RAISE_VARARGS', 'YIELD_VALUE'}
+
+CO_OPTIMIZED = 0x0001
+
+# Returned by IR instructions jumping to another offset, the block is left
+# without a reason.
+_JUMPED = 'jumped'
+
+# Returned by translators if a block is ended
+_END = object()
+
+
+def _ends_block(instr):
+    """Check whether a block should be ended after given instruction is
+    executed by its operation. Besides jumps, a block is ended after calls as
+    `closurecompiler.py` does.
+    """
+    if instr.opname.startswith('SETUP_'):
+        return False
+    if instr.jump_target is not None:
+        return True
+    opname = instr.opname
+    return (opname in _JUMPING_OPS or opname in _LEAVING_OPS or
+            opname.startswith('CALL_'))
+
+
+# --- IR instructions ---
+# Each of them is called with the frame and its operands, and the result is
+# written to the register given as the first operand (`dst`) if there is one.
+
+def _move(frame, dst, src):
+    regs = frame.registers
+    regs[dst] = regs[src]
+
+def _check_bound(frame, index):
+    if frame.registers[index] is UNBOUND:
+        _unbound_local(frame, index)
+
+def _pop(frame, dst):
+    frame.registers[dst] = frame.stack.pop()
+
+def _pop_many(frame, *dsts):
+    stack, regs = frame.stack, frame.registers
+    n = len(dsts)
+    for dst, value in zip(dsts, stack[-n:]):
+        regs[dst] = value
+    del stack[-n:]
+
+def _push(frame, src):
+    frame.stack.append(frame.registers[src])
+
+def _push_many(frame, *srcs):
+    regs = frame.registers
+    frame.stack.extend([regs[src] for src in srcs])
+
+def _unary(frame, dst, func, x):
+    regs = frame.registers
+    regs[dst] = func(regs[x])
+
+def _binary(frame, dst, func, x, y):
+    regs = frame.registers
+    regs[dst] = func(regs[x], regs[y])
+
+def _compare(frame, dst, func, x, y):
+    regs = frame.registers
+    regs[dst] = func(regs[x], regs[y])
+
+def _store_subscr(frame, obj, subscr, value):
+    regs = frame.registers
+    regs[obj][regs[subscr]] = regs[value]
+
+def _load_global_to(frame, dst, name):
+    try:
+        value = frame.f_globals[name]
+    except KeyError:
+        value = _load_global(frame, name)
+    frame.registers[dst] = value
+
+def _load_attr(frame, dst, obj, name):
+    regs = frame.registers
+    regs[dst] = getattr(regs[obj], name)
+
+def _store_attr(frame, obj, name, value):
+    regs = frame.registers
+    setattr(regs[obj], name, regs[value])
+
+def _build_tuple(frame, dst, *srcs):
+    regs = frame.registers
+    regs[dst] = tuple([regs[src] for src in srcs])
+
+def _build_list(frame, dst, *srcs):
+    regs = frame.registers
+    regs[dst] = [regs[src] for src in srcs]
+
+def _get_iter(frame, dst, x):
+    regs = frame.registers
+    regs[dst] = iter(regs[x])
+
+_EXHAUSTED = object()
+
+def _for_iter(frame, dst, target):
+    # Iterator is on the top of value stack
+    value = next(frame.stack[-1], _EXHAUSTED)
+    if value is _EXHAUSTED:
+        frame.stack.pop()
+        frame.f_lasti = target
+        return _JUMPED
+    frame.registers[dst] = value
+
+def _jump(frame, target):
+    frame.f_lasti = target
+    return _JUMPED
+
+def _jump_if_false(frame, x, target):
+    if not frame.registers[x]:
+        frame.f_lasti = target
+        return _JUMPED
+
+def _jump_if_true(frame, x, target):
+    if frame.registers[x]:
+        frame.f_lasti = target
+        return _JUMPED
+
+def _compare_jump_if_false(frame, func, x, y, target):
+    regs = frame.registers
+    if not func(regs[x], regs[y]):
+        frame.f_lasti = target
+        return _JUMPED
+
+def _compare_jump_if_true(frame, func, x, y, target):
+    regs = frame.registers
+    if func(regs[x], regs[y]):
+        frame.f_lasti = target
+        return _JUMPED
+
+def _jump_backward(frame, loop):
+    frame.f_lasti = loop.header
+    return loop.iterate(frame) or _JUMPED
+
+# Conditional jumps fused with the comparison producing their condition
+_COMPARE_JUMPS = {
+    _jump_if_false: _compare_jump_if_false,
+    _jump_if_true: _compare_jump_if_true,
+}
+
+
+def _make_block(start, steps, spills, make_registers):
+    """Make a closure running the IR instructions of a block. Each step is a
+    tuple of (operation, operands, next_offset), and `spills` maps the
+    `next_offset` of the steps to the temporaries holding the values which
+    should be on the value stack if that step raises an exception.
+
+    A jump back to the start of block runs it again directly, unless tracing
+    is enabled meanwhile.
+    """
+    def block(frame):
+        if frame.registers is None:
+            make_registers(frame)
+        tstate = frame.f_tstate
+        next_offset = None
+        try:
+            while True:
+                for operation, operands, next_offset in steps:
+                    frame.f_lasti = next_offset
+                    why = operation(frame, *operands)
+                    if why:
+                        break
+                else:
+                    return None
+                if why is not _JUMPED:
+                    return why
+                if frame.f_lasti != start or tstate.tracefunc is not None:
+                    return None
+        except BaseException:
+            live = spills.get(next_offset)
+            if live:
+                regs = frame.registers
+                frame.stack.extend([regs[r] for r in live])
+            raise
+    return block
+
+
+class _BlockTranslator(object):
+    """Translate the instructions of a block starting from given offset into
+    IR instructions.
+    """
+    def __init__(self, compiled, start):
+        self.compiled = compiled
+        self.start = start
+        self.steps = []
+        self.spills = {}
+        # Registers holding the values which are not pushed onto the value
+        # stack yet
+        self.stack = []
+        self.bound = set(compiled.bound_slots)
+        self.budget = MAX_BLOCK_SIZE
+        self.instr = None
+        # (index, register of result) of the last step if it produces a
+        # value, it's reset once another step is emitted.
+        self.producer = None
+
+    # --- Helpers for emitting IR ---
+
+    def emit(self, operation, *operands, **kwargs):
+        """Append a step. If `raising` is True, the values in `stack` are
+        recorded to be pushed back when it raises an exception.
+        """
+        next_offset = self.instr.next_offset
+        if kwargs.get('raising', True) and self.stack:
+            self.spills[next_offset] = tuple(self.stack)
+        self.steps.append((operation, operands, next_offset))
+        self.producer = None
+
+    def produce(self, operation, *operands):
+        """Emit an instruction writing its result to a new temporary, and
+        push that temporary.
+        """
+        dst = self.temp()
+        self.emit(operation, dst, *operands)
+        self.producer = (len(self.steps) - 1, dst)
+        self.stack.append(dst)
+
+    def temp(self, exclude=()):
+        compiled = self.compiled
+        for reg in range(compiled.temps, compiled.size):
+            if reg not in self.stack and reg not in exclude:
+                return reg
+        raise RuntimeError('no free register')  # pragma: no cover
+
+    def ensure(self, n):
+        """Make sure there are `n` values in registers, the missing ones are
+        popped from the value stack.
+        """
+        missing = n - len(self.stack)
+        if missing <= 0:
+            return
+        dsts = []
+        for _ in range(missing):
+            dsts.append(self.temp(dsts))
+        if missing == 1:
+            self.emit(_pop, dsts[0], raising=False)
+        else:
+            self.emit(_pop_many, *dsts, raising=False)
+        self.stack[:0] = dsts
+
+    def pop(self):
+        self.ensure(1)
+        return self.stack.pop()
+
+    def popn(self, n):
+        """Pop `n` values at once, so that the temporaries popped from the
+        value stack for them are not reused by each other.
+        """
+        if n == 0:
+            return []
+        self.ensure(n)
+        values = self.stack[-n:]
+        del self.stack[-n:]
+        return values
+
+    def flush(self):
+        """Push values in registers onto the value stack."""
+        values = self.stack
+        self.stack = []
+        if len(values) == 1:
+            self.emit(_push, values[0], raising=False)
+        elif values:
+            self.emit(_push_many, *values, raising=False)
+
+    # --- Translation ---
+
+    def translate_block(self):
+        instructions = self.compiled.instructions
+        offset = self.start
+        while self.budget > 0 and offset < len(instructions):
+            self.budget -= 1
+            self.instr = instr = instructions[offset]
+            result = self.translate(instr)
+            if result is _END:
+                return
+            offset = instr.next_offset if result is None else result
+        self.flush()
+        self.emit(_jump, offset, raising=False)
+
+    def translate(self, instr):
+        """Translate an instruction. Returned value is `_END` if the block is
+        ended by it, an offset to continue from, or None for the next one.
+        """
+        # locally lazy-import to avoid circular reference
+        from .ops import (
+            UNARY_OPERATORS, BINARY_OPERATORS, INPLACE_OPERATORS,
+            COMPARE_OPERATORS,
+        )
+
+        name = instr.opname
+        prefix, _, operator = name.partition('_')
+        if prefix == 'UNARY' and operator in UNARY_OPERATORS:
+            self.produce(_unary, UNARY_OPERATORS[operator], self.pop())
+        elif prefix == 'BINARY' and operator in BINARY_OPERATORS:
+            x, y = self.popn(2)
+            self.produce(_binary, BINARY_OPERATORS[operator], x, y)
+        elif prefix == 'INPLACE' and operator in INPLACE_OPERATORS:
+            x, y = self.popn(2)
+            self.produce(_binary, INPLACE_OPERATORS[operator], x, y)
+        elif name == 'COMPARE_OP':
+            x, y = self.popn(2)
+            self.produce(_compare, COMPARE_OPERATORS[instr.arg], x, y)
+        else:
+            translator = getattr(self, name, None)
+            result = NotImplemented if translator is None else translator(instr)
+            if result is NotImplemented:
+                return self.fallback(instr)
+            return result
+        return None
+
+    def fallback(self, instr):
+        """Execute an instruction by its operation."""
+        compiled = self.compiled
+        self.flush()
+        entry = compiled.table[instr.offset]
+        if entry is None or entry.next_offset != instr.next_offset:
+            # It's fused into a superinstruction
+            entry = instr
+        arguments = entry.arguments
+        if arguments and isinstance(arguments[0], Site):
+            compiled.watch(arguments[0])
+        self.emit(compiled.dispatch_table[entry.opcode], *arguments,
+                  raising=False)
+        if instr.opname == 'DELETE_FAST':
+            self.bound.discard(instr.arg)
+        return _END if _ends_block(instr) else None
+
+    def is_produced(self, value):
+        """Check whether a value popped from `stack` is the result of the
+        last step, and it's not used by other entries of `stack`.
+        """
+        producer = self.producer
+        return (producer is not None and producer[1] == value and
+                value not in self.stack)
+
+    def fast(self, instr):
+        """Get the register of a local variable, or None if locals of code
+        object are not stored in slots.
+        """
+        return instr.arg if self.compiled.optimized else None
+
+    # Translators of instructions, their returned values are the same as
+    # `translate`, or `NotImplemented` if the instruction should be executed
+    # by its operation instead.
+
+    def NOP(self, instr):
+        pass
+
+    def POP_TOP(self, instr):
+        if not self.stack:
+            return NotImplemented
+        self.stack.pop()
+
+    def ROT_TWO(self, instr):
+        self.ensure(2)
+        s = self.stack
+        s[-1], s[-2] = s[-2], s[-1]
+
+    def ROT_THREE(self, instr):
+        self.ensure(3)
+        s = self.stack
+        s[-1], s[-2], s[-3] = s[-2], s[-3], s[-1]
+
+    def ROT_FOUR(self, instr):
+        self.ensure(4)
+        s = self.stack
+        s[-1], s[-2], s[-3], s[-4] = s[-2], s[-3], s[-4], s[-1]
+
+    def DUP_TOP(self, instr):
+        self.ensure(1)
+        self.stack.append(self.stack[-1])
+
+    def DUP_TOP_TWO(self, instr):
+        self.ensure(2)
+        self.stack.extend(self.stack[-2:])
+
+    def LOAD_CONST(self, instr):
+        self.stack.append(self.compiled.consts + instr.arg)
+
+    def LOAD_FAST(self, instr):
+        reg = self.fast(instr)
+        if reg is None:
+            return NotImplemented
+        if reg not in self.bound:
+            self.emit(_check_bound, reg)
+            self.bound.add(reg)
+        self.stack.append(reg)
+
+    def STORE_FAST(self, instr):
+        reg = self.fast(instr)
+        if reg is None:
+            return NotImplemented
+        if not self.stack:
+            self.emit(_pop, reg, raising=False)
+            self.bound.add(reg)
+            return None
+        value = self.stack.pop()
+        if reg in self.stack:
+            # Keep the value loaded before for the entries of stack
+            temp = self.temp((value,))
+            self.emit(_move, temp, reg, raising=False)
+            self.stack = [temp if v == reg else v for v in self.stack]
+        elif self.is_produced(value):
+            # Write the result to the slot of local directly
+            index = self.producer[0]
+            operation, operands, next_offset = self.steps[index]
+            self.steps[index] = (
+                operation, (reg,) + operands[1:], next_offset
+            )
+            self.producer = None
+            self.bound.add(reg)
+            return None
+        if value != reg:
+            self.emit(_move, reg, value, raising=False)
+        self.bound.add(reg)
+
+    def LOAD_GLOBAL(self, instr):
+        self.produce(_load_global_to, instr.argval)
+
+    def LOAD_ATTR(self, instr):
+        self.produce(_load_attr, self.pop(), instr.argval)
+
+    def STORE_ATTR(self, instr):
+        value, obj = self.popn(2)
+        self.emit(_store_attr, obj, instr.argval, value)
+
+    def STORE_SUBSCR(self, instr):
+        value, obj, subscr = self.popn(3)
+        self.emit(_store_subscr, obj, subscr, value)
+
+    def BUILD_TUPLE(self, instr):
+        if instr.arg > len(self.stack):
+            # Items pushed by previous blocks are taken from the value stack
+            return self.fallback(instr)
+        self.produce(_build_tuple, *self.popn(instr.arg))
+
+    def BUILD_LIST(self, instr):
+        if instr.arg > len(self.stack):
+            return self.fallback(instr)
+        self.produce(_build_list, *self.popn(instr.arg))
+
+    def GET_ITER(self, instr):
+        self.produce(_get_iter, self.pop())
+
+    def FOR_ITER(self, instr):
+        self.flush()
+        self.produce(_for_iter, instr.jump_target)
+
+    def JUMP_FORWARD(self, instr):
+        return instr.jump_target
+
+    def JUMP_ABSOLUTE(self, instr):
+        target = instr.jump_target
+        if target > instr.offset:
+            return target
+        self.flush()
+        loop = self.compiled.loops.get(instr.offset)
+        if loop is None:
+            self.emit(_jump, target, raising=False)
+        else:
+            self.emit(_jump_backward, loop, raising=False)
+        return _END
+
+    def POP_JUMP_IF_FALSE(self, instr):
+        return self.branch(_jump_if_false, instr)
+
+    def POP_JUMP_IF_TRUE(self, instr):
+        return self.branch(_jump_if_true, instr)
+
+    def branch(self, operation, instr):
+        """Translate a conditional jump, the comparison producing its
+        condition is fused into it if possible.
+        """
+        condition = self.pop()
+        if self.is_produced(condition) and not self.stack:
+            index = self.producer[0]
+            compare, operands, next_offset = self.steps[index]
+            if compare is _compare:
+                # Keep `next_offset` of the comparison, since it's the
+                # instruction raising exceptions.
+                self.steps[index] = (
+                    _COMPARE_JUMPS[operation],
+                    operands[1:] + (instr.jump_target,), next_offset
+                )
+                self.producer = None
+                return None
+        self.flush()
+        self.emit(operation, condition, instr.jump_target)
+        return None
+
+
+class RegisterCode(CompiledCode):
+    """Blocks of a code object translated into register-based IR, indexed by
+    the offset they start from. IR instructions of translated blocks are
+    kept in `steps` for inspection.
+
+    Registers of frame are allocated at the first block it runs.
+    """
+    def __init__(self, code, table, dispatch_table):
+        super(RegisterCode, self).__init__(code, table, dispatch_table)
+        self.instructions = get_instructions(code)
+        self.bound_slots = _get_bound_slots(code, self.instructions)
+        self.optimized = bool(code.co_flags & CO_OPTIMIZED)
+        # Offsets of the regions of constants and temporaries
+        self.consts = len(code.co_varnames) if self.optimized else 0
+        self.temps = self.consts + len(code.co_consts)
+        self.size = self.temps + code.co_stacksize
+        self.template = list(code.co_consts) + [None] * code.co_stacksize
+        # Loops closed by backward jumps, indexed by the offset of jumps
+        self.loops = {
+            instr.offset: find_loop(code, instr.offset)
+            for instr in self.instructions
+            if instr is not None and instr.opname == 'JUMP_ABSOLUTE' and
+            instr.jump_target <= instr.offset
+        }
+        self.steps = {}
+
+    def compile_block(self, offset):
+        translator = _BlockTranslator(self, offset)
+        translator.translate_block()
+        steps = self.steps[offset] = tuple(translator.steps)
+        return _make_block(
+            offset, steps, translator.spills, self.make_registers
+        )
+
+    def make_registers(self, frame):
+        """Allocate the registers of frame after its fast locals."""
+        registers = frame.fastlocals if self.optimized else []
+        registers.extend(self.template)
+        frame.registers = registers
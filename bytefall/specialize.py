@@ -0,0 +1,888 @@
+"""
+Quickening of instructions with specialized operations.
+
+Similar to the specializing adaptive interpreter of CPython 3.11 (PEP 659),
+instructions which can be specialized are replaced by an adaptive operation
+in the instruction stream executed by frames. After being executed a number
+of times, the adaptive operation checks types of its operands (or the
+namespace a name is found in) and rewrites the entry in place to a specialized
+operation for them.
+
+Specialized operations guard the types of their operands, and fall back to
+the generic operation if the guard fails. A site is deoptimized to the
+adaptive operation after too many misses, and it stays with the generic
+operation after too many failed attempts.
+
+Backward jumps are quickened into `JUMP_BACKWARD`, which counts iterations
+of the loop closed by it. Once that loop is hot, it's handed to the trace JIT
+of vm to be recorded and compiled into a trace. (see `tracejit.py`)
+
+Specialized operations, superinstructions (see `superinstructions.py`) and
+operations introduced by passes (see `passes.py`) are appended to the
+dispatch table of vm, and their opcodes start from 256. (see also
+`vm.py::build_dispatch_table`)
+"""
+from collections import namedtuple
+
+from ._internal.cache import CodeObjectCache
+from ._internal.utils import get_operations
+from .objects import Function, Method
+from .objects.codeobject import get_instructions
+from .objects.generatorobject import AsyncGenerator, AsyncGenASend, _gen_set_yf
+from .passes import optimize, PASS_OPS
+from .superinstructions import fuse, SUPERINSTRUCTION_OPS
+
+
+__all__ = [
+    'quicken', 'get_specialization_stats', 'get_loop_stats', 'QUICKENED_OPS',
+]
+
+
+# Number of executions before the first attempt to specialize a site
+ADAPTIVE_WARMUP = 8
+# Number of executions before the next attempt after a failure or deopt
+ADAPTIVE_BACKOFF = 64
+# Number of failed guards before a specialized site is deoptimized
+MISS_LIMIT = 16
+# Number of failures and deopts before a site is left with generic operation
+MAX_ATTEMPTS = 4
+# Number of iterations of a loop before the frame running it is moved to
+# compiled tiers, if the trace JIT is disabled.
+LOOP_WARMUP = 200
+
+
+_Namedtuple_SiteStats = namedtuple(
+    'SiteStats',
+    'offset, opname, state, specialized, specializations, misses, deopts'
+)
+
+class SiteStats(_Namedtuple_SiteStats):
+    """State of a site of instruction which can be specialized.
+
+    - offset, opname: offset and name of the original instruction
+    - state: 'adaptive', 'specialized' or 'generic'
+    - specialized: name of the specialized operation, None if it's not
+    - specializations: number of times it has been specialized
+    - misses: number of failed guards in the specialized operations
+    - deopts: number of times it has been deoptimized
+    """
+    __slots__ = ()
+
+
+class Site(object):
+    """A site of instruction in a quickened instruction stream."""
+    __slots__ = [
+        'table', 'instr', 'generic', 'state', 'specialized', 'counter',
+        'budget', 'failures', 'specializations', 'misses', 'deopts', 'cache',
+        'operation', 'arguments', 'watchers',
+    ]
+
+    def __init__(self, table, instr, generic):
+        self.table = table
+        self.instr = instr
+        self.generic = generic
+        self.specialized = None
+        self.counter = ADAPTIVE_WARMUP
+        self.budget = 0
+        self.failures = 0
+        self.specializations = 0
+        self.misses = 0
+        self.deopts = 0
+        # Data used by the specialized operation, it's set by specializer
+        self.cache = None
+        # Callbacks called with this site after it's rewritten
+        self.watchers = []
+        self._rewrite('adaptive', ADAPTIVE)
+
+    def _rewrite(self, state, opcode):
+        self.state = state
+        instr = self.instr
+        if state == 'generic':
+            self.table[instr.offset] = instr
+            self.operation, self.arguments = self.generic, instr.arguments
+        else:
+            arguments = (self,) + instr.arguments
+            self.table[instr.offset] = instr._replace(
+                opcode=opcode, arguments=arguments
+            )
+            self.operation = QUICKENED_OPS[opcode - 256][1]
+            self.arguments = arguments
+        for watcher in self.watchers:
+            watcher(self)
+
+    def run(self, frame):
+        """Execute the current operation of this site, it's used by the
+        superinstructions which end with this site.
+        """
+        return self.operation(frame, *self.arguments)
+
+    def specialize(self, frame):
+        """Rewrite this site to an operation specialized for the operands on
+        the value stack of given frame.
+        """
+        self.cache = None
+        name = _SPECIALIZERS[self.instr.opname](frame, self)
+        if name is None:
+            self.failures += 1
+            self._backoff()
+            return
+        self.specialized = name
+        self.specializations += 1
+        self.budget = MISS_LIMIT
+        self._rewrite('specialized', QUICKENED_OPCODE[name])
+
+    def miss(self, frame, *args):
+        """Handle a failed guard of the specialized operation, and execute
+        the generic operation instead.
+        """
+        self.misses += 1
+        self.budget -= 1
+        if self.budget <= 0:
+            self.deopts += 1
+            self.specialized = None
+            self._backoff()
+        return self.generic(frame, *args)
+
+    def _backoff(self):
+        if self.failures + self.deopts >= MAX_ATTEMPTS:
+            self._rewrite('generic', None)
+        else:
+            self.counter = ADAPTIVE_BACKOFF
+            self._rewrite('adaptive', ADAPTIVE)
+
+    def stats(self):
+        return SiteStats(
+            self.instr.offset, self.instr.opname, self.state, self.specialized,
+            self.specializations, self.misses, self.deopts
+        )
+
+
+_Namedtuple_LoopStats = namedtuple(
+    'LoopStats', 'offset, header, state, traces, misses, failures'
+)
+
+class LoopStats(_Namedtuple_LoopStats):
+    """State of a loop closed by a backward jump.
+
+    - offset: offset of the backward jump
+    - header: offset of the first instruction of loop (target of the jump)
+    - state: 'new', 'warming', 'traced' or 'generic'
+    - traces: number of traces compiled for this loop
+    - misses: number of failed guards in the traces
+    - failures: number of aborted recordings and discarded traces
+    """
+    __slots__ = ()
+
+
+class Loop(object):
+    """A backward jump closing a loop in a quickened instruction stream.
+
+    The jump counts iterations of the loop. At the first time its counter
+    runs out, the counter is reset to the threshold of trace JIT of vm. At
+    the next time, an iteration of the loop is recorded into a trace, which
+    runs the following iterations.
+
+    If the loop can't be traced, the frame running it is moved to compiled
+    tiers instead. (see `VirtualMachine.osr`)
+    """
+    __slots__ = [
+        'table', 'entry', 'header', 'generic', 'arguments', 'state',
+        'counter', 'budget', 'trace', 'traces', 'misses', 'failures',
+    ]
+
+    def __init__(self, table, entry, generic):
+        self.table = table
+        self.entry = entry
+        self.header = entry.jump_target
+        # Operation of the jump (or the superinstruction ending with it)
+        self.generic = generic
+        self.arguments = entry.arguments
+        self.state = 'new'
+        self.counter = 1
+        self.budget = 0
+        self.trace = None
+        self.traces = 0
+        self.misses = 0
+        self.failures = 0
+        table[entry.offset] = entry._replace(
+            opcode=QUICKENED_OPCODE['JUMP_BACKWARD'], arguments=(self,)
+        )
+
+    def tier_up(self, frame):
+        """Hand this loop to the trace JIT since its counter runs out.
+        It's called right after the jump, so that `f_lasti` of frame is the
+        header of loop.
+        """
+        interp = frame.f_tstate.interp
+        jit = interp.trace_jit
+        if self.state == 'new':
+            self.state = 'warming'
+            self.counter = LOOP_WARMUP if jit is None else jit.threshold
+            return None
+        if jit is None:
+            self._rewrite_generic()
+        else:
+            why = jit.record(frame, self)
+            if why or self.state != 'generic':
+                return why
+        return interp.osr(frame)
+
+    def iterate(self, frame):
+        """Run the following iterations by the trace or count an iteration,
+        it's called by compiled tiers right after jumping to the header
+        without executing the generic operation.
+        """
+        trace = self.trace
+        if trace is not None:
+            return trace.run(frame)
+        if self.state == 'generic':
+            return None
+        self.counter -= 1
+        if self.counter <= 0:
+            return self.tier_up(frame)
+        return None
+
+    def attach(self, trace):
+        """Run the following iterations by given trace."""
+        self.state = 'traced'
+        self.trace = trace
+        self.traces += 1
+        self.budget = MISS_LIMIT
+
+    def abort(self):
+        """Handle a recording which is aborted."""
+        self.failures += 1
+        self._backoff()
+
+    def give_up(self):
+        """Leave this loop with the generic jump, since it can't be traced
+        in any case.
+        """
+        self.failures += 1
+        self._rewrite_generic()
+
+    def miss(self):
+        """Handle a failed guard of the trace, which is discarded after too
+        many misses.
+        """
+        self.misses += 1
+        self.budget -= 1
+        if self.budget <= 0:
+            self.trace = None
+            self.failures += 1
+            self._backoff()
+
+    def _backoff(self):
+        if self.failures >= MAX_ATTEMPTS:
+            self._rewrite_generic()
+        else:
+            self.state = 'warming'
+            self.counter = ADAPTIVE_BACKOFF
+
+    def _rewrite_generic(self):
+        self.state = 'generic'
+        self.trace = None
+        self.table[self.entry.offset] = self.entry
+
+    def stats(self):
+        return LoopStats(
+            self.entry.offset, self.header, self.state, self.traces,
+            self.misses, self.failures
+        )
+
+
+def JUMP_BACKWARD(frame, loop):
+    loop.generic(frame, *loop.arguments)
+    trace = loop.trace
+    if trace is not None:
+        return trace.run(frame)
+    loop.counter -= 1
+    if loop.counter <= 0:
+        return loop.tier_up(frame)
+
+
+def adaptive_operation(frame, site, *args):
+    site.counter -= 1
+    if site.counter <= 0:
+        site.specialize(frame)
+    return site.generic(frame, *args)
+
+
+# --- Specialized operations ---
+# Operands are read from the value stack before checking their types, so that
+# the stack is left untouched when the guard fails.
+
+def BINARY_ADD_INT(frame, site):
+    stack = frame.stack
+    y = stack[-1]
+    if y.__class__ is int:
+        x = stack[-2]
+        if x.__class__ is int:
+            del stack[-1]
+            stack[-1] = x + y
+            return
+    return site.miss(frame)
+
+def BINARY_SUBTRACT_INT(frame, site):
+    stack = frame.stack
+    y = stack[-1]
+    if y.__class__ is int:
+        x = stack[-2]
+        if x.__class__ is int:
+            del stack[-1]
+            stack[-1] = x - y
+            return
+    return site.miss(frame)
+
+def BINARY_MULTIPLY_INT(frame, site):
+    stack = frame.stack
+    y = stack[-1]
+    if y.__class__ is int:
+        x = stack[-2]
+        if x.__class__ is int:
+            del stack[-1]
+            stack[-1] = x * y
+            return
+    return site.miss(frame)
+
+def BINARY_ADD_FLOAT(frame, site):
+    stack = frame.stack
+    y = stack[-1]
+    if y.__class__ is float:
+        x = stack[-2]
+        if x.__class__ is float:
+            del stack[-1]
+            stack[-1] = x + y
+            return
+    return site.miss(frame)
+
+def BINARY_SUBTRACT_FLOAT(frame, site):
+    stack = frame.stack
+    y = stack[-1]
+    if y.__class__ is float:
+        x = stack[-2]
+        if x.__class__ is float:
+            del stack[-1]
+            stack[-1] = x - y
+            return
+    return site.miss(frame)
+
+def BINARY_MULTIPLY_FLOAT(frame, site):
+    stack = frame.stack
+    y = stack[-1]
+    if y.__class__ is float:
+        x = stack[-2]
+        if x.__class__ is float:
+            del stack[-1]
+            stack[-1] = x * y
+            return
+    return site.miss(frame)
+
+def BINARY_ADD_STR(frame, site):
+    stack = frame.stack
+    y = stack[-1]
+    if y.__class__ is str:
+        x = stack[-2]
+        if x.__class__ is str:
+            del stack[-1]
+            stack[-1] = x + y
+            return
+    return site.miss(frame)
+
+def BINARY_SUBSCR_LIST_INT(frame, site):
+    stack = frame.stack
+    y = stack[-1]
+    if y.__class__ is int:
+        x = stack[-2]
+        if x.__class__ is list:
+            del stack[-1]
+            stack[-1] = x[y]
+            return
+    return site.miss(frame)
+
+def BINARY_SUBSCR_DICT(frame, site):
+    stack = frame.stack
+    x = stack[-2]
+    if x.__class__ is dict:
+        y = stack.pop()
+        stack[-1] = x[y]
+        return
+    return site.miss(frame)
+
+
+def COMPARE_OP_INT_LT(frame, site, opnum):
+    stack = frame.stack
+    y = stack[-1]
+    if y.__class__ is int:
+        x = stack[-2]
+        if x.__class__ is int:
+            del stack[-1]
+            stack[-1] = x < y
+            return
+    return site.miss(frame, opnum)
+
+def COMPARE_OP_INT_LE(frame, site, opnum):
+    stack = frame.stack
+    y = stack[-1]
+    if y.__class__ is int:
+        x = stack[-2]
+        if x.__class__ is int:
+            del stack[-1]
+            stack[-1] = x <= y
+            return
+    return site.miss(frame, opnum)
+
+def COMPARE_OP_INT_EQ(frame, site, opnum):
+    stack = frame.stack
+    y = stack[-1]
+    if y.__class__ is int:
+        x = stack[-2]
+        if x.__class__ is int:
+            del stack[-1]
+            stack[-1] = x == y
+            return
+    return site.miss(frame, opnum)
+
+def COMPARE_OP_INT_NE(frame, site, opnum):
+    stack = frame.stack
+    y = stack[-1]
+    if y.__class__ is int:
+        x = stack[-2]
+        if x.__class__ is int:
+            del stack[-1]
+            stack[-1] = x != y
+            return
+    return site.miss(frame, opnum)
+
+def COMPARE_OP_INT_GT(frame, site, opnum):
+    stack = frame.stack
+    y = stack[-1]
+    if y.__class__ is int:
+        x = stack[-2]
+        if x.__class__ is int:
+            del stack[-1]
+            stack[-1] = x > y
+            return
+    return site.miss(frame, opnum)
+
+def COMPARE_OP_INT_GE(frame, site, opnum):
+    stack = frame.stack
+    y = stack[-1]
+    if y.__class__ is int:
+        x = stack[-2]
+        if x.__class__ is int:
+            del stack[-1]
+            stack[-1] = x >= y
+            return
+    return site.miss(frame, opnum)
+
+
+# A unique object to denote that an iterator is exhausted
+_EXHAUSTED = object()
+
+_range_iterator = type(iter(range(0)))
+_list_iterator = type(iter([]))
+
+def FOR_ITER_RANGE(frame, site, jump):
+    it = frame.stack[-1]
+    if it.__class__ is not _range_iterator:
+        return site.miss(frame, jump)
+    value = next(it, _EXHAUSTED)
+    if value is _EXHAUSTED:
+        frame.stack.pop()
+        frame.f_lasti = jump
+    else:
+        frame.stack.append(value)
+
+def FOR_ITER_LIST(frame, site, jump):
+    it = frame.stack[-1]
+    if it.__class__ is not _list_iterator:
+        return site.miss(frame, jump)
+    value = next(it, _EXHAUSTED)
+    if value is _EXHAUSTED:
+        frame.stack.pop()
+        frame.f_lasti = jump
+    else:
+        frame.stack.append(value)
+
+
+# Version tags of dict (PEP 509) are not accessible from Python, and reading
+# them through `ctypes` is slower than probing the dict. Namespaces of modules
+# can't be replaced by a watched subclass of dict either. So that the caches
+# of names remember which namespace a name was resolved in, and a hit costs a
+# single probe of that namespace (plus the check that the name is not shadowed
+# by a namespace searched before it). Hence they never go stale.
+
+def LOAD_GLOBAL_MODULE(frame, site, name):
+    try:
+        frame.stack.append(frame.f_globals[name])
+    except KeyError:
+        return site.miss(frame, name)
+
+def LOAD_GLOBAL_BUILTIN(frame, site, name):
+    if name not in frame.f_globals:
+        try:
+            frame.stack.append(frame.f_builtins[name])
+            return
+        except KeyError:
+            pass
+    return site.miss(frame, name)
+
+def LOAD_NAME_LOCAL(frame, site, name):
+    try:
+        frame.stack.append(frame._f_locals[name])
+    except KeyError:
+        return site.miss(frame, name)
+
+def LOAD_NAME_GLOBAL(frame, site, name):
+    # Names of module are loaded by `LOAD_NAME` with `f_locals is f_globals`
+    f_globals = frame.f_globals
+    if frame._f_locals is f_globals or name not in frame._f_locals:
+        try:
+            frame.stack.append(f_globals[name])
+            return
+        except KeyError:
+            pass
+    return site.miss(frame, name)
+
+def LOAD_NAME_BUILTIN(frame, site, name):
+    f_globals = frame.f_globals
+    if name not in f_globals and (
+        frame._f_locals is f_globals or name not in frame._f_locals):
+        try:
+            frame.stack.append(frame.f_builtins[name])
+            return
+        except KeyError:
+            pass
+    return site.miss(frame, name)
+
+
+# Caches of attributes are keyed by the type of receiver. Since version tags of
+# types are not accessible from Python, the caches are validated by checking
+# that `__mro__` is not reassigned, the attribute is still the same object in
+# the dict of the class defining it, and it's not shadowed by the dict of
+# instance or classes before that class in `__mro__`. (`site.cache` is built
+# by `_specialize_method`) `__getattribute__` could be assigned to the class
+# after specialization, so it's checked before reading the dict of instance,
+# which is read without going through that hook.
+
+_object_getattribute = object.__getattribute__
+
+def LOAD_METHOD_FUNCTION(frame, site, name, type=type):
+    stack = frame.stack
+    obj = stack[-1]
+    cls, mro, owner_dict, func, shadows, has_dict = site.cache
+    if (type(obj) is cls and cls.__mro__ is mro and
+        cls.__getattribute__ is _object_getattribute and
+        owner_dict.get(name) is func and
+        not (has_dict and
+             name in _object_getattribute(obj, '__dict__'))):
+        for namespace in shadows:
+            if name in namespace:
+                break
+        else:
+            # Push the function with `self` as the first argument, so that
+            # `CALL_METHOD` calls it without a bound `Method`.
+            stack[-1] = func
+            stack.append(obj)
+            return
+    return site.miss(frame, name)
+
+def LOAD_ATTR_METHOD(frame, site, name, type=type):
+    stack = frame.stack
+    obj = stack[-1]
+    cls, mro, owner_dict, func, shadows, has_dict = site.cache
+    if (type(obj) is cls and cls.__mro__ is mro and
+        cls.__getattribute__ is _object_getattribute and
+        owner_dict.get(name) is func and
+        not (has_dict and
+             name in _object_getattribute(obj, '__dict__'))):
+        for namespace in shadows:
+            if name in namespace:
+                break
+        else:
+            # Same as `Function.__get__`, but without looking it up
+            stack[-1] = Method(obj, cls, func)
+            return
+    return site.miss(frame, name)
+
+
+# `async for` over an async generator of vm. The awaitable of `__anext__()` is
+# reused by the iterations of the same generator, and the value yielded by
+# that generator is pushed without raising a StopIteration for it.
+
+def GET_ANEXT_ASYNC_GEN(frame, site):
+    aiter = frame.stack[-1]
+    if aiter.__class__ is not AsyncGenerator:
+        return site.miss(frame)
+    frame.stack.append(aiter._anext())
+
+def YIELD_FROM_ASYNC_GEN(frame, site):
+    stack = frame.stack
+    x = stack[-2]
+    if x.__class__ is not AsyncGenASend:
+        return site.miss(frame)
+    u = stack.pop()
+    try:
+        yielded, value = x._send(u)
+    except StopIteration as e:
+        _gen_set_yf(frame.generator, None)
+        stack[-1] = e.value
+        return
+    except BaseException:
+        _gen_set_yf(frame.generator, None)
+        raise
+    if yielded:
+        _gen_set_yf(frame.generator, None)
+        stack[-1] = value
+        return
+    # Suspend the frame at this instruction as `YIELD_FROM` does
+    frame.f_tstate.return_value = value
+    frame.f_lasti = site.instr.offset
+    _gen_set_yf(frame.generator, x)
+    return 'yield'
+
+
+# --- Specializers ---
+# Each of them returns the name of specialized operation for the operands on
+# the value stack, or None if there is no suitable one. Data required by that
+# operation can be stored in `site.cache`.
+
+_ARITHMETIC_SPECIALIZATIONS = {
+    'ADD': {int: 'BINARY_ADD_INT', float: 'BINARY_ADD_FLOAT',
+            str: 'BINARY_ADD_STR'},
+    'SUBTRACT': {int: 'BINARY_SUBTRACT_INT', float: 'BINARY_SUBTRACT_FLOAT'},
+    'MULTIPLY': {int: 'BINARY_MULTIPLY_INT', float: 'BINARY_MULTIPLY_FLOAT'},
+}
+
+def _specialize_arithmetic(frame, site):
+    x, y = frame.stack[-2:]
+    if x.__class__ is not y.__class__:
+        return None
+    operator = site.instr.opname.split('_', 1)[1]
+    candidates = _ARITHMETIC_SPECIALIZATIONS[operator]
+    return candidates.get(x.__class__)
+
+def _specialize_subscr(frame, site):
+    x, y = frame.stack[-2:]
+    if x.__class__ is list and y.__class__ is int:
+        return 'BINARY_SUBSCR_LIST_INT'
+    if x.__class__ is dict:
+        return 'BINARY_SUBSCR_DICT'
+    return None
+
+_COMPARE_SPECIALIZATIONS = [
+    'COMPARE_OP_INT_LT', 'COMPARE_OP_INT_LE', 'COMPARE_OP_INT_EQ',
+    'COMPARE_OP_INT_NE', 'COMPARE_OP_INT_GT', 'COMPARE_OP_INT_GE',
+]
+
+def _specialize_compare(frame, site):
+    x, y = frame.stack[-2:]
+    opnum = site.instr.arg
+    if x.__class__ is int and y.__class__ is int:
+        if opnum < len(_COMPARE_SPECIALIZATIONS):
+            return _COMPARE_SPECIALIZATIONS[opnum]
+    return None
+
+def _specialize_for_iter(frame, site):
+    it = frame.stack[-1]
+    if it.__class__ is _range_iterator:
+        return 'FOR_ITER_RANGE'
+    if it.__class__ is _list_iterator:
+        return 'FOR_ITER_LIST'
+    return None
+
+def _specialize_load_global(frame, site):
+    name = site.instr.argval
+    if name in frame.f_globals:
+        return 'LOAD_GLOBAL_MODULE'
+    if name in frame.f_builtins:
+        return 'LOAD_GLOBAL_BUILTIN'
+    return None
+
+def _specialize_load_name(frame, site):
+    name = site.instr.argval
+    if name in frame._f_locals:
+        return ('LOAD_NAME_GLOBAL' if frame._f_locals is frame.f_globals
+                else 'LOAD_NAME_LOCAL')
+    if name in frame.f_globals:
+        return 'LOAD_NAME_GLOBAL'
+    if name in frame.f_builtins:
+        return 'LOAD_NAME_BUILTIN'
+    return None
+
+def _specialize_method(frame, site):
+    name = site.instr.argval
+    obj = frame.stack[-1]
+    cls = type(obj)
+    if cls.__getattribute__ is not _object_getattribute:
+        return None
+
+    # Find the class defining this attribute. (`typeobject.c::_PyType_Lookup`)
+    mro = cls.__mro__
+    for i, klass in enumerate(mro):
+        if name in klass.__dict__:
+            break
+    else:
+        return None
+    func = klass.__dict__[name]
+    if not isinstance(func, Function):
+        return None
+
+    instance_dict = getattr(obj, '__dict__', None)
+    has_dict = isinstance(instance_dict, dict)
+    if has_dict and name in instance_dict:
+        return None
+
+    shadows = tuple(klass.__dict__ for klass in mro[:i])
+    site.cache = (cls, mro, mro[i].__dict__, func, shadows, has_dict)
+    if site.instr.opname == 'LOAD_METHOD':
+        return 'LOAD_METHOD_FUNCTION'
+    return 'LOAD_ATTR_METHOD'
+
+def _specialize_get_anext(frame, site):
+    if frame.stack[-1].__class__ is AsyncGenerator:
+        return 'GET_ANEXT_ASYNC_GEN'
+    return None
+
+def _specialize_yield_from(frame, site):
+    if frame.stack[-2].__class__ is AsyncGenASend:
+        return 'YIELD_FROM_ASYNC_GEN'
+    return None
+
+_SPECIALIZERS = {
+    'BINARY_ADD': _specialize_arithmetic,
+    'BINARY_SUBTRACT': _specialize_arithmetic,
+    'BINARY_MULTIPLY': _specialize_arithmetic,
+    'INPLACE_ADD': _specialize_arithmetic,
+    'INPLACE_SUBTRACT': _specialize_arithmetic,
+    'INPLACE_MULTIPLY': _specialize_arithmetic,
+    'BINARY_SUBSCR': _specialize_subscr,
+    'COMPARE_OP': _specialize_compare,
+    'FOR_ITER': _specialize_for_iter,
+    'LOAD_GLOBAL': _specialize_load_global,
+    'LOAD_NAME': _specialize_load_name,
+    'LOAD_ATTR': _specialize_method,
+    'LOAD_METHOD': _specialize_method,
+    'GET_ANEXT': _specialize_get_anext,
+    'YIELD_FROM': _specialize_yield_from,
+}
+
+
+# Operations appended to the dispatch table, in the order of their opcodes.
+SPECIALIZED_OPS = [
+    ('ADAPTIVE', adaptive_operation),
+    ('BINARY_ADD_INT', BINARY_ADD_INT),
+    ('BINARY_SUBTRACT_INT', BINARY_SUBTRACT_INT),
+    ('BINARY_MULTIPLY_INT', BINARY_MULTIPLY_INT),
+    ('BINARY_ADD_FLOAT', BINARY_ADD_FLOAT),
+    ('BINARY_SUBTRACT_FLOAT', BINARY_SUBTRACT_FLOAT),
+    ('BINARY_MULTIPLY_FLOAT', BINARY_MULTIPLY_FLOAT),
+    ('BINARY_ADD_STR', BINARY_ADD_STR),
+    ('BINARY_SUBSCR_LIST_INT', BINARY_SUBSCR_LIST_INT),
+    ('BINARY_SUBSCR_DICT', BINARY_SUBSCR_DICT),
+    ('COMPARE_OP_INT_LT', COMPARE_OP_INT_LT),
+    ('COMPARE_OP_INT_LE', COMPARE_OP_INT_LE),
+    ('COMPARE_OP_INT_EQ', COMPARE_OP_INT_EQ),
+    ('COMPARE_OP_INT_NE', COMPARE_OP_INT_NE),
+    ('COMPARE_OP_INT_GT', COMPARE_OP_INT_GT),
+    ('COMPARE_OP_INT_GE', COMPARE_OP_INT_GE),
+    ('FOR_ITER_RANGE', FOR_ITER_RANGE),
+    ('FOR_ITER_LIST', FOR_ITER_LIST),
+    ('LOAD_GLOBAL_MODULE', LOAD_GLOBAL_MODULE),
+    ('LOAD_GLOBAL_BUILTIN', LOAD_GLOBAL_BUILTIN),
+    ('LOAD_NAME_LOCAL', LOAD_NAME_LOCAL),
+    ('LOAD_NAME_GLOBAL', LOAD_NAME_GLOBAL),
+    ('LOAD_NAME_BUILTIN', LOAD_NAME_BUILTIN),
+    ('LOAD_METHOD_FUNCTION', LOAD_METHOD_FUNCTION),
+    ('LOAD_ATTR_METHOD', LOAD_ATTR_METHOD),
+    ('GET_ANEXT_ASYNC_GEN', GET_ANEXT_ASYNC_GEN),
+    ('YIELD_FROM_ASYNC_GEN', YIELD_FROM_ASYNC_GEN),
+    ('JUMP_BACKWARD', JUMP_BACKWARD),
+]
+
+# All operations used by quickened instruction streams, and their opcodes.
+QUICKENED_OPS = SPECIALIZED_OPS + SUPERINSTRUCTION_OPS + PASS_OPS
+QUICKENED_OPCODE = {name: 256 + i for i, (name, _) in enumerate(QUICKENED_OPS)}
+ADAPTIVE = QUICKENED_OPCODE['ADAPTIVE']
+
+
+_quickened_cache = CodeObjectCache()
+_sites_cache = CodeObjectCache()
+_loops_cache = CodeObjectCache()
+
+
+def _is_backward_jump(entry):
+    return (entry.opname.endswith('JUMP_ABSOLUTE') and
+            entry.jump_target <= entry.offset)
+
+def quicken(code):
+    """Get the instruction stream to be executed by vm.
+
+    It is a copy of the decoded instructions (`codeobject.get_instructions`)
+    rewritten by the passes of `passes.py`, with sequences of instructions
+    fused into superinstructions, the other specializable instructions
+    replaced by adaptive operation, and backward jumps replaced by
+    `JUMP_BACKWARD`. Dead instructions are not quickened. It is shared by all
+    frames of the same code object.
+    """
+    table = _quickened_cache.get(code)
+    if table is None:
+        table = list(get_instructions(code))
+        dead = optimize(code, table, QUICKENED_OPCODE)
+        cls_op = get_operations()
+        sites = {}
+        for instr in get_instructions(code):
+            if instr is None or instr.offset in dead:
+                continue
+            # It could be skipping the instructions removed by passes
+            entry = table[instr.offset]
+            if entry.opname == instr.opname and entry.opname in _SPECIALIZERS:
+                generic = getattr(cls_op, entry.opname)
+                sites[entry.offset] = Site(table, entry, generic)
+
+        # Sites replaced by superinstructions are never executed
+        for offset in fuse(table, code, QUICKENED_OPCODE, sites):
+            sites.pop(offset, None)
+        sites = sorted(sites.values(), key=lambda site: site.instr.offset)
+
+        loops = []
+        for entry in list(table):
+            if (entry is not None and entry.offset not in dead and
+                _is_backward_jump(entry)):
+                if entry.opcode < 256:
+                    generic = getattr(cls_op, entry.opname)
+                else:
+                    generic = QUICKENED_OPS[entry.opcode - 256][1]
+                loops.append(Loop(table, entry, generic))
+        _quickened_cache.set(code, table)
+        _sites_cache.set(code, sites)
+        _loops_cache.set(code, loops)
+    return table
+
+
+def get_specialization_stats(code):
+    """Get a list of `SiteStats` for the sites of instruction which can be
+    specialized in given code object. It's empty if that code object has
+    not been executed yet.
+    """
+    return [site.stats() for site in _sites_cache.get(code, [])]
+
+
+def find_loop(code, offset):
+    """Get the `Loop` closed by the backward jump at given offset, which
+    could be fused into a superinstruction. It's None if that jump is not
+    quickened yet.
+    """
+    for loop in _loops_cache.get(code, []):
+        entry = loop.entry
+        if entry.offset <= offset < entry.next_offset:
+            return loop
+    return None
+
+
+def get_loop_stats(code):
+    """Get a list of `LoopStats` for the backward jumps in given code object.
+    It's empty if that code object has not been executed yet.
+    """
+    return [loop.stats() for loop in _loops_cache.get(code, [])]
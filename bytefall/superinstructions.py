@@ -0,0 +1,401 @@
+"""
+Superinstructions: operations fusing a sequence of instructions.
+
+A sequence of instructions which are frequently executed one after another
+is replaced by a single operation in the quickened instruction stream (see
+`specialize.quicken`), so that it costs one dispatch instead of two or three.
+Entries of the fused instructions other than the first one are left in the
+stream, so that jumping to them still works.
+
+Sequences to be fused are chosen from `FREQUENCIES`, which is a table of
+sequences counted while running programs in the virtual machine. It can be
+regenerated by:
+
+    $ python -m bytefall.superinstructions [YOUR_SCRIPT.py] [args ...]
+"""
+import sys
+import weakref
+from collections import Counter
+
+from .objects import UNBOUND
+from .objects.codeobject import get_instructions, get_line_table
+
+
+__all__ = ['fuse', 'count_sequences', 'SUPERINSTRUCTION_OPS']
+
+
+# Number of times a sequence of instructions is executed one after another,
+# sequences which are not listed here are not fused. It's generated by running
+# some loop-heavy and call-heavy scripts with the command shown above, and
+# only the most frequent ones are kept.
+FREQUENCIES = {
+    ('LOAD_FAST', 'LOAD_FAST'): 870002,
+    ('STORE_FAST', 'LOAD_FAST'): 590002,
+    ('STORE_FAST', 'JUMP_ABSOLUTE'): 490000,
+    ('LOAD_FAST', 'LOAD_CONST'): 463782,
+    ('LOAD_GLOBAL', 'LOAD_FAST'): 451896,
+    ('LOAD_FAST', 'CALL_FUNCTION'): 400007,
+    ('FOR_ITER', 'STORE_FAST'): 390000,
+    ('CALL_FUNCTION', 'BINARY_ADD'): 340945,
+    ('INPLACE_ADD', 'STORE_FAST'): 320000,
+    ('BINARY_ADD', 'LOAD_GLOBAL'): 300000,
+    ('LOAD_GLOBAL', 'LOAD_FAST', 'CALL_FUNCTION'): 270006,
+    ('LOAD_FAST', 'LOAD_GLOBAL'): 270000,
+    ('STORE_FAST', 'LOAD_FAST', 'LOAD_GLOBAL'): 270000,
+    ('LOAD_FAST', 'LOAD_GLOBAL', 'LOAD_FAST'): 270000,
+    ('BINARY_ADD', 'STORE_FAST'): 270000,
+    ('FOR_ITER', 'STORE_FAST', 'LOAD_FAST'): 230000,
+    ('INPLACE_ADD', 'STORE_FAST', 'JUMP_ABSOLUTE'): 220000,
+    ('BINARY_ADD', 'STORE_FAST', 'JUMP_ABSOLUTE'): 210000,
+    ('LOAD_CONST', 'BINARY_MULTIPLY'): 200000,
+    ('LOAD_FAST', 'LOAD_CONST', 'BINARY_MULTIPLY'): 200000,
+    ('LOAD_FAST', 'LOAD_FAST', 'LOAD_FAST'): 200000,
+    ('COMPARE_OP', 'POP_JUMP_IF_FALSE'): 181893,
+    ('LOAD_FAST', 'BINARY_ADD'): 180000,
+    ('CALL_FUNCTION', 'BINARY_ADD', 'STORE_FAST'): 180000,
+    ('LOAD_FAST', 'LOAD_ATTR'): 180000,
+    ('LOAD_CONST', 'CALL_FUNCTION'): 150009,
+    ('LOAD_GLOBAL', 'LOAD_CONST'): 150006,
+    ('LOAD_GLOBAL', 'LOAD_CONST', 'CALL_FUNCTION'): 150006,
+    ('LOAD_FAST', 'CALL_FUNCTION', 'BINARY_ADD'): 150000,
+    ('CALL_FUNCTION', 'BINARY_ADD', 'LOAD_GLOBAL'): 150000,
+    ('LOAD_GLOBAL', 'BINARY_ADD'): 150000,
+    ('BINARY_ADD', 'LOAD_GLOBAL', 'BINARY_ADD'): 150000,
+    ('LOAD_GLOBAL', 'BINARY_ADD', 'LOAD_GLOBAL'): 150000,
+    ('BINARY_ADD', 'LOAD_GLOBAL', 'LOAD_CONST'): 150000,
+    ('LOAD_CONST', 'CALL_FUNCTION', 'BINARY_ADD'): 150000,
+    ('LOAD_FAST', 'LOAD_METHOD'): 145714,
+    ('POP_JUMP_IF_FALSE', 'LOAD_FAST'): 140946,
+    ('COMPARE_OP', 'POP_JUMP_IF_FALSE', 'LOAD_FAST'): 140946,
+    ('BINARY_ADD', 'RETURN_VALUE'): 130945,
+    ('STORE_FAST', 'LOAD_GLOBAL'): 130006,
+    ('STORE_FAST', 'LOAD_GLOBAL', 'LOAD_FAST'): 130002,
+    ('STORE_FAST', 'LOAD_FAST', 'LOAD_CONST'): 130001,
+    ('POP_JUMP_IF_FALSE', 'LOAD_FAST', 'LOAD_FAST'): 130000,
+    ('FOR_ITER', 'STORE_FAST', 'LOAD_GLOBAL'): 130000,
+    ('LOAD_FAST', 'STORE_ATTR'): 120001,
+    ('LOAD_FAST', 'LOAD_FAST', 'BINARY_ADD'): 120000,
+    ('LOAD_FAST', 'BINARY_ADD', 'RETURN_VALUE'): 120000,
+    ('CALL_FUNCTION', 'INPLACE_ADD'): 120000,
+    ('LOAD_FAST', 'CALL_FUNCTION', 'INPLACE_ADD'): 120000,
+    ('CALL_FUNCTION', 'INPLACE_ADD', 'STORE_FAST'): 120000,
+    ('STORE_FAST', 'LOAD_FAST', 'LOAD_FAST'): 100001,
+    ('LOAD_FAST', 'COMPARE_OP'): 100001,
+    ('LOAD_FAST', 'LOAD_FAST', 'COMPARE_OP'): 100001,
+    ('LOAD_FAST', 'COMPARE_OP', 'POP_JUMP_IF_FALSE'): 100001,
+    ('CALL_FUNCTION', 'LOAD_FAST'): 100001,
+    ('LOAD_FAST', 'LOAD_FAST', 'LOAD_CONST'): 100000,
+    ('BINARY_MULTIPLY', 'INPLACE_ADD'): 100000,
+    ('LOAD_CONST', 'BINARY_MULTIPLY', 'INPLACE_ADD'): 100000,
+    ('BINARY_MULTIPLY', 'INPLACE_ADD', 'STORE_FAST'): 100000,
+    ('INPLACE_ADD', 'STORE_FAST', 'LOAD_FAST'): 100000,
+    ('LOAD_CONST', 'INPLACE_ADD'): 100000,
+    ('LOAD_FAST', 'LOAD_CONST', 'INPLACE_ADD'): 100000,
+    ('LOAD_CONST', 'INPLACE_ADD', 'STORE_FAST'): 100000,
+    ('LOAD_GLOBAL', 'LOAD_FAST', 'LOAD_FAST'): 100000,
+}
+
+# Maximum number of kinds of sequences to be fused
+MAX_SUPERINSTRUCTIONS = 16
+
+
+def _load_fast_checked(frame, *indices):
+    """Push local variables one by one, and raise `UnboundLocalError` at the
+    first one which is not bound. It's the slow path of operations below.
+    """
+    for index in indices:
+        val = frame.fastlocals[index]
+        if val is UNBOUND:
+            raise UnboundLocalError(
+                "local variable '%s' referenced before assignment"
+                % frame.f_code.co_varnames[index])
+        frame.stack.append(val)
+
+
+def LOAD_FAST__LOAD_FAST(frame, first, second):
+    fastlocals = frame.fastlocals
+    x = fastlocals[first]
+    y = fastlocals[second]
+    if x is UNBOUND or y is UNBOUND:
+        return _load_fast_checked(frame, first, second)
+    frame.stack.extend((x, y))
+
+def LOAD_FAST__LOAD_ATTR(frame, index, site):
+    # `LOAD_ATTR` is run through its site, so that it's still specialized
+    x = frame.fastlocals[index]
+    if x is UNBOUND:
+        return _load_fast_checked(frame, index)
+    frame.stack.append(x)
+    return site.run(frame)
+
+def LOAD_FAST__LOAD_CONST(frame, index, const):
+    x = frame.fastlocals[index]
+    if x is UNBOUND:
+        return _load_fast_checked(frame, index)
+    frame.stack.extend((x, const))
+
+def STORE_FAST__LOAD_FAST(frame, first, second):
+    stack = frame.stack
+    fastlocals = frame.fastlocals
+    fastlocals[first] = stack[-1]
+    x = fastlocals[second]
+    if x is UNBOUND:
+        del stack[-1]
+        return _load_fast_checked(frame, second)
+    stack[-1] = x
+
+def STORE_FAST__JUMP_ABSOLUTE(frame, index, jump):
+    frame.fastlocals[index] = frame.stack.pop()
+    frame.f_lasti = jump
+
+def LOAD_FAST__RETURN_VALUE(frame, index):
+    x = frame.fastlocals[index]
+    if x is UNBOUND:
+        return _load_fast_checked(frame, index)
+    frame.f_tstate.return_value = x
+    if frame.generator:
+        frame.generator._finished = True
+    return 'return'
+
+def LOAD_CONST__RETURN_VALUE(frame, const):
+    frame.f_tstate.return_value = const
+    if frame.generator:
+        frame.generator._finished = True
+    return 'return'
+
+def LOAD_FAST__LOAD_FAST__BINARY_ADD(frame, first, second):
+    fastlocals = frame.fastlocals
+    x = fastlocals[first]
+    y = fastlocals[second]
+    if x is UNBOUND or y is UNBOUND:
+        return _load_fast_checked(frame, first, second)
+    frame.stack.append(x + y)
+
+def LOAD_FAST__LOAD_CONST__BINARY_ADD(frame, index, const):
+    x = frame.fastlocals[index]
+    if x is UNBOUND:
+        return _load_fast_checked(frame, index)
+    frame.stack.append(x + const)
+
+def LOAD_FAST__LOAD_CONST__INPLACE_ADD(frame, index, const):
+    x = frame.fastlocals[index]
+    if x is UNBOUND:
+        return _load_fast_checked(frame, index)
+    x += const
+    frame.stack.append(x)
+
+
+# Comparison is done inline, so that there is one operation for each kind of
+# rich comparison. (the order is the same as `dis.cmp_op`)
+
+def COMPARE_OP_LT__POP_JUMP_IF_FALSE(frame, opnum, jump):
+    stack = frame.stack
+    y = stack.pop()
+    if not stack.pop() < y:
+        frame.f_lasti = jump
+
+def COMPARE_OP_LE__POP_JUMP_IF_FALSE(frame, opnum, jump):
+    stack = frame.stack
+    y = stack.pop()
+    if not stack.pop() <= y:
+        frame.f_lasti = jump
+
+def COMPARE_OP_EQ__POP_JUMP_IF_FALSE(frame, opnum, jump):
+    stack = frame.stack
+    y = stack.pop()
+    if not stack.pop() == y:
+        frame.f_lasti = jump
+
+def COMPARE_OP_NE__POP_JUMP_IF_FALSE(frame, opnum, jump):
+    stack = frame.stack
+    y = stack.pop()
+    if not stack.pop() != y:
+        frame.f_lasti = jump
+
+def COMPARE_OP_GT__POP_JUMP_IF_FALSE(frame, opnum, jump):
+    stack = frame.stack
+    y = stack.pop()
+    if not stack.pop() > y:
+        frame.f_lasti = jump
+
+def COMPARE_OP_GE__POP_JUMP_IF_FALSE(frame, opnum, jump):
+    stack = frame.stack
+    y = stack.pop()
+    if not stack.pop() >= y:
+        frame.f_lasti = jump
+
+
+_COMPARE_JUMPS = [
+    'COMPARE_OP_LT__POP_JUMP_IF_FALSE', 'COMPARE_OP_LE__POP_JUMP_IF_FALSE',
+    'COMPARE_OP_EQ__POP_JUMP_IF_FALSE', 'COMPARE_OP_NE__POP_JUMP_IF_FALSE',
+    'COMPARE_OP_GT__POP_JUMP_IF_FALSE', 'COMPARE_OP_GE__POP_JUMP_IF_FALSE',
+]
+
+def _select_compare_jump(instrs):
+    opnum = instrs[0].arg
+    return _COMPARE_JUMPS[opnum] if opnum < len(_COMPARE_JUMPS) else None
+
+def _select_by_opnames(instrs):
+    return '__'.join(instr.opname for instr in instrs)
+
+
+# Sequences which can be fused, and functions selecting the operation for the
+# given instructions (None if they can't be fused).
+_CANDIDATES = {
+    ('LOAD_FAST', 'LOAD_FAST'): _select_by_opnames,
+    ('LOAD_FAST', 'LOAD_ATTR'): _select_by_opnames,
+    ('LOAD_FAST', 'LOAD_CONST'): _select_by_opnames,
+    ('STORE_FAST', 'LOAD_FAST'): _select_by_opnames,
+    ('STORE_FAST', 'JUMP_ABSOLUTE'): _select_by_opnames,
+    ('LOAD_FAST', 'RETURN_VALUE'): _select_by_opnames,
+    ('LOAD_CONST', 'RETURN_VALUE'): _select_by_opnames,
+    ('LOAD_FAST', 'LOAD_FAST', 'BINARY_ADD'): _select_by_opnames,
+    ('LOAD_FAST', 'LOAD_CONST', 'BINARY_ADD'): _select_by_opnames,
+    ('LOAD_FAST', 'LOAD_CONST', 'INPLACE_ADD'): _select_by_opnames,
+    ('COMPARE_OP', 'POP_JUMP_IF_FALSE'): _select_compare_jump,
+}
+
+# Superinstructions ending with a specializable instruction, which is run
+# through its site instead of being done inline.
+_RUN_BY_SITE = {'LOAD_FAST__LOAD_ATTR'}
+
+# Operations appended to the dispatch table after specialized operations.
+SUPERINSTRUCTION_OPS = [
+    ('LOAD_FAST__LOAD_FAST', LOAD_FAST__LOAD_FAST),
+    ('LOAD_FAST__LOAD_ATTR', LOAD_FAST__LOAD_ATTR),
+    ('LOAD_FAST__LOAD_CONST', LOAD_FAST__LOAD_CONST),
+    ('STORE_FAST__LOAD_FAST', STORE_FAST__LOAD_FAST),
+    ('STORE_FAST__JUMP_ABSOLUTE', STORE_FAST__JUMP_ABSOLUTE),
+    ('LOAD_FAST__RETURN_VALUE', LOAD_FAST__RETURN_VALUE),
+    ('LOAD_CONST__RETURN_VALUE', LOAD_CONST__RETURN_VALUE),
+    ('LOAD_FAST__LOAD_FAST__BINARY_ADD', LOAD_FAST__LOAD_FAST__BINARY_ADD),
+    ('LOAD_FAST__LOAD_CONST__BINARY_ADD', LOAD_FAST__LOAD_CONST__BINARY_ADD),
+    ('LOAD_FAST__LOAD_CONST__INPLACE_ADD', LOAD_FAST__LOAD_CONST__INPLACE_ADD),
+] + [(name, globals()[name]) for name in _COMPARE_JUMPS]
+
+
+def select_sequences(frequencies, limit=MAX_SUPERINSTRUCTIONS):
+    """Choose the sequences to be fused from a table of frequencies, the most
+    frequent ones which can be fused are chosen. Returned sequences are sorted
+    by the order to be matched: longer ones first, then more frequent ones.
+    """
+    chosen = sorted(
+        [seq for seq in frequencies if seq in _CANDIDATES],
+        key=lambda seq: frequencies[seq], reverse=True
+    )[:limit]
+    return sorted(chosen, key=lambda seq: (len(seq), frequencies[seq]),
+        reverse=True)
+
+_ENABLED_SEQUENCES = select_sequences(FREQUENCIES)
+
+
+def fuse(table, code, opcodes, sites, sequences=None):
+    """Replace sequences of instructions in `table` by superinstructions in
+    place, and return offsets of the replaced entries.
+
+    `opcodes` maps the name of superinstruction to its opcode, and `sites`
+    maps offsets to the sites of specializable instructions. Instructions
+    are fused only if they are in the same line, so that line numbers looked
+    up by `f_lasti` are not changed, and none of them is rewritten by passes.
+    (see `passes.py`)
+    """
+    sequences = _ENABLED_SEQUENCES if sequences is None else sequences
+    longest = max([len(seq) for seq in sequences] or [0])
+    line_table = get_line_table(code)
+    instructions = get_instructions(code)
+    fused = []
+
+    instrs = [instr for instr in instructions if instr is not None]
+    i = 0
+    while i < len(instrs):
+        window = instrs[i:i+longest]
+        opnames = tuple(instr.opname for instr in window)
+        for seq in sequences:
+            n = len(seq)
+            if opnames[:n] != seq:
+                continue
+            lineno = line_table.lineno(window[0].offset)
+            if any(line_table.lineno(instr.offset) != lineno
+                   for instr in window[1:n]):
+                continue
+            if any(table[instr.offset].opname != instr.opname or
+                   table[instr.offset].next_offset != instr.next_offset
+                   for instr in window[:n]):
+                continue
+            name = _CANDIDATES[seq](window[:n])
+            if name is None:
+                continue
+            first, last = window[0], window[n-1]
+            if name in _RUN_BY_SITE:
+                if last.offset not in sites:
+                    continue
+                arguments = first.arguments + (sites[last.offset],)
+            else:
+                arguments = ()
+                for instr in window[:n]:
+                    arguments += instr.arguments
+            table[first.offset] = first._replace(
+                opcode=opcodes[name], opname=name, arguments=arguments,
+                next_offset=last.next_offset, jump_target=last.jump_target
+            )
+            fused.append(first.offset)
+            i += n - 1
+            break
+        i += 1
+    return fused
+
+
+def count_sequences(filename, args, lengths=(2, 3)):
+    """Run a script in virtual machine, and count the sequences of
+    instructions executed one after another.
+    """
+    from .execfile import run_python_file
+    from ._internal.utils import get_vm
+
+    counts = Counter()
+    histories = weakref.WeakKeyDictionary()
+    longest = max(lengths)
+
+    def counter(opname, oparg, frame):
+        # `f_lasti` has been advanced to the next instruction, and the
+        # previous instruction is executed right before it only if it's not
+        # jumped.
+        history = histories.get(frame)
+        f_lasti = frame.f_lasti
+        if history is None or history[0] != _start_offset(frame, f_lasti):
+            history = (None, ())
+        names = (history[1] + (opname,))[-longest:]
+        histories[frame] = (f_lasti, names)
+        for n in lengths:
+            if len(names) >= n:
+                counts[names[-n:]] += 1
+
+    vm = get_vm()
+    settings = vm._show_oparg, vm._oparg_logger
+    vm._show_oparg, vm._oparg_logger = True, counter
+    try:
+        run_python_file(filename, [filename] + list(args))
+    finally:
+        vm._show_oparg, vm._oparg_logger = settings
+    return counts
+
+
+def _start_offset(frame, next_offset):
+    """Get the offset of instruction ending at `next_offset`."""
+    instructions = get_instructions(frame.f_code)
+    offset = next_offset - 1
+    while offset >= 0 and instructions[offset] is None:
+        offset -= 1
+    return offset if offset >= 0 else None
+
+
+def main(argv):
+    counts = count_sequences(argv[0], argv[1:])
+    print('FREQUENCIES = {')
+    for seq, count in counts.most_common(MAX_SUPERINSTRUCTIONS * 4):
+        print('    %r: %d,' % (seq, count))
+    print('}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,349 @@
+"""
+Trace-recording JIT for hot loops.
+
+Backward jumps count iterations of the loops closed by them (see `Loop` in
+`specialize.py`). Once a loop is hot, an iteration of it is executed by the
+generic operations of decoded instructions while the path it takes is
+recorded, together with the types of operands seen by arithmetic operations
+and comparisons. The recorded path is then compiled into a host function by
+the generator of Python source (see `codegen.py`), which runs the following
+iterations of that loop in a `while` loop.
+
+Operands of builtin types are guarded to have the types recorded, and the
+types of values produced from them are propagated, so that they are not
+guarded again. The direction of a conditional jump not taken while recording
+is translated as `codegen.py` does, without guards, until it reaches the
+header again or leaves the loop.
+
+When a guard fails or the loop is left, values in variables are pushed back
+onto the value stack and `f_lasti` is set to the instruction to be executed
+next, so that the interpreter continues with the frame intact. A trace is
+discarded after too many of its type guards fail, and the loop will be
+recorded again.
+
+Recording is aborted if the iteration leaves the loop, jumps back to another
+loop (only the innermost loops are traced), yields, or returns a reason
+(why) other than 'call'. Frames running the loops which can't be traced are
+moved to compiled tiers instead (see `VirtualMachine.osr`). Functions called
+in a trace are run to the end by a nested loop of vm, so that the trace
+doesn't have to be left at each call.
+"""
+from .closurecompiler import _JUMPING_OPS
+from .codegen import (
+    _BlockGenerator, _END, _BINARY_OPERATORS, _get_bound_slots
+)
+from .objects.codeobject import get_instructions
+
+
+__all__ = ['TraceJIT', 'Trace']
+
+
+# Number of iterations of a loop before it's recorded
+DEFAULT_TRACE_THRESHOLD = 200
+
+# Maximum number of instructions recorded in a trace
+MAX_TRACE_LENGTH = 256
+
+# Maximum number of frames run by nested loops of vm for calls in traces,
+# the following calls leave traces instead.
+MAX_NESTED_RUNS = 16
+
+# Operations which can't be recorded, since they change `f_lasti` without
+# having a jump target or suspend the frame.
+_UNTRACEABLE_OPS = _JUMPING_OPS | {'YIELD_VALUE'}
+
+# Types of operands which are guarded. Operations on them can't be overridden,
+# so that the types of their results are known.
+_GUARDED_TYPES = frozenset([int, float, complex, bool, str, bytes, list,
+                            tuple, dict])
+
+_IMMUTABLE_TYPES = frozenset([int, float, complex, bool, str, bytes, tuple])
+
+# Operators returning `int` for int operands, and `float` for float operands
+_INT_OPERATORS = {
+    'ADD', 'SUBTRACT', 'MULTIPLY', 'FLOOR_DIVIDE', 'MODULO', 'LSHIFT',
+    'RSHIFT', 'AND', 'XOR', 'OR',
+}
+_FLOAT_OPERATORS = {
+    'ADD', 'SUBTRACT', 'MULTIPLY', 'TRUE_DIVIDE', 'FLOOR_DIVIDE', 'MODULO',
+}
+# Types of operands which rich comparisons return `bool` for. (containers
+# compare their items, which could return anything)
+_COMPARED_TYPES = frozenset([int, float, str])
+
+
+def _is_guarded(instr):
+    """Check whether the types of operands of given instruction are recorded
+    and guarded.
+    """
+    prefix, _, operator = instr.opname.partition('_')
+    if prefix in ('BINARY', 'INPLACE'):
+        return operator in _BINARY_OPERATORS or operator == 'SUBSCR'
+    # Rich comparisons only
+    return instr.opname == 'COMPARE_OP' and instr.arg < 6
+
+
+def _operand_types(frame, instr):
+    """Get the types of operands of an instruction to be executed, or None if
+    they are not guarded.
+    """
+    if not _is_guarded(instr):
+        return None
+    types = tuple(value.__class__ for value in frame.stack[-2:])
+    if len(types) == 2 and all(t in _GUARDED_TYPES for t in types):
+        return types
+    return None
+
+
+def _result_type(instr, types):
+    """Get the type of the value produced by an instruction with operands of
+    given types, or None if it's unknown.
+    """
+    if instr.opname == 'COMPARE_OP':
+        if all(t in _COMPARED_TYPES for t in types):
+            return bool
+        return None
+    prefix, _, operator = instr.opname.partition('_')
+    if prefix not in ('BINARY', 'INPLACE') or types[0] is not types[1]:
+        return None
+    cls = types[0]
+    if cls is int:
+        if operator in _INT_OPERATORS:
+            return int
+        return float if operator == 'TRUE_DIVIDE' else None
+    if cls is float and operator in _FLOAT_OPERATORS:
+        return float
+    if cls is str and operator == 'ADD':
+        return str
+    return None
+
+
+class _TraceGenerator(_BlockGenerator):
+    """Generate the source of a trace. Instructions are translated in the
+    order they are recorded, and the directions of branches not taken while
+    recording are translated by following their jumps until the loop is
+    left or the header is reached again.
+    """
+    def __init__(self, trace, jit):
+        super(_TraceGenerator, self).__init__(trace, trace.loop.header)
+        self.end = trace.loop.entry.next_offset
+        self.run_callee = self.bind(jit.run_callee, 'r')
+        self.guard_failed = self.bind(trace.guard_failed, 'g')
+        # Whether the recorded path is being translated, and whether the jump
+        # of current instruction is taken while recording.
+        self.recording = True
+        self.taken = False
+        # Types of values held in variables, which are known from guards and
+        # the operations producing them.
+        self.known = {}
+
+    def generate(self, offset=None):
+        if offset is not None:
+            # A branch not taken while recording
+            return super(_TraceGenerator, self).generate(offset)
+        for instr, types, taken in self.generated.recorded:
+            self.instr, self.taken = instr, taken
+            if types is not None:
+                self.guard(types)
+            result = self.translate(instr, types)
+            if result is _END:
+                return
+            if types is not None:
+                cls = _result_type(instr, types)
+                if cls is not None:
+                    self.known[self.stack[-1]] = cls
+        self.flush()
+        self.goto(self.start)
+
+    def is_exit(self, offset):
+        return not self.start < offset < self.end
+
+    def translate(self, instr, types=None):
+        prefix, _, operator = instr.opname.partition('_')
+        if (prefix == 'INPLACE' and operator in _BINARY_OPERATORS and
+            types is not None and all(t in _IMMUTABLE_TYPES for t in types)):
+            # In-place operators are the same as binary ones for immutable
+            # types, they are translated into a single expression.
+            y = self.pop()
+            x = self.pop()
+            self.assign('%s %s %s' % (x, _BINARY_OPERATORS[operator], y))
+            return None
+        return super(_TraceGenerator, self).translate(instr)
+
+    def guard(self, types):
+        """Leave the trace if the operands on top of stack don't have the
+        recorded types.
+        """
+        self.ensure(len(types))
+        operands = self.stack[-len(types):]
+        checks = [
+            '%s.__class__ is not %s' % (value, self.constant(cls))
+            for value, cls in zip(operands, types)
+            if self.known.get(value) is not cls
+        ]
+        if not checks:
+            return
+        self.emit('if %s:' % ' or '.join(sorted(set(checks))), mapped=False)
+        self.depth += 1
+        self.spill(self.stack)
+        self.emit('return %s(frame, %d)' % (
+            self.guard_failed, self.instr.offset
+        ), mapped=False)
+        self.depth -= 1
+        self.known.update(zip(operands, types))
+
+    def branch(self, condition, target, values, offset=None, prologue=()):
+        if not self.recording:
+            return super(_TraceGenerator, self).branch(
+                condition, target, values, offset, prologue
+            )
+        # The recorded direction goes on in the trace, and the other one is
+        # translated into the body of `if` statement.
+        epilogue = ()
+        if self.taken:
+            condition = 'not (%s)' % condition
+            values, self.stack = self.stack, list(values)
+            target = self.instr.next_offset
+            prologue, epilogue = (), prologue
+
+        self.emit('if %s:' % condition, offset=offset)
+        self.depth += 1
+        for line in prologue:
+            self.emit(line, mapped=False)
+        if target > self.instr.offset and not self.is_exit(target):
+            state = (self.stack, self.cached, self.bound, self.known,
+                     self.instr)
+            self.stack = list(values)
+            self.cached, self.bound = dict(self.cached), set(self.bound)
+            self.known = dict(self.known)
+            self.recording = False
+            self.generate(target)
+            self.recording = True
+            self.stack, self.cached, self.bound, self.known, self.instr = state
+        else:
+            self.spill(values)
+            self.goto(target)
+        self.depth -= 1
+        for line in epilogue:
+            self.emit(line, mapped=False)
+
+    def check_reason(self, instr):
+        if instr.opname.startswith('CALL_'):
+            self.emit("if why == 'call':", mapped=False)
+            self.emit('why = %s(frame)' % self.run_callee, 1, mapped=False)
+        super(_TraceGenerator, self).check_reason(instr)
+
+    def LOAD_CONST(self, instr):
+        super(_TraceGenerator, self).LOAD_CONST(instr)
+        self.known[self.stack[-1]] = instr.argval.__class__
+
+    def LOAD_FAST(self, instr):
+        if instr.arg not in self.cached:
+            self.known.pop('l%d' % instr.arg, None)
+        return super(_TraceGenerator, self).LOAD_FAST(instr)
+
+    def STORE_FAST(self, instr):
+        cls = self.known.get(self.stack[-1]) if self.stack else None
+        super(_TraceGenerator, self).STORE_FAST(instr)
+        self.known['l%d' % instr.arg] = cls
+
+
+class Trace(object):
+    """A recorded iteration of loop compiled into a host function, `run` is
+    called with a frame at the header of loop.
+
+    `recorded` is a list of (instruction, types of operands, whether its jump
+    is taken) in the order they are executed, and the source compiled from
+    them is kept in `source` for inspection.
+    """
+    def __init__(self, jit, code, loop, recorded):
+        self.loop = loop
+        self.recorded = recorded
+        self.instructions = get_instructions(code)
+        self.table = jit.vm.get_instructions(code)
+        self.dispatch_table = jit.vm.dispatch_table
+        self.bound_slots = _get_bound_slots(code, self.instructions)
+        self.filename = '<bytefall trace: %s>' % code.co_name
+
+        generator = _TraceGenerator(self, jit)
+        generator.generate()
+        self.source, values = generator.assemble()
+        namespace = {}
+        exec(compile(self.source, self.filename, 'exec'), namespace)
+        self.run = namespace['make_block'](*values)
+
+    def guard_failed(self, frame, offset):
+        """Leave the trace at the instruction whose type guard fails."""
+        frame.f_lasti = offset
+        self.loop.miss()
+
+
+class TraceJIT(object):
+    """Record hot loops into traces. Loops are hot after `threshold`
+    iterations.
+    """
+    def __init__(self, vm, threshold=DEFAULT_TRACE_THRESHOLD):
+        self.vm = vm
+        self.threshold = threshold
+        # Number of frames being run by `run_callee`
+        self.depth = 0
+
+    def record(self, frame, loop):
+        """Execute an iteration of loop from its header, and compile the
+        recorded path into a trace attached to it. Returned value is the
+        same as operations, and recording is aborted if it's not None.
+        """
+        instructions = get_instructions(frame.f_code)
+        dispatch_table = self.vm.dispatch_table
+        tstate = frame.f_tstate
+        start, end = loop.header, loop.entry.next_offset
+        recorded = []
+        try:
+            while True:
+                instr = instructions[frame.f_lasti]
+                if (instr.opname in _UNTRACEABLE_OPS or
+                    len(recorded) >= MAX_TRACE_LENGTH):
+                    loop.abort()
+                    return None
+                types = _operand_types(frame, instr)
+                frame.f_lasti = instr.next_offset
+                why = dispatch_table[instr.opcode](frame, *instr.arguments)
+                if why == 'call':
+                    why = self.run_callee(frame)
+                if why or tstate.tracefunc is not None:
+                    loop.abort()
+                    return why
+
+                offset = frame.f_lasti
+                recorded.append((instr, types, offset != instr.next_offset))
+                if offset == start:
+                    break
+                if offset <= instr.offset:
+                    # Jumping back to an inner loop
+                    loop.give_up()
+                    return None
+                if not start <= offset < end:
+                    loop.abort()
+                    return None
+        except BaseException:
+            loop.abort()
+            raise
+        loop.attach(Trace(self, frame.f_code, loop, recorded))
+        return None
+
+    def run_callee(self, frame):
+        """Run the frame of callee pushed by a call in a trace to the end,
+        and push its returned value. The callee is left to the loop of vm,
+        and 'call' is returned, if there are too many nested loops.
+        """
+        if self.depth >= MAX_NESTED_RUNS:
+            return 'call'
+        vm = self.vm
+        callee = vm.frame
+        vm.pop_frame()
+        self.depth += 1
+        try:
+            frame.stack.append(vm.run(callee))
+        finally:
+            self.depth -= 1
+        return None
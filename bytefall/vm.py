@@ -12,41 +12,80 @@ import dis, builtins, sys
 import six
 
 from ._internal.base import Singleton
-from ._internal.utils import get_operations, check_line_number
-from ._internal.cache import GlobalCache
+from ._internal.utils import get_vm, get_operations, check_line_number
 from ._internal.exceptions import VirtualMachineError
+from ._internal.pystate import ThreadState
 from ._internal.tracer import OPTracer
+from .objects.codeobject import get_instructions
 from .objects.frameobject import Frame
+from .specialize import quicken, QUICKENED_OPS
+from .closurecompiler import ClosureCompiler, CompiledCode, DEFAULT_THRESHOLD
+from .registers import RegisterCode
+from .codegen import CodeGenerator, DEFAULT_CODEGEN_THRESHOLD
+from .tracejit import TraceJIT, DEFAULT_TRACE_THRESHOLD
 
 
-# build a map for opcodes that defined in `dis.hasconst`, `dis.hasfree`, ...
-SPECIAL_COLLECTION = {v: getattr(dis, v) for v in dir(dis) if v[:3] == 'has'}
-SPECIAL_OPCODE = {}
-for name, values in SPECIAL_COLLECTION.items():
-    SPECIAL_OPCODE.update({v: name for v in values})
-
-COLLECTION_PROCESS = {
-    'hasconst': lambda f, code, int_arg: code.co_consts[int_arg],
-    'hasfree': lambda f, code, int_arg: (code.co_cellvars[int_arg]
-        if int_arg < len(code.co_cellvars) else
-        code.co_freevars[int_arg - len(code.co_cellvars)]),
-    'hasname': lambda f, code, int_arg: code.co_names[int_arg],
-    'haslocal': lambda f, code, int_arg: code.co_varnames[int_arg],
-    'hasjrel': lambda f, code, int_arg: f.f_lasti + int_arg,
-}
+# Default value of maximum depth of frames, it is the same as CPython.
+DEFAULT_RECURSION_LIMIT = 1000
 
 
 class VirtualMachine(metaclass=Singleton):
     def __init__(self, config=None):
         self.frames = []
         self.frame = None
+        self.tstate = ThreadState(self)
         self.cls_op = get_operations()  # local lazy-import to avoid circular reference
+        self.dispatch_table = build_dispatch_table(self.cls_op)
+
+        # Table used by the loop running without tracing. Its entries will be
+        # replaced in place by `_leave_fast_loop` while tracing is enabled, so
+        # that all running loops can be switched at their next instruction.
+        self._fast_table = list(self.dispatch_table)
 
         config = config if config is not None else {}
         self._debug = config.get('debug', False)
-        self._oparg_logger = _prepare_oparg_logger(config.get('show_oparg', False))
+        self._show_oparg = config.get('show_oparg', False)
+        self._oparg_logger = _prepare_oparg_logger(self._show_oparg)
         self._trace_opcode = config.get('trace_opcode', False)
 
+        # Frames of `Function` called by operations are pushed onto `frames`
+        # and executed in the same loop of their caller, so that the depth of
+        # frames is limited by this value instead of the stack of host.
+        self.recursion_limit = config.get(
+            'recursion_limit', DEFAULT_RECURSION_LIMIT
+        )
+
+        # Hot code objects are translated into register-based IR (or compiled
+        # into closures of basic blocks), and hotter ones are translated into
+        # Python source.
+        threshold = None
+        if config.get('closure_tier', True):
+            threshold = config.get('closure_threshold', DEFAULT_THRESHOLD)
+        if config.get('register_tier', True):
+            blocks = RegisterCode
+        else:
+            blocks = CompiledCode
+        if config.get('codegen_tier', True):
+            self.compiler = CodeGenerator(self, threshold, config.get(
+                'codegen_threshold', DEFAULT_CODEGEN_THRESHOLD
+            ), blocks)
+        elif threshold is not None:
+            self.compiler = ClosureCompiler(self, threshold, blocks)
+        else:
+            self.compiler = None
+
+        # Frames running hot loops which can't be traced are moved to the
+        # compiled tiers.
+        self._osr = config.get('osr', True)
+
+        # Hot loops are recorded and compiled into traces
+        if config.get('trace_jit', True):
+            self.trace_jit = TraceJIT(self, config.get(
+                'trace_threshold', DEFAULT_TRACE_THRESHOLD
+            ))
+        else:
+            self.trace_jit = None
+
     def run_code(self, code, f_globals=None, f_locals=None):
         if f_globals is None: f_globals = builtins.globals()
         if f_locals is None:  f_locals = f_globals
@@ -55,28 +94,69 @@ class VirtualMachine(metaclass=Singleton):
         frame = Frame(code, f_globals, f_locals, None, None)
         return self.run(frame)
 
+    def get_instructions(self, code):
+        """ Get the instruction stream to be executed by frames of given code
+        object, specializable instructions in it are quickened.
+        """
+        return quicken(code)
+
+    def get_compiled(self, code):
+        """ Get the compiled blocks to be executed by a new frame of given
+        code object, it's None if that code object is not hot enough or the
+        compiled tiers are disabled.
+        """
+        if self.compiler is None:
+            return None
+        return self.compiler.get(code)
+
+    def osr(self, frame):
+        """ Move a frame running a hot loop to the compiled tiers, that is
+        on-stack replacement. The value stack, local variables and block
+        stack are kept in frame, so that the compiled blocks continue from
+        `f_lasti` of frame directly.
+
+        Returned value is a reason making the loop running that frame leave,
+        or None if the frame is not moved.
+        """
+        if not self._osr or self.compiler is None or frame.compiled is not None:
+            return None
+        frame.compiled = self.compiler.compile(frame.f_code)
+        return _OSR
+
     def run(self, frame, exc=None):
         self.push_frame(frame)
-        why = None
         _call_trace_protected(self.frame, 'call', None)
+        return self._run(frame, 'exception' if exc is not None else None)
+
+    def _run(self, entry, why):
+        """ Run the pushed frame `entry` and frames called by it until `entry`
+        returns, yields or raises, starting with given reason (None to
+        execute the next instruction of `entry`).
+        """
+        frame = entry
+        tstate = frame.f_tstate
 
         while True:
-            if exc is not None:
-                why = 'exception'
-                exc = None
-            elif why is None:
-                byte_name, arguments = self.parse_byte_and_args()
-                self._oparg_logger(byte_name, arguments, self.frame)
-                why = self.dispatch(byte_name, arguments)
-
-            if why == 'extended_arg':
-                # NOTE: for those operations requires additional byte for
-                # argument representation.
-                arg_offset = GlobalCache().pop('oparg')
-                byte_name, arguments = self.parse_byte_and_args(arg_offset=arg_offset)
-                self._oparg_logger(byte_name, arguments, self.frame)
-                why = self.dispatch(byte_name, arguments)
+            if why is None:
+                if tstate.tracefunc is None and not self._show_oparg:
+                    compiled = frame.compiled
+                    if compiled is None:
+                        why = self.eval_fast(frame)
+                    else:
+                        why = self.eval_compiled(frame, compiled)
+                else:
+                    why = self.eval_instrumented(frame)
+                if why is None:
+                    # Tracing is enabled or disabled, or the frame is moved to
+                    # compiled tiers, run again with another loop.
+                    continue
+            if why == 'call':
+                # Frame of callee is pushed by operation, run it here.
+                frame = self.frame
+                _call_trace_protected(frame, 'call', None)
+                why = None
                 continue
+
             if why == 'exception':
                 _call_exc_trace(self.frame)
             if why == 'reraise':
@@ -84,26 +164,44 @@ class VirtualMachine(metaclass=Singleton):
             if why != 'yield':
                 while why and frame.block_stack:
                     why = frame.manage_block_stack(why)
-            if why:
+            if not why:
+                continue
+            if frame is entry:
                 break
 
-        func = GlobalCache().get('tracefunc', None)
-        obj = GlobalCache().get('traceobj', None)
-        retval = GlobalCache().get('return_value', None)
+            # Leave the frame of callee, and resume its caller with the
+            # returned value or the exception.
+            why = self.leave_frame(frame, why)
+            frame = self.frame
+            if why == 'return':
+                frame.push(tstate.return_value)
+                why = None
+
+        why = self.leave_frame(frame, why)
+        if why == 'exception':
+            six.reraise(*tstate.last_exception)
+
+        return tstate.return_value
+
+    def leave_frame(self, frame, why):
+        """ Call trace function for leaving a frame and pop it. """
+        tstate = frame.f_tstate
+        retval = tstate.return_value
 
         if why in ['return', 'yield']:
-            if _call_trace(func, obj, self.frame, 'return', retval):
+            if _call_trace(tstate.tracefunc, tstate.traceobj, frame, 'return', retval):
                 why = 'exception'
         elif why == 'exception':
-            _call_trace_protected(self.frame, 'return', None)
+            _call_trace_protected(frame, 'return', None)
 
+        # Value might be overwritten by code executed by trace function
+        tstate.return_value = retval
         self.pop_frame()
-        if why == 'exception':
-            six.reraise(*GlobalCache().get('last_exception'))
-
-        return retval
+        return why
 
     def push_frame(self, frame):
+        if len(self.frames) >= self.recursion_limit:
+            raise RecursionError('maximum recursion depth exceeded')
         self.frames.append(frame)
         self.frame = frame
 
@@ -117,10 +215,116 @@ class VirtualMachine(metaclass=Singleton):
         frame.f_back = None
         return val
 
-    def parse_byte_and_args(self, **kwargs):
-        raise NotImplementedError
+    def resume_generator(self, frame, exc=None):
+        """ Resume the suspended frame of a generator (or coroutine), and get
+        the value it yields or returns.
+
+        While tracing is disabled, the frame is re-entered without the setup
+        of `run`, and it's popped directly if it yields again. Otherwise, e.g.
+        it calls a function, raises or returns, it continues in the loop of
+        `run`.
+        """
+        tstate = frame.f_tstate
+        if exc is not None or tstate.tracefunc is not None or self._show_oparg:
+            return self.resume_frame(frame, exc=exc)
+
+        frame.f_back = self.frame
+        self.push_frame(frame)
+        compiled = frame.compiled
+        if compiled is None:
+            why = self.eval_fast(frame)
+        else:
+            why = self.eval_compiled(frame, compiled)
+        if why == 'yield' and tstate.tracefunc is None:
+            self.frames.pop()
+            self.frame = frame.f_back
+            frame.f_back = None
+            return tstate.return_value
+
+        val = self._run(frame, why)
+        frame.f_back = None
+        return val
+
+    def eval_fast(self, frame):
+        """ Execute instructions without any work for tracing until an
+        operation returns a reason to leave the loop.
 
-    def dispatch(self, byte_name, arguments):
+        Returned value is None if tracing is enabled while executing, or the
+        frame is moved to compiled tiers.
+        """
+        instructions = frame.instructions
+        table = self._fast_table
+        try:
+            while True:
+                offset = frame.f_lasti
+                _, opcode, _, _, _, arguments, frame.f_lasti, _ = instructions[offset]
+                why = table[opcode](frame, *arguments)
+                if why:
+                    if why is _TRACING:
+                        frame.f_lasti = offset
+                        return None
+                    if why is _OSR:
+                        return None
+                    return why
+        except:
+            # raise exception directly for debugging code while developing
+            if self._debug: raise
+            last_exception = sys.exc_info()[:2] + (None,)
+            frame.f_tstate.last_exception = last_exception
+            return 'exception'
+
+    def eval_compiled(self, frame, compiled):
+        """ Execute compiled blocks of a frame until a block returns a reason
+        to leave the loop.
+
+        Returned value is None if tracing is enabled while executing. Since
+        blocks end after calls, it's checked before each block.
+        """
+        tstate = frame.f_tstate
+        try:
+            while tstate.tracefunc is None:
+                why = compiled[frame.f_lasti](frame)
+                if why:
+                    return why
+            return None
+        except:
+            # raise exception directly for debugging code while developing
+            if self._debug: raise
+            last_exception = sys.exc_info()[:2] + (None,)
+            frame.f_tstate.last_exception = last_exception
+            return 'exception'
+
+    def eval_instrumented(self, frame):
+        """ Execute instructions with tracing and logging of arguments until
+        an operation returns a reason to leave the loop.
+
+        Returned value is None if tracing is disabled while executing.
+        """
+        # Instructions are not quickened here, so that each of them is traced
+        # and logged even if it is fused into a superinstruction.
+        instructions = get_instructions(frame.f_code)
+        tstate = frame.f_tstate
+        while tstate.tracefunc is not None or self._show_oparg:
+            instr = instructions[frame.f_lasti]
+            frame.f_lasti = instr.next_offset
+            self._oparg_logger(
+                instr.opname, () if instr.arg is None else (instr.argval,), frame
+            )
+            why = self.dispatch(instr.opcode, instr.arguments)
+            if why:
+                return why
+        return None
+
+    def set_instrumented(self, enabled):
+        """ Make the loop running without tracing leave at the next
+        instruction if `enabled` is True, or restore it.
+        """
+        if enabled:
+            self._fast_table[:] = [_leave_fast_loop] * len(self.dispatch_table)
+        else:
+            self._fast_table[:] = self.dispatch_table
+
+    def dispatch(self, opcode, arguments):
         """ Dispatch opcode.
 
         Equivalent to the block defined as `dispatch_opcode` in "ceval.c".
@@ -132,26 +336,24 @@ class VirtualMachine(metaclass=Singleton):
         _maybe_call_line_trace(self.frame)
 
         try:
-            prefix, *rem = byte_name.split('_')
-            if prefix in ['UNARY', 'BINARY', 'INPLACE']:
-                op = byte_name[len(prefix)+1:]
-                attr_name = '%s_operator' % prefix.lower()
-                self.get_op(self.cls_op, attr_name)(self.frame, op)
+            if self._trace_opcode:
+                why = self.get_op(opcode)(self.frame, *arguments)
             else:
-                why = self.get_op(self.cls_op, byte_name)(self.frame, *arguments)
+                why = self.dispatch_table[opcode](self.frame, *arguments)
         except:
             # raise exception directly for debugging code while developing
             if self._debug: raise
             last_exception = sys.exc_info()[:2] + (None,)
-            GlobalCache().set('last_exception', last_exception)
+            self.frame.f_tstate.last_exception = last_exception
             why = 'exception'
         return why
 
-    def get_op(self, cls_op, name):
-        target_func = getattr(cls_op, name)
-        is_tracing = GlobalCache().get('use_tracing', False)
+    def get_op(self, opcode):
+        target_func = self.dispatch_table[opcode]
+        if not self._trace_opcode:
+            return target_func
 
-        if self._trace_opcode and is_tracing:
+        if self.frame.f_tstate.use_tracing:
             def wrapper(frame, *args, **kwargs):
                 # Since it is impossible to get the frame within a function
                 # which is not executed yet, we can install a trace function in
@@ -160,28 +362,14 @@ class VirtualMachine(metaclass=Singleton):
                 f = sys._getframe()
                 tracer = OPTracer()
                 tracer.set_trace(f)
-                target_func(frame, *args, **kwargs)
+                return target_func(frame, *args, **kwargs)
             return wrapper
         else:
             return target_func
 
 
 class VirtualMachinePy34(VirtualMachine):
-    def parse_byte_and_args(self, arg_offset=0):
-        f = self.frame
-        code = f.f_code
-        opcode = code.co_code[f.f_lasti]
-        f.f_lasti += 1
-        if opcode >= dis.HAVE_ARGUMENT:
-            int_arg = (code.co_code[f.f_lasti] + (code.co_code[f.f_lasti+1] << 8)) | arg_offset
-            f.f_lasti += 2
-            collection_type = SPECIAL_OPCODE.get(opcode, None)
-            if collection_type and collection_type in COLLECTION_PROCESS:
-                arg = COLLECTION_PROCESS[collection_type](f, code, int_arg)
-            else:
-                arg = int_arg
-            return dis.opname[opcode], (arg,)
-        return dis.opname[opcode], ()
+    ...
 
 
 class VirtualMachinePy35(VirtualMachinePy34):
@@ -199,23 +387,6 @@ class VirtualMachinePy36(VirtualMachine):
         frame = Frame(code, f_globals, f_locals, None, None)
         return self.run(frame)
 
-    def parse_byte_and_args(self, arg_offset=0):
-        f = self.frame
-        code = f.f_code
-        opcode, int_arg = code.co_code[f.f_lasti:f.f_lasti+2]
-        int_arg |= arg_offset
-        f.f_lasti += 2
-
-        if opcode >= dis.HAVE_ARGUMENT:
-            collection_type = SPECIAL_OPCODE.get(opcode, None)
-            if collection_type and collection_type in COLLECTION_PROCESS:
-                arg = COLLECTION_PROCESS[collection_type](f, code, int_arg)
-            else:
-                arg = int_arg
-            return dis.opname[opcode], (arg,)
-
-        return dis.opname[opcode], ()
-
 
 class VirtualMachinePy37(VirtualMachinePy36):
     ...
@@ -225,28 +396,66 @@ class VirtualMachinePy38(VirtualMachinePy36):
     ...
 
 
+def build_dispatch_table(cls_op):
+    """ Build a table of operations indexed by opcode.
+
+    Each entry is the implementation defined in given `OperationPyXX`, or a
+    function raising `VirtualMachineError` if that operation is not supported.
+    Operations of quickened instructions are appended after them.
+    (see `specialize.py`)
+    """
+    def unknown_op(name):
+        def wrapper(*args, **kwargs):
+            raise VirtualMachineError('Unknown opcode: %s' % name)
+        return wrapper
+
+    table = []
+    for name in dis.opname:
+        func = getattr(cls_op, name, None)
+        table.append(func if func is not None else unknown_op(name))
+    table.extend([func for _, func in QUICKENED_OPS])
+    return table
+
+
+# A reason returned by `_leave_fast_loop` to switch to the instrumented loop.
+_TRACING = 'tracing'
+
+def _leave_fast_loop(frame, *args):
+    return _TRACING
+
+# A reason returned by `VirtualMachine.osr` to switch to the loop running
+# compiled blocks.
+_OSR = 'osr'
+
+
 def settrace(func, arg):
     """ Setup trace function. (`ceval.c::PyEval_SetTrace`) """
-    GlobalCache().set('tracefunc', func)  # _trace_trampoline
-    GlobalCache().set('traceobj', arg)    # a Python callback function
-    GlobalCache().set('use_tracing', func is not None)
+    vm = get_vm()
+    tstate = vm.tstate
+    tstate.tracefunc = func     # _trace_trampoline
+    tstate.traceobj = arg       # a Python callback function
+    tstate.use_tracing = func is not None
+    vm.set_instrumented(func is not None)
 
 
 def _call_trace(func, obj, frame, what, arg=None):
     """ Call trace function. (`ceval.c::calltrace`) """
-    tracing = GlobalCache().get('tracing', False)
-    if tracing or func is None:
+    tstate = frame.f_tstate
+    if tstate.tracing or func is None:
         return
 
-    GlobalCache().set('tracing', True)
-    GlobalCache().set('use_tracing', False)
+    tstate.tracing = True
+    tstate.use_tracing = False
+    # Local variables could be read and modified by trace function.
+    # (`sysmodule.c::call_trampoline`)
+    frame.fast_to_locals()
     result = func(obj, frame, what, arg)
+    frame.locals_to_fast()
 
     # Here we get the trace function directly in case it is uninstalled by
     # `sys.settrace(None)`.
-    temp = GlobalCache().get('tracefunc', None)
-    GlobalCache().set('use_tracing', temp is not None)
-    GlobalCache().set('tracing', False)
+    tstate.use_tracing = tstate.tracefunc is not None
+    tstate.tracing = False
     return result
 
 
@@ -254,15 +463,14 @@ def _call_trace_protected(frame, what, arg=None):
     """ Call trace function with exception handling.
     (`ceval.c::call_trace_protected`)
     """
-    use_tracing = GlobalCache().get('use_tracing', False)
-    func = GlobalCache().get('tracefunc', None)
-    obj = GlobalCache().get('traceobj', None)
+    tstate = frame.f_tstate
+    func = tstate.tracefunc
 
-    if not use_tracing or func is None:
+    if not tstate.use_tracing or func is None:
         return
 
     try:
-        _call_trace(func, obj, frame, what, arg)
+        _call_trace(func, tstate.traceobj, frame, what, arg)
     except:
         raise
 
@@ -271,13 +479,12 @@ def _maybe_call_line_trace(frame):
     """ Used to trigger the callback function to trace per line in source
     code or bytecode instruction.
     """
-    tracing = GlobalCache().get('tracing', False)
-    func = GlobalCache().get('tracefunc', None)
-    obj = GlobalCache().get('traceobj', None)
+    tstate = frame.f_tstate
+    func, obj = tstate.tracefunc, tstate.traceobj
 
     # Check whether we are tracing now. If true, we should avoid calling
     # trace function again.
-    if tracing or func is None:
+    if tstate.tracing or func is None:
         return
 
     # Get lower & upper bound of instructions corresponding to line number
@@ -299,19 +506,19 @@ def _call_exc_trace(frame):
     """ Used to trigger the callback function for tracing while there is
     an error occuring.
     """
-    func = GlobalCache().get('tracefunc', None)
-    obj = GlobalCache().get('traceobj', None)
+    tstate = frame.f_tstate
+    func = tstate.tracefunc
 
     if func is None:
         return
 
     # PyErr_Fetch
-    arg = GlobalCache().pop('last_exception', (type(None), None, None))
+    arg = tstate.fetch_exception()
 
-    _call_trace(func, obj, frame, 'exception', arg)
+    _call_trace(func, tstate.traceobj, frame, 'exception', arg)
 
     # PyErr_Restore
-    GlobalCache().set('last_exception', arg)
+    tstate.last_exception = arg
 
 
 # TODO: make it able to load custom logger (like `conftest.py` of pytest)
@@ -2,10 +2,20 @@
 These tests should be run when version of Python >= 3.5
 """
 
+import asyncio
 import pytest
+from bytefall import get_vm
+from bytefall.objects.generatorobject import CoroWrapper, CoroutineWrapper
 from .. import vmtest
 
 
+def _coroutine(value):
+    globs = {}
+    code = compile('async def double(x):\n    return x * 2\n', '<test>', 'exec')
+    get_vm().run_code(code, f_globals=globs)
+    return globs['double'](value)
+
+
 class TestCoroutine(vmtest.VmTestCase):
     def test_run_awaitable_object(self):
         self.assert_ok("""\
@@ -22,6 +32,82 @@ class TestCoroutine(vmtest.VmTestCase):
             print(result)
             """)
 
+    def test_chain_of_awaited_coroutines(self):
+        self.assert_ok("""\
+            import asyncio
+
+            async def leaf(i):
+                await asyncio.sleep(0)
+                if i == 2:
+                    raise ValueError(i)
+                return i
+
+            async def level(depth, i):
+                if depth == 0:
+                    return await leaf(i)
+                return await level(depth - 1, i) + 1
+
+            async def coro():
+                results = []
+                for i in range(4):
+                    try:
+                        results.append(await level(10, i))
+                    except ValueError as e:
+                        results.append('error %s' % e)
+                return results
+
+            loop = asyncio.get_event_loop()
+            result = loop.run_until_complete(coro())
+            print(result)
+            """)
+
+    def test_await_generator(self):
+        self.assert_ok("""\
+            def gen():
+                yield 1
+
+            async def coro():
+                await gen()
+
+            try:
+                coro().send(None)
+            except TypeError as e:
+                print(e)
+            """)
+
+    def test_generator_is_not_awaitable(self):
+        self.assert_ok("""\
+            import collections.abc, inspect
+
+            def gen():
+                yield 1
+
+            g = gen()
+            print(isinstance(g, collections.abc.Awaitable))
+            print(isinstance(g, collections.abc.Coroutine))
+            print(inspect.isawaitable(g))
+            """)
+
+    def test_await_types_coroutine_generator(self):
+        self.assert_ok("""\
+            import asyncio, types
+
+            @types.coroutine
+            def wait(value):
+                yield
+                return value * 2
+
+            async def coro():
+                results = []
+                for i in range(3):
+                    results.append(await wait(i))
+                return results
+
+            loop = asyncio.new_event_loop()
+            print(loop.run_until_complete(coro()))
+            loop.close()
+            """)
+
     # Support for asynchronous __aiter__ is dropped in Py37. (bpo-31709)
     @pytest.mark.skipif_py_ge((3, 7))
     def test_run_awaitable_iterator(self):
@@ -78,3 +164,40 @@ class TestCoroutine(vmtest.VmTestCase):
             result = loop.run_until_complete(coro())
             print(result)
             """, raises=TypeError)
+
+
+class TestAwaitedByHost(object):
+    def test_run_as_native_coroutine(self):
+        coro = _coroutine(21)
+        assert asyncio.iscoroutine(coro)
+
+        loop = asyncio.new_event_loop()
+        try:
+            task = loop.create_task(coro)
+            assert loop.run_until_complete(task) == 42
+        finally:
+            loop.close()
+
+    def test_await_without_debug_mode(self):
+        it = _coroutine(21).__await__()
+
+        assert isinstance(it, CoroutineWrapper)
+        with pytest.raises(StopIteration) as e:
+            next(it)
+        assert e.value.value == 42
+
+    def test_source_traceback_in_debug_mode(self):
+        loop = asyncio.new_event_loop()
+        loop.set_debug(True)
+        asyncio.events._set_running_loop(loop)
+        try:
+            it = _coroutine(21).__await__()
+        finally:
+            asyncio.events._set_running_loop(None)
+            loop.close()
+
+        assert isinstance(it, CoroWrapper)
+        assert it._source_traceback
+        with pytest.raises(StopIteration) as e:
+            next(it)
+        assert e.value.value == 42
@@ -3,6 +3,7 @@ These tests should be run when version of Python >= 3.6
 """
 
 import pytest
+from bytefall.specialize import get_specialization_stats
 from .. import vmtest
 
 
@@ -131,3 +132,105 @@ class TestCoroutine(vmtest.VmTestCase):
             result = loop.run_until_complete(coro())
             print(result)
             """)
+
+    def test_async_for_over_async_generator_awaiting(self):
+        self.assert_ok("""\
+            import asyncio
+
+            async def gen(n):
+                for i in range(n):
+                    await asyncio.sleep(0)
+                    yield i
+
+            async def coro():
+                values = [v async for v in gen(20)]
+                g = gen(20)
+                async for v in g:
+                    if v == 5:
+                        break
+                # Continue with the generator left by the loop
+                async for v in g:
+                    values.append(v)
+                return values
+
+            loop = asyncio.new_event_loop()
+            print(loop.run_until_complete(coro()))
+            loop.close()
+            """)
+
+    def test_exception_raised_in_async_generator(self):
+        self.assert_ok("""\
+            import asyncio
+
+            async def gen():
+                yield 1
+                await asyncio.sleep(0)
+                raise ValueError('failed in generator')
+
+            async def coro():
+                values = []
+                try:
+                    async for v in gen():
+                        values.append(v)
+                except ValueError as e:
+                    values.append(str(e))
+                return values
+
+            loop = asyncio.new_event_loop()
+            print(loop.run_until_complete(coro()))
+            loop.close()
+            """)
+
+    def test_async_generator_ignoring_generator_exit(self):
+        self.assert_ok("""\
+            import asyncio
+
+            async def gen():
+                try:
+                    yield 1
+                finally:
+                    yield 2
+
+            async def coro():
+                g = gen()
+                print(await g.__anext__())
+                try:
+                    await g.aclose()
+                except RuntimeError as e:
+                    print(e)
+
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(coro())
+            loop.close()
+            """)
+
+
+class TestSpecializedAsyncFor(object):
+    def test_specialized_for_async_generator(self):
+        globs = vmtest.run_source("""\
+            import asyncio
+
+            async def gen(n):
+                for i in range(n):
+                    if i % 2:
+                        await asyncio.sleep(0)
+                    yield i
+
+            async def coro(n):
+                total = 0
+                async for v in gen(n):
+                    total += v
+                return total
+
+            loop = asyncio.new_event_loop()
+            total = loop.run_until_complete(coro(100))
+            loop.close()
+            """)
+
+        assert globs['total'] == sum(range(100))
+        stats = {
+            s.opname: s for s in get_specialization_stats(globs['coro'].__code__)
+        }
+        assert stats['GET_ANEXT'].specialized == 'GET_ANEXT_ASYNC_GEN'
+        assert stats['YIELD_FROM'].specialized == 'YIELD_FROM_ASYNC_GEN'
+        assert stats['YIELD_FROM'].misses == 0
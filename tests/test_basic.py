@@ -68,6 +68,70 @@ class TestIt(vmtest.VmTestCase):
             print(-x, ~x, not x)
             """)
 
+    def test_binary_operators(self):
+        self.assert_ok("""\
+            x, y = 23, 5
+            print(x ** y, x * y, x / y, x // y, x % y, x + y, x - y)
+            print(x << y, x >> y, x & y, x ^ y, x | y, [x, y][1])
+            """)
+
+    def test_inplace_operators(self):
+        self.assert_ok("""\
+            x, y = 23, 5
+            x **= y; x *= y; x //= y; x %= y; x += y; x -= y
+            x <<= y; x >>= y; x &= y; x ^= y; x |= y
+            print(x)
+            x /= y
+            print(x)
+            """)
+
+    def test_local_variables(self):
+        self.assert_ok("""\
+            def f(a, b=2):
+                c = a + b
+                def g():
+                    return c
+                assert sorted(locals()) == ['a', 'b', 'c', 'g']
+                del a
+                assert sorted(locals()) == ['b', 'c', 'g']
+                return g()
+            print(f(1))
+            """)
+        self.assert_ok("""\
+            def f():
+                x = 1
+                del x
+                return x
+            f()
+            """, raises=UnboundLocalError)
+        self.assert_ok("""\
+            def f():
+                del x
+                x = 1
+            f()
+            """, raises=UnboundLocalError)
+
+    def test_inplace_subscript(self):
+        # case for `DUP_TOP_TWO` and `ROT_THREE`
+        self.assert_ok("""\
+            x = [1, 2]
+            x[0] += 5
+            d = {'a': [1]}
+            d['a'][0] *= 3
+            print(x, d)
+            """)
+
+    def test_calling_with_keyword_arguments(self):
+        self.assert_ok("""\
+            def f(a, b, c=3, **kwargs):
+                return a, b, c, sorted(kwargs.items())
+            print(f(1, 2))
+            print(f(1, b=2, d=5))
+            print(f(1, 2, e=6, d=7))
+            print(dict([(1, 2)], x=3, y=[4, 5]))
+            print({'a': f(1, 2)[0], 'b': len([]), 'a': 2})
+            """)
+
     def test_attributes(self):
         self.assert_ok("""\
             l = lambda: 1   # Just to have an object...
@@ -389,6 +453,12 @@ class TestIt(vmtest.VmTestCase):
             ), globs=g)
 
 
+    def test_chained_extended_arg(self):
+        # case for a jump target which requires more than one `EXTENDED_ARG`
+        body = '\n'.join(['    y = %d' % i for i in range(20000)])
+        self.assert_ok('x = 0\nif x:\n%s\nprint(x)\n' % body)
+
+
 class TestLoops(vmtest.VmTestCase):
     def test_for(self):
         self.assert_ok("""\
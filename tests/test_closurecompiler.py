@@ -0,0 +1,119 @@
+"""Tests for the closure-compiled execution tier."""
+
+from bytefall import get_vm
+from bytefall._modules import sys as py_sys
+from bytefall.closurecompiler import CompiledCode
+from bytefall.specialize import get_specialization_stats
+from . import test_basic, test_exceptions, test_functions, test_with, vmtest
+
+
+class CompileAllMixin(vmtest.TierOverrideMixin):
+    """Run test cases with every code object compiled into closures at its
+    first call.
+    """
+    overrides = [
+        ('vm.compiler.threshold', 0), ('vm.compiler.blocks', CompiledCode),
+    ]
+
+
+class TestCompiledBasic(CompileAllMixin, test_basic.TestIt):
+    pass
+
+
+class TestCompiledLoops(CompileAllMixin, test_basic.TestLoops):
+    pass
+
+
+class TestCompiledExceptions(CompileAllMixin, test_exceptions.TestExceptions):
+    pass
+
+
+class TestCompiledFunctions(CompileAllMixin, test_functions.TestFunctions):
+    pass
+
+
+class TestCompiledGenerators(CompileAllMixin, test_functions.TestGenerators):
+    pass
+
+
+class TestCompiledWithStatement(CompileAllMixin, test_with.TestWithStatement):
+    pass
+
+
+class TestClosureCompiler(vmtest.TierOverrideMixin):
+    overrides = [('vm.compiler.blocks', CompiledCode)]
+
+    def test_hot_function_is_compiled(self):
+        compiler = get_vm().compiler
+        globs = vmtest.run_source("""\
+            def cold(x):
+                return x
+
+            def hot(n):
+                total = 0
+                for i in range(n):
+                    total += i
+                return total
+
+            cold(1)
+            results = [hot(i) for i in range(%d)]
+            """ % (compiler.threshold + 10), {})
+
+        assert globs['results'][-1] == sum(range(compiler.threshold + 9))
+        assert compiler.is_compiled(globs['hot'].__code__)
+        assert not compiler.is_compiled(globs['cold'].__code__)
+
+    def test_blocks_follow_rewritten_sites(self):
+        compiler = get_vm().compiler
+        globs = vmtest.run_source("""\
+            def mul(a, b):
+                return a * b
+
+            ints = [mul(i, 2) for i in range(%d)]
+            floats = [mul(i, 0.5) for i in range(100)]
+            """ % (compiler.threshold + 100), {})
+
+        assert compiler.is_compiled(globs['mul'].__code__)
+        assert globs['ints'][-1] == (compiler.threshold + 99) * 2
+        assert globs['floats'][:3] == [0.0, 0.5, 1.0]
+
+        # Site of `a * b` is specialized for int and then deoptimized
+        stats = get_specialization_stats(globs['mul'].__code__)
+        assert stats[0].opname == 'BINARY_MULTIPLY'
+        assert stats[0].deopts == 1
+
+    def test_trace_compiled_function(self):
+        compiler = get_vm().compiler
+
+        def trace_foo(ncalls):
+            events = []
+
+            def tracer(frame, what, arg):
+                events.append((what, frame.f_lineno))
+                frame.f_trace = tracer
+                return tracer
+
+            globs = {'settrace': py_sys.settrace, 'tracer': tracer}
+            vmtest.run_source("""\
+                def foo(x):
+                    y = x + 1
+                    if y > 1:
+                        y = -y
+                    return y
+
+                for i in range(%d):
+                    foo(i)
+                settrace(tracer)
+                result = foo(1)
+                settrace(None)
+                """ % ncalls, globs)
+            assert globs['result'] == -2
+            return events, compiler.is_compiled(globs['foo'].__code__)
+
+        # Events of a compiled function are the same as the interpreted one
+        events, compiled = trace_foo(compiler.threshold + 1)
+        assert compiled
+        assert (events, False) == trace_foo(0)
+        assert events[0][0] == 'call'
+        assert ('line', 4) in events
+        assert get_vm().tstate.tracefunc is None
@@ -0,0 +1,111 @@
+"""Tests for the tier of code generated as Python source."""
+
+import pytest
+
+from bytefall import get_vm
+from bytefall.codegen import GeneratedCode
+from bytefall.objects.codeobject import get_instructions
+from . import test_basic, test_exceptions, test_functions, test_with, vmtest
+
+
+class GenerateAllMixin(vmtest.TierOverrideMixin):
+    """Run test cases with sources of every code object generated at its
+    first call.
+    """
+    overrides = [('vm.compiler.codegen_threshold', 0)]
+
+
+class TestGeneratedBasic(GenerateAllMixin, test_basic.TestIt):
+    pass
+
+
+class TestGeneratedLoops(GenerateAllMixin, test_basic.TestLoops):
+    pass
+
+
+class TestGeneratedComparisons(GenerateAllMixin, test_basic.TestComparisons):
+    pass
+
+
+class TestGeneratedExceptions(GenerateAllMixin, test_exceptions.TestExceptions):
+    pass
+
+
+class TestGeneratedFunctions(GenerateAllMixin, test_functions.TestFunctions):
+    pass
+
+
+class TestGeneratedClosures(GenerateAllMixin, test_functions.TestClosures):
+    pass
+
+
+class TestGeneratedGenerators(GenerateAllMixin, test_functions.TestGenerators):
+    pass
+
+
+class TestGeneratedWithStatement(GenerateAllMixin, test_with.TestWithStatement):
+    pass
+
+
+class TestCodegen(object):
+    def test_stack_operations_become_expressions(self):
+        func = vmtest.function_from_source("""\
+            def fn(a, b):
+                c = a + b
+                return c
+            """)
+        generated = vmtest.compile_function(GeneratedCode, func)
+        generated[0]
+        source = generated.sources[0]
+        assert 't0 = l0 + l1' in source
+        assert 'fastlocals[2] = l2 = t0' in source
+
+    def test_loop_in_a_block(self):
+        func = vmtest.function_from_source("""\
+            def fn(n):
+                total = 0
+                i = 0
+                while i < n:
+                    total += i
+                    i += 1
+                return total
+            """)
+        assert func(100) == 4950
+
+        generated = vmtest.compile_function(GeneratedCode, func)
+        loop_head = [
+            instr for instr in get_instructions(func.__code__)
+            if instr is not None and instr.opname == 'JUMP_ABSOLUTE'
+        ][0].jump_target
+        generated[loop_head]
+        assert 'while True:' in generated.sources[loop_head]
+
+    def test_offset_of_exception_raised_in_a_block(self):
+        func = vmtest.function_from_source("""\
+            def fn(a, b):
+                c = a + b
+                d = c / b
+                return d
+            """)
+        division = [
+            instr for instr in get_instructions(func.__code__)
+            if instr is not None and instr.opname == 'BINARY_TRUE_DIVIDE'
+        ][0]
+        frame = func.make_frame((1, 0), {}, None)
+        with pytest.raises(ZeroDivisionError):
+            vmtest.compile_function(GeneratedCode, func)[0](frame)
+        assert frame.f_lasti == division.next_offset
+
+    def test_hot_function_is_generated(self):
+        compiler = get_vm().compiler
+        globs = vmtest.run_source("""\
+            def fn(x):
+                return x * 2 + 1
+
+            results = [fn(i) for i in range(%d)]
+            """ % (compiler.codegen_threshold + 1), {})
+
+        assert globs['results'][:3] == [1, 3, 5]
+        assert isinstance(
+            compiler.lookup(globs['fn'].__code__), GeneratedCode
+        )
@@ -0,0 +1,99 @@
+"""Tests for decoded instruction streams of code objects."""
+
+import dis
+
+from bytefall.objects.codeobject import get_instructions, get_line_table
+from . import vmtest
+
+
+class TestInstructions(object):
+    def test_instructions_match_dis(self):
+        code = vmtest.compile_source("""\
+            def fn(a, b=2):
+                c = a + b
+                for i in range(c):
+                    if i > a:
+                        break
+                return c
+            """)
+        fn_code = [c for c in code.co_consts if hasattr(c, 'co_code')][0]
+        table = get_instructions(fn_code)
+
+        for expected in dis.get_instructions(fn_code):
+            instr = table[expected.offset]
+            assert instr is not None
+            assert instr.opname == expected.opname
+            if expected.opcode in dis.hasjrel + dis.hasjabs:
+                assert instr.jump_target == expected.argval
+            elif expected.opcode not in dis.hascompare:
+                assert instr.argval == expected.argval
+
+    def test_instructions_are_cached(self):
+        code = vmtest.compile_source('x = 1')
+        assert get_instructions(code) is get_instructions(code)
+
+    def test_non_instruction_offsets(self):
+        code = vmtest.compile_source('x = 1')
+        table = get_instructions(code)
+        offsets = {instr.offset for instr in dis.get_instructions(code)}
+        assert len(table) == len(code.co_code)
+        for offset, instr in enumerate(table):
+            assert (instr is not None) == (offset in offsets)
+
+    def test_extended_arg_is_merged(self):
+        # `POP_JUMP_IF_FALSE` with a target out of the range of 2 bytes
+        # requires chained `EXTENDED_ARG` in both formats of bytecode.
+        body = '\n'.join(['    y = %d' % i for i in range(20000)])
+        code = vmtest.compile_source('x = 0\nif x:\n%s\nprint(x)\n' % body)
+        table = get_instructions(code)
+
+        prefix = None
+        for expected in dis.get_instructions(code):
+            if expected.opname == 'EXTENDED_ARG':
+                if prefix is None:
+                    prefix = expected.offset
+                assert table[expected.offset] is None or prefix == expected.offset
+                continue
+            offset = expected.offset if prefix is None else prefix
+            prefix = None
+            instr = table[offset]
+            assert instr.opname == expected.opname
+            assert instr.offset == offset
+            if expected.opcode in dis.hasjabs:
+                assert instr.jump_target == expected.argval
+                assert instr.jump_target > 0xFFFF
+            else:
+                assert instr.argval == expected.argval
+        assert 'EXTENDED_ARG' not in [v.opname for v in table if v is not None]
+
+
+class TestLineTable(object):
+    def test_line_numbers_match_dis(self):
+        code = vmtest.compile_source("""\
+            def fn(a):
+                total = 0
+                while a > 0:
+                    total += (
+                        a
+                    )
+                    a -= 1
+                return [
+                    total
+                    for _ in range(2)
+                ]
+            """)
+        fn_code = [c for c in code.co_consts if hasattr(c, 'co_code')][0]
+        table = get_line_table(fn_code)
+
+        line = None
+        starts = dict(dis.findlinestarts(fn_code))
+        for instr in dis.get_instructions(fn_code):
+            line = starts.get(instr.offset, line)
+            assert table.lineno(instr.offset) == line
+            lineno, lb, ub = table.bounds(instr.offset)
+            assert lineno == line
+            assert lb <= instr.offset < ub
+
+    def test_line_table_is_cached(self):
+        code = vmtest.compile_source('x = 1')
+        assert get_line_table(code) is get_line_table(code)
@@ -2,15 +2,10 @@
 These tests should be run when version of Python >= 3.4
 """
 
-import pytest
 from . import vmtest
 
 
 class TestCoroutine(vmtest.VmTestCase):
-    @pytest.mark.skip(reason='this case works while running it as a script, '
-    'but it will fail in test runner currently. Cause of failure is that '
-    '`asyncio.coroutine` was patched while running this case in vm, but it '
-    'was not restored after that.')
     def test_run_awaitable_object(self):
         # py34, generator-based coroutine
         # which will be removed in CPython 3.10
@@ -39,3 +34,26 @@ class TestCoroutine(vmtest.VmTestCase):
                 return 1
             foo()
             """)
+
+    def test_generator_based_coroutine_yielding_future(self):
+        self.assert_ok("""\
+            import asyncio
+
+            @asyncio.coroutine
+            def wait(loop, value):
+                fut = loop.create_future()
+                loop.call_soon(fut.set_result, value)
+                result = yield from fut
+                return result * 2
+
+            @asyncio.coroutine
+            def coro(loop):
+                results = []
+                for i in range(3):
+                    results.append((yield from wait(loop, i)))
+                return results
+
+            loop = asyncio.new_event_loop()
+            print(loop.run_until_complete(coro(loop)))
+            loop.close()
+            """)
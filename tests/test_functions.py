@@ -1,6 +1,10 @@
 """Test functions etc, for Byterun."""
 
 from __future__ import print_function
+import sys, textwrap
+import pytest
+
+from bytefall import get_vm
 from . import vmtest
 
 
@@ -29,6 +33,31 @@ class TestFunctions(vmtest.VmTestCase):
             assert f6 == 720
             """)
 
+    def test_recursion_deeper_than_host(self):
+        # Calls between functions do not consume the stack of host, so the
+        # depth of recursion is limited by `recursion_limit` of vm only.
+        depth = 5 * sys.getrecursionlimit()
+        code = compile(textwrap.dedent("""\
+            def count(n):
+                return 0 if n == 0 else count(n - 1) + 1
+            result = count(%d)
+            """ % depth), '<test_recursion>', 'exec')
+
+        vm = get_vm()
+        limit = vm.recursion_limit
+        try:
+            vm.recursion_limit = depth + 10
+            globs = {}
+            vm.run_code(code, f_globals=globs)
+            assert globs['result'] == depth
+
+            vm.recursion_limit = depth // 2
+            with pytest.raises(RecursionError):
+                vm.run_code(code, f_globals={})
+            assert vm.frames == []
+        finally:
+            vm.recursion_limit = limit
+
     def test_nested_names(self):
         self.assert_ok("""\
             def one():
@@ -138,6 +167,27 @@ class TestFunctions(vmtest.VmTestCase):
             fn(4, 3)
         """, raises=TypeError)
 
+    def test_mixed_kinds_of_parameters(self):
+        self.assert_ok("""\
+            def fn(a, b, c=3, *args, d, e=5, **kwargs):
+                return a, b, c, args, d, e, sorted(kwargs.items())
+            print(fn(1, 2, d=4))
+            print(fn(1, 2, 6, 7, 8, d=4, f=9))
+            print(fn(b=1, a=2, e=3, d=4, c=5))
+            fn.__defaults__ = (30,)
+            fn.__kwdefaults__ = {'d': 40, 'e': 50}
+            print(fn(1, 2))
+            """)
+
+    def test_calling_functions_wrong(self):
+        for call in ['fn()', 'fn(1, 2, 3)', 'fn(1, a=1)', 'fn(1, x=2)',
+                     'fn(b=2)', 'fn(1)']:
+            self.assert_ok("""\
+                def fn(a, b=2, *, c):
+                    return a, b, c
+                %s
+                """ % call, raises=TypeError)
+
     def test_partial(self):
         self.assert_ok("""\
             from _functools import partial
@@ -581,6 +631,122 @@ class TestGenerators(vmtest.VmTestCase):
             list(main())
         """)
 
+    def test_generator_calls_and_raises_between_yields(self):
+        self.assert_ok("""\
+            def double(x):
+                return x * 2
+
+            def gen(n):
+                for i in range(n):
+                    yield double(i)
+                    if i == 2:
+                        raise ValueError(i)
+
+            def main():
+                g = gen(5)
+                try:
+                    for v in g:
+                        print(v)
+                except ValueError as e:
+                    print('error', e)
+
+            main()
+            """)
+
+    def test_generator_resumed_in_generator(self):
+        self.assert_ok("""\
+            def source(n):
+                for i in range(n):
+                    yield i
+
+            def double(it):
+                for x in it:
+                    yield x * 2
+
+            print(sum(double(double(source(50)))))
+            """)
+
+    def test_values_sent_through_chain_of_yield_from(self):
+        self.assert_ok("""\
+            def leaf(n):
+                total = 0
+                for i in range(n):
+                    total += yield i
+                return total
+
+            def level(depth, n):
+                if depth == 0:
+                    result = yield from leaf(n)
+                else:
+                    result = yield from level(depth - 1, n)
+                    yield 'level %d' % depth
+                return result + 1
+
+            g = level(5, 3)
+            received = [next(g)]
+            try:
+                while True:
+                    received.append(g.send(10))
+            except StopIteration as e:
+                print(received, e.value)
+            """)
+
+    def test_exception_raised_in_chain_of_yield_from(self):
+        self.assert_ok("""\
+            def leaf():
+                yield 1
+                raise ValueError('leaf')
+
+            def middle():
+                yield from leaf()
+
+            def outer():
+                try:
+                    yield from middle()
+                except ValueError as e:
+                    print('caught', e)
+                yield 2
+
+            g = outer()
+            print(g.gi_yieldfrom)
+            print(next(g))
+            print(g.gi_yieldfrom is not None)
+            print(next(g))
+            print(g.gi_yieldfrom)
+            """)
+
+    def test_chain_of_yield_from_entered_again(self):
+        self.assert_ok("""\
+            def leaf(n):
+                for i in range(n):
+                    yield i
+
+            def outer():
+                for n in range(1, 4):
+                    yield from leaf(n)
+                    yield from (n, n)
+
+            print(list(outer()))
+            """)
+
+    def test_send_to_delegating_generator_while_running(self):
+        self.assert_ok("""\
+            def leaf():
+                try:
+                    next(g)
+                except ValueError as e:
+                    print(e)
+                yield 1
+                yield 2
+
+            def outer():
+                yield from leaf()
+
+            g = outer()
+            print(next(g))
+            print(next(g))
+            """)
+
     def test_generator_is_running(self):
         self.assert_ok("""\
             gen = (v for v in range(3))
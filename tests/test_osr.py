@@ -0,0 +1,100 @@
+"""Tests for on-stack replacement of frames running hot loops."""
+
+from bytefall import get_vm
+from bytefall.codegen import GeneratedCode
+from bytefall.specialize import get_loop_stats
+from . import test_basic, test_exceptions, test_functions, test_with, vmtest
+
+
+class ReplaceAllMixin(vmtest.TierOverrideMixin):
+    """Run test cases with the trace JIT disabled, and frames moved to the
+    compiled tiers at the second iteration of loops.
+    """
+    overrides = [('vm.trace_jit', None), ('specialize.LOOP_WARMUP', 0)]
+
+
+class TestReplacedBasic(ReplaceAllMixin, test_basic.TestIt):
+    pass
+
+
+class TestReplacedLoops(ReplaceAllMixin, test_basic.TestLoops):
+    pass
+
+
+class TestReplacedExceptions(ReplaceAllMixin, test_exceptions.TestExceptions):
+    pass
+
+
+class TestReplacedFunctions(ReplaceAllMixin, test_functions.TestFunctions):
+    pass
+
+
+class TestReplacedGenerators(ReplaceAllMixin, test_functions.TestGenerators):
+    pass
+
+
+class TestReplacedWithStatement(ReplaceAllMixin, test_with.TestWithStatement):
+    pass
+
+
+class TestOSR(object):
+    def test_module_level_nested_loops(self):
+        code = vmtest.compile_source("""\
+            total = 0
+            for i in range(500):
+                for j in range(20):
+                    total += i * j
+            """)
+        globs = vmtest.run_source(code, {})
+
+        assert globs['total'] == sum(range(500)) * sum(range(20))
+        # The outer loop can't be traced, and the frame of module is moved
+        # to the compiled tiers.
+        outer = max(get_loop_stats(code), key=lambda s: s.offset)
+        assert outer.state == 'generic' and outer.traces == 0
+        assert isinstance(get_vm().compiler.lookup(code), GeneratedCode)
+
+    def test_loop_with_yield(self):
+        code = vmtest.compile_source("""\
+            def gen(n):
+                i = 0
+                while i < n:
+                    yield i * 2
+                    i += 1
+
+            result = sum(gen(1000))
+            """)
+        globs = vmtest.run_source(code, {})
+
+        assert globs['result'] == sum(range(1000)) * 2
+        assert isinstance(
+            get_vm().compiler.lookup(globs['gen'].__code__), GeneratedCode
+        )
+
+    def test_loop_with_block_stack(self):
+        code = vmtest.compile_source("""\
+            def main():
+                results = []
+                for i in range(500):
+                    for j in range(3):
+                        try:
+                            results.append(10 // (i % 7 - j))
+                        except ZeroDivisionError:
+                            results.append(None)
+                return results
+
+            results = main()
+            """)
+        globs = vmtest.run_source(code, {})
+
+        expected = []
+        for i in range(500):
+            for j in range(3):
+                try:
+                    expected.append(10 // (i % 7 - j))
+                except ZeroDivisionError:
+                    expected.append(None)
+        assert globs['results'] == expected
+        assert isinstance(
+            get_vm().compiler.lookup(globs['main'].__code__), GeneratedCode
+        )
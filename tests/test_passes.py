@@ -0,0 +1,193 @@
+"""Tests for the peephole and dataflow passes over decoded instructions."""
+
+from bytefall import passes
+from bytefall.objects.codeobject import get_instructions
+from bytefall.passes import PassManager, PassStats, get_pass_stats
+from bytefall.specialize import QUICKENED_OPCODE, quicken
+from . import vmtest
+
+
+def _optimize(code, names):
+    manager = PassManager(
+        [(name, func) for name, func in passes.DEFAULT_PASSES if name in names]
+    )
+    table = list(get_instructions(code))
+    ctx, stats = manager.run(code, table, QUICKENED_OPCODE)
+    return table, ctx, stats
+
+
+def _stream(table):
+    """Get names of the entries executed one after another from the start."""
+    names, offset = [], 0
+    while offset < len(table):
+        names.append(table[offset].opname)
+        offset = table[offset].next_offset
+    return names
+
+
+class TestPasses(object):
+    def test_fold_constants(self):
+        code = vmtest.function_code("""\
+            def fn():
+                return (1 < 2, 'ab' in 'abc', 3)
+            """)
+        table, _, stats = _optimize(code, ['fold_constants'])
+
+        assert _stream(table) == ['LOAD_CONST', 'RETURN_VALUE']
+        assert table[0].argval == (True, True, 3)
+        assert stats == [PassStats('fold_constants', 7)]
+
+    def test_operations_raising_are_not_folded(self):
+        code = vmtest.function_code("""\
+            def fn():
+                return 1 < 'a', 2 ** 1000
+            """)
+        table, _, stats = _optimize(code, ['fold_constants'])
+
+        assert 'COMPARE_OP' in _stream(table)
+        assert 'BINARY_POWER' in _stream(table)
+        assert stats[0].removed == 0
+
+    def test_constant_branch_and_dead_block(self):
+        code = vmtest.function_code("""\
+            def fn(x):
+                if 0 < 1:
+                    y = x
+                else:
+                    y = -x
+                return y
+            """)
+        table, ctx, stats = _optimize(
+            code, ['fold_constants', 'remove_dead_blocks']
+        )
+
+        assert 'POP_JUMP_IF_FALSE' not in _stream(table)
+        assert 'UNARY_NEGATIVE' not in [
+            table[offset].opname for offset in
+            set(range(len(table))) - ctx.dead if table[offset] is not None
+        ]
+        assert [s.removed for s in stats] == [3, 3]
+        # Entries of dead instructions are kept
+        assert all(table[offset] is not None for offset in ctx.dead)
+
+    def test_thread_jumps(self):
+        code = vmtest.function_code("""\
+            def fn(a, b):
+                if a:
+                    if b:
+                        x = 1
+                    else:
+                        x = 2
+                else:
+                    x = 3
+                return x
+            """)
+        table = list(get_instructions(code))
+        # Make the jump of inner `if` go to the jump after its body
+        branch = [e for e in table if e is not None and
+                  e.opname == 'POP_JUMP_IF_FALSE'][1]
+        jump = [e for e in table if e is not None and
+                e.opname == 'JUMP_ABSOLUTE'][0]
+        table[branch.offset] = branch._replace(
+            arguments=(jump.offset,), argval=jump.offset,
+            jump_target=jump.offset
+        )
+        ctx = passes.PassContext(code, table, QUICKENED_OPCODE)
+
+        assert passes.thread_jumps(ctx) == 1
+        assert table[branch.offset].opname == 'POP_JUMP_IF_FALSE'
+        assert table[branch.offset].jump_target == jump.jump_target
+        assert table[branch.offset].arguments == (jump.jump_target,)
+
+    def test_eliminate_store_load(self):
+        code = vmtest.function_code("""\
+            def fn(a, b):
+                c = a + b; return c
+            """)
+        table, _, stats = _optimize(code, ['eliminate_store_load'])
+
+        assert _stream(table) == [
+            'LOAD_FAST', 'LOAD_FAST', 'BINARY_ADD', 'RETURN_VALUE'
+        ]
+        assert stats[0].removed == 2
+
+    def test_store_load_of_variable_loaded_elsewhere(self):
+        code = vmtest.function_code("""\
+            def fn(a):
+                c = a; return c + c
+            """)
+        table, _, stats = _optimize(code, ['eliminate_store_load'])
+
+        assert stats[0].removed == 0
+        assert 'STORE_FAST' in _stream(table)
+
+    def test_eliminate_tuple_unpack(self):
+        code = vmtest.function_code("""\
+            def fn(a, b, c, d):
+                a, b, c, d = d, c, b, a
+                return a, b, c, d
+            """)
+        table, _, stats = _optimize(code, ['eliminate_tuple_unpack'])
+        stream = _stream(table)
+
+        assert 'BUILD_TUPLE__UNPACK_SEQUENCE' in stream
+        assert 'UNPACK_SEQUENCE' not in stream
+        assert stats[0].removed == 1
+
+    def test_register_pass(self):
+        def remove_nothing(ctx):
+            return 0
+
+        manager = PassManager()
+        manager.register(remove_nothing, before='thread_jumps')
+        assert [name for name, _ in manager.passes][:3] == [
+            'fold_constants', 'remove_nothing', 'thread_jumps'
+        ]
+        manager.unregister('remove_nothing')
+        assert manager.passes == passes.DEFAULT_PASSES
+
+    def test_pass_stats(self):
+        code = vmtest.function_code("""\
+            def fn(a):
+                b = a * (2 > 1); return b
+            """)
+        quicken(code)
+        stats = get_pass_stats(code)
+
+        assert [s.name for s in stats] == [
+            name for name, _ in passes.pass_manager.passes
+        ]
+        assert stats[0] == PassStats('fold_constants', 2)
+        assert stats[3] == PassStats('eliminate_store_load', 2)
+        totals = dict(get_pass_stats())
+        assert totals['fold_constants'] >= 2
+
+
+class TestOptimizedCode(vmtest.VmTestCase):
+    def test_folded_code(self):
+        self.assert_ok("""\
+            def fn(a, b, c, d):
+                a, b, c, d = d, c, b, a
+                (x,) = (a,)
+                if 1 < 2 and 'a' not in 'bc':
+                    y = (a, b, c, d, x, -(3 - 5), 2 ** 3)
+                else:
+                    y = None
+                return y
+
+            print(fn(1, 2, 3, 4))
+            """)
+
+    def test_jumping_into_removed_instructions(self):
+        self.assert_ok("""\
+            def fn(values):
+                total = 0
+                for v in values:
+                    w = v
+                    if w:
+                        continue
+                    total += 1
+                return total
+
+            print(fn([0, 1, 0, 2]))
+            """)
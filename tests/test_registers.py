@@ -0,0 +1,157 @@
+"""Tests for the register-based execution tier."""
+
+import pytest
+
+from bytefall import get_vm
+from bytefall.registers import RegisterCode
+from bytefall.specialize import get_loop_stats
+from . import test_basic, test_exceptions, test_functions, test_with, vmtest
+
+
+class TranslateAllMixin(vmtest.TierOverrideMixin):
+    """Run test cases with every code object translated into register-based
+    IR at its first call.
+    """
+    overrides = [
+        ('vm.compiler.threshold', 0), ('vm.compiler.blocks', RegisterCode),
+    ]
+
+
+class TestRegistersBasic(TranslateAllMixin, test_basic.TestIt):
+    pass
+
+
+class TestRegistersLoops(TranslateAllMixin, test_basic.TestLoops):
+    pass
+
+
+class TestRegistersComparisons(TranslateAllMixin, test_basic.TestComparisons):
+    pass
+
+
+class TestRegistersExceptions(TranslateAllMixin, test_exceptions.TestExceptions):
+    pass
+
+
+class TestRegistersFunctions(TranslateAllMixin, test_functions.TestFunctions):
+    pass
+
+
+class TestRegistersClosures(TranslateAllMixin, test_functions.TestClosures):
+    pass
+
+
+class TestRegistersGenerators(TranslateAllMixin, test_functions.TestGenerators):
+    pass
+
+
+class TestRegistersWithStatement(TranslateAllMixin, test_with.TestWithStatement):
+    pass
+
+
+class TestRegisterCode(TranslateAllMixin):
+    def test_operands_are_registers(self):
+        func = vmtest.function_from_source("""\
+            def fn(a, b):
+                c = a + b * 2
+                return c
+            """)
+        compiled = vmtest.compile_function(RegisterCode, func)
+        compiled[0]
+        names = [step[0].__name__ for step in compiled.steps[0]]
+
+        # Loads of locals and constants are folded into the operands, and
+        # the result is written to the slot of `c` directly.
+        assert names == ['_binary', '_binary', '_push', 'RETURN_VALUE']
+        assert compiled.steps[0][1][1][0] == 2
+        assert func(1, 2) == 5
+
+    def test_comparison_fused_into_jump(self):
+        func = vmtest.function_from_source("""\
+            def fn(n):
+                i = 0
+                while i < n:
+                    i += 1
+                return i
+            """)
+        compiled = vmtest.compile_function(RegisterCode, func)
+        compiled[0]
+        names = [step[0].__name__ for step in compiled.steps[0]]
+
+        assert '_compare_jump_if_false' in names
+        assert func(10) == 10
+
+    @pytest.mark.parametrize('values, expected', [
+        ([1, 2, 5], [10, 5, 2]),
+        ([1, 0, 5], [10, 'error', 2]),
+    ])
+    def test_exception_with_values_held_in_registers(self, values, expected):
+        globs = vmtest.run_source("""\
+            def fn(values):
+                results = []
+                for v in values:
+                    try:
+                        results.append([v, 10 // v][1])
+                    except ZeroDivisionError:
+                        results.append('error')
+                return results
+
+            result = fn(%r)
+            """ % values, {})
+
+        assert globs['result'] == expected
+
+    def test_unbound_local(self):
+        globs = vmtest.run_source("""\
+            def fn(flag):
+                if flag:
+                    x = 1
+                return x + 1
+
+            try:
+                fn(False)
+            except UnboundLocalError as e:
+                error = str(e)
+            result = fn(True)
+            """, {})
+
+        assert "'x'" in globs['error']
+        assert globs['result'] == 2
+
+    def test_generator_suspended_with_values_in_registers(self):
+        globs = vmtest.run_source("""\
+            def gen():
+                total = 0
+                for i in range(3):
+                    total = total * 10 + (yield i) + i
+                return total
+
+            g = gen()
+            received = [next(g)]
+            try:
+                while True:
+                    received.append(g.send(len(received)))
+            except StopIteration as e:
+                result = e.value
+            """, {})
+
+        assert globs['received'] == [0, 1, 2]
+        assert globs['result'] == (1 * 10 + 2 + 1) * 10 + 3 + 2
+
+    def test_hot_loop_is_traced(self):
+        globs = vmtest.run_source("""\
+            def fn(n):
+                total = 0
+                for i in range(n):
+                    total += i
+                return total
+
+            result = fn(1000)
+            """, {})
+
+        assert globs['result'] == sum(range(1000))
+        assert isinstance(
+            get_vm().compiler.lookup(globs['fn'].__code__), RegisterCode
+        )
+        stats = get_loop_stats(globs['fn'].__code__)
+        assert stats[0].state == 'traced'
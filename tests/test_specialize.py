@@ -0,0 +1,153 @@
+"""Tests for quickening of instructions with specialized operations."""
+
+from bytefall.closurecompiler import CompiledCode
+from bytefall.specialize import get_specialization_stats
+from . import vmtest
+
+
+def _stats(func):
+    return {s.opname: s for s in get_specialization_stats(func.__code__)}
+
+
+class TestSpecialize(vmtest.TierOverrideMixin):
+    # Hot functions are compiled into closures, which run the quickened
+    # instructions as they are, instead of translating the arithmetic.
+    overrides = [('vm.compiler.blocks', CompiledCode)]
+
+    def test_specialized_for_operands_of_same_type(self):
+        globs = vmtest.run_source("""\
+            def fn(n, step):
+                total = 0
+                for i in range(n):
+                    below = i < n
+                    if below:
+                        total += step
+                return total
+
+            ints = fn(100, 1)
+            floats = fn(100, 0.5)
+            """, {})
+
+        assert globs['ints'] == 100
+        assert globs['floats'] == 50.0
+        stats = _stats(globs['fn'])
+        assert stats['FOR_ITER'].state == 'specialized'
+        assert stats['FOR_ITER'].specialized == 'FOR_ITER_RANGE'
+        assert stats['COMPARE_OP'].specialized == 'COMPARE_OP_INT_LT'
+
+        # `total` starts with an int and becomes float in the second call,
+        # so that the guard of `BINARY_ADD_INT` fails and it is deoptimized.
+        add = stats['INPLACE_ADD']
+        assert add.misses > 0 and add.deopts == 1
+        assert add.specialized == 'BINARY_ADD_FLOAT'
+
+    def test_polymorphic_site_falls_back_to_generic(self):
+        globs = vmtest.run_source("""\
+            def mul(a, b):
+                return a * b
+
+            values = [(2, 3), ('a', 2), (1.5, 2.0), ([1], 2)] * 200
+            result = [mul(a, b) for a, b in values]
+            """, {})
+
+        assert globs['result'][:4] == [6, 'aa', 3.0, [1, 1]]
+        assert len(globs['result']) == 800
+        mul = _stats(globs['mul'])['BINARY_MULTIPLY']
+        assert mul.state == 'generic'
+        assert mul.specialized is None
+
+    def test_cached_names_follow_changes_of_namespaces(self):
+        globs = vmtest.run_source("""\
+            def fn():
+                return len([1, 2, 3]) + offset
+
+            offset = 0
+            before = [fn() for _ in range(20)]
+            len = lambda x: 10
+            offset = 100
+            shadowed = [fn() for _ in range(20)]
+            del len
+            restored = fn()
+
+            total = 0
+            for i in range(20):
+                total = total + abs(-i)
+            """, {})
+
+        assert globs['before'] == [3] * 20
+        assert globs['shadowed'] == [110] * 20
+        assert globs['restored'] == 103
+        assert globs['total'] == 190
+
+        # `len` is resolved in builtins at first, then it's shadowed by globals
+        stats = get_specialization_stats(globs['fn'].__code__)
+        load_len = [s for s in stats if s.opname == 'LOAD_GLOBAL'][0]
+        assert load_len.misses > 0 and load_len.deopts == 1
+
+    def test_cached_methods_follow_changes_of_classes(self):
+        globs = vmtest.run_source("""\
+            class Base(object):
+                def value(self):
+                    return 1
+
+            class Thing(Base):
+                pass
+
+            def call(obj):
+                return obj.value()
+
+            def get(obj):
+                return obj.value
+
+            thing = Thing()
+            results = [call(thing) for _ in range(20)]
+            bound = [get(thing)() for _ in range(20)]
+
+            Thing.value = lambda self: 2
+            results.append(call(thing))
+            Base.value = lambda self: 3
+            results.append(call(thing))
+            thing.value = lambda: 4
+            results.append(call(thing))
+            results.append(call(Base()))
+            """, {})
+
+        assert globs['results'] == [1] * 20 + [2, 2, 4, 3]
+        assert globs['bound'] == [1] * 20
+        stats = get_specialization_stats(globs['call'].__code__)
+        load_method = [s for s in stats if s.opname in (
+            'LOAD_METHOD', 'LOAD_ATTR')][0]
+        assert load_method.specializations == 1
+        assert load_method.misses == 4
+
+    def test_cached_methods_follow_getattribute_assigned_later(self):
+        globs = vmtest.run_source("""\
+            class Thing(object):
+                def value(self):
+                    return 'value'
+
+            def hook(self, name):
+                return lambda: 'hooked'
+
+            def call(obj):
+                for _ in range(3000):
+                    result = obj.value()
+                return result
+
+            def get(obj):
+                for _ in range(3000):
+                    result = obj.value
+                return result()
+
+            thing = Thing()
+            results = [call(thing), get(thing)]
+            Thing.__getattribute__ = hook
+            results += [call(thing), get(thing)]
+            """, {})
+
+        assert globs['results'] == ['value', 'value', 'hooked', 'hooked']
+
+    def test_stats_of_code_not_executed(self):
+        def fn(a, b):
+            return a + b
+        assert get_specialization_stats(fn.__code__) == []
@@ -0,0 +1,80 @@
+"""Tests for fusing sequences of instructions into superinstructions."""
+
+from bytefall.objects.codeobject import get_instructions
+from bytefall.specialize import QUICKENED_OPCODE
+from bytefall.superinstructions import fuse, select_sequences
+from . import vmtest
+
+
+class TestFuse(object):
+    def test_fuse_sequences_in_the_same_line(self):
+        code = vmtest.function_code("""\
+            def fn(a, b):
+                c = a + b
+                return c
+            """)
+        table = list(get_instructions(code))
+        fused = fuse(table, code, QUICKENED_OPCODE, {})
+
+        assert fused == [0]
+        assert table[0].opname == 'LOAD_FAST__LOAD_FAST__BINARY_ADD'
+        assert table[0].arguments == (0, 1)
+        assert table[0].next_offset == get_instructions(code)[4].next_offset
+
+        # `STORE_FAST c` and `LOAD_FAST c` are in different lines
+        store = table[table[0].next_offset]
+        assert store is get_instructions(code)[store.offset]
+
+    def test_select_sequences(self):
+        frequencies = {
+            ('LOAD_FAST', 'LOAD_FAST'): 30,
+            ('LOAD_FAST', 'LOAD_CONST'): 20,
+            ('LOAD_FAST', 'LOAD_FAST', 'BINARY_ADD'): 10,
+            ('LOAD_GLOBAL', 'CALL_FUNCTION'): 100,
+        }
+        assert select_sequences(frequencies) == [
+            ('LOAD_FAST', 'LOAD_FAST', 'BINARY_ADD'),
+            ('LOAD_FAST', 'LOAD_FAST'),
+            ('LOAD_FAST', 'LOAD_CONST'),
+        ]
+        assert select_sequences(frequencies, limit=1) == [
+            ('LOAD_FAST', 'LOAD_FAST'),
+        ]
+
+
+class TestSuperinstructions(vmtest.VmTestCase):
+    def test_fused_operations(self):
+        self.assert_ok("""\
+            class Counter(object):
+                def __init__(self):
+                    self.count = 0
+
+            def run(n, counter):
+                i = 0
+                total = 0
+                while i < n:
+                    total = total + i
+                    i += 1
+                    counter.count = counter.count + i
+                    if i != n: x = i
+                return total
+
+            counter = Counter()
+            print(run(50, counter), counter.count)
+            """)
+
+    def test_unbound_local_in_fused_operations(self):
+        self.assert_ok("""\
+            def fn(a):
+                if a:
+                    b = 1
+                return a + b
+            fn(0)
+            """, raises=UnboundLocalError)
+        self.assert_ok("""\
+            def fn(a):
+                if a:
+                    b = 1
+                c = a; d = b
+            fn(0)
+            """, raises=UnboundLocalError)
@@ -0,0 +1,156 @@
+"""Tests for the trace-recording JIT of hot loops."""
+
+from bytefall.specialize import get_loop_stats
+from . import test_basic, test_exceptions, test_functions, test_with, vmtest
+
+
+def _traced_loops(func):
+    return [s for s in get_loop_stats(func.__code__) if s.traces]
+
+
+class TraceAllMixin(vmtest.TierOverrideMixin):
+    """Run test cases with every loop recorded at its second iteration."""
+    overrides = [('vm.trace_jit.threshold', 0)]
+
+
+class TestTracedBasic(TraceAllMixin, test_basic.TestIt):
+    pass
+
+
+class TestTracedLoops(TraceAllMixin, test_basic.TestLoops):
+    pass
+
+
+class TestTracedComparisons(TraceAllMixin, test_basic.TestComparisons):
+    pass
+
+
+class TestTracedExceptions(TraceAllMixin, test_exceptions.TestExceptions):
+    pass
+
+
+class TestTracedFunctions(TraceAllMixin, test_functions.TestFunctions):
+    pass
+
+
+class TestTracedClosures(TraceAllMixin, test_functions.TestClosures):
+    pass
+
+
+class TestTracedGenerators(TraceAllMixin, test_functions.TestGenerators):
+    pass
+
+
+class TestTracedWithStatement(TraceAllMixin, test_with.TestWithStatement):
+    pass
+
+
+class TestTraceJIT(object):
+    def test_hot_loop_is_traced(self):
+        globs = vmtest.run_source("""\
+            def fn(n):
+                total = 0
+                for i in range(n):
+                    if i % 3 == 0:
+                        total += i
+                    else:
+                        total -= 1
+                return total
+
+            result = fn(1000)
+            """, {})
+
+        assert globs['result'] == sum(
+            i if i % 3 == 0 else -1 for i in range(1000)
+        )
+        stats = _traced_loops(globs['fn'])
+        assert len(stats) == 1
+        assert stats[0].state == 'traced' and stats[0].misses == 0
+
+    def test_failed_guard_leaves_trace(self):
+        globs = vmtest.run_source("""\
+            def fn(values):
+                total = 0
+                for v in values:
+                    total = total + v
+                return total
+
+            result = fn([1] * 500 + [0.5] * 10 + [2] * 10)
+            """, {})
+
+        assert globs['result'] == 500 + 5.0 + 20
+        stats = _traced_loops(globs['fn'])
+        assert stats[0].misses > 0
+
+    def test_comparison_of_containers_returning_non_bool(self):
+        globs = vmtest.run_source("""\
+            class Item(object):
+                def __init__(self, result):
+                    self.result = result
+                def __eq__(self, other):
+                    return False
+                def __lt__(self, other):
+                    return self.result
+
+            def fn(pairs):
+                for a, b in pairs:
+                    x = a < b
+                    x += x
+                return x
+
+            items = [1]
+            pairs = [((1,), (2,))] * 500
+            pairs += [((Item(items),), (Item(items),))] * 3
+            fn(pairs)
+            """, {})
+
+        # Tuples return the result of comparing their items, `x += x` should
+        # extend that list in place rather than assuming a bool.
+        assert len(globs['items']) == 8
+        assert _traced_loops(globs['fn'])
+
+    def test_exception_raised_in_trace(self):
+        globs = vmtest.run_source("""\
+            def fn(values):
+                total = 0
+                for v in values:
+                    try:
+                        total += 10 // v
+                    except ZeroDivisionError:
+                        total -= 100
+                return total
+
+            result = fn([1] * 500 + [0] + [2] * 10)
+            """, {})
+
+        assert globs['result'] == 5000 - 100 + 50
+        assert _traced_loops(globs['fn'])
+
+    def test_calls_in_trace(self):
+        globs = vmtest.run_source("""\
+            def square(x):
+                return x * x
+
+            def fn(n):
+                total = 0
+                i = 0
+                while i < n:
+                    total += square(i)
+                    i += 1
+                return total
+
+            result = fn(1000)
+            """, {})
+
+        assert globs['result'] == sum(i * i for i in range(1000))
+        stats = _traced_loops(globs['fn'])
+        assert stats[0].state == 'traced'
+
+    def test_loop_at_module_level(self):
+        globs = vmtest.run_source("""\
+            total = 0
+            for i in range(1000):
+                total += i
+            """, {})
+
+        assert globs['total'] == sum(range(1000))
@@ -0,0 +1,135 @@
+"""Tests for tracing execution in virtual machine."""
+
+from bytefall import get_vm
+from bytefall._modules import sys as py_sys
+from . import vmtest
+
+
+class TestTracing(object):
+    def test_install_and_remove_trace_function_while_running(self):
+        events = []
+
+        def tracer(frame, what, arg):
+            events.append((frame.f_code.co_name, what))
+            frame.f_trace = tracer
+            return tracer
+
+        globs = {'settrace': py_sys.settrace, 'tracer': tracer}
+        vmtest.run_source("""\
+            def foo(x):
+                y = x + 1
+                return y
+
+            foo(1)
+            settrace(tracer)
+            foo(2)
+            settrace(None)
+            foo(3)
+            """, globs)
+
+        assert ('foo', 'call') in events
+        assert ('foo', 'line') in events
+        assert events.count(('foo', 'call')) == 1
+        assert events.count(('foo', 'return')) == 1
+        assert get_vm().tstate.tracefunc is None
+
+    def test_trace_function_removed_by_returning_none(self):
+        events = []
+
+        def tracer(frame, what, arg):
+            events.append((frame.f_code.co_name, what))
+
+        globs = {'settrace': py_sys.settrace, 'tracer': tracer}
+        vmtest.run_source("""\
+            def foo(x):
+                return x + 1
+
+            settrace(tracer)
+            foo(1)
+            foo(2)
+            """, globs)
+
+        assert events == [('foo', 'call')]
+        assert get_vm().tstate.tracefunc is None
+
+    def test_local_variables_modified_by_trace_function(self):
+        def tracer(frame, what, arg):
+            frame.f_trace = tracer
+            if what == 'line' and frame.f_locals.get('x') == 1:
+                frame.f_locals['x'] = 2
+            return tracer
+
+        globs = {'settrace': py_sys.settrace, 'tracer': tracer}
+        vmtest.run_source("""\
+            def foo():
+                x = 1
+                y = 0
+                z = 0
+                return x
+
+            settrace(tracer)
+            result = foo()
+            settrace(None)
+            """, globs)
+
+        assert globs['result'] == 2
+
+    def test_generator_resumed_while_tracing(self):
+        events = []
+
+        def tracer(frame, what, arg):
+            events.append((frame.f_code.co_name, what))
+            frame.f_trace = tracer
+            return tracer
+
+        globs = {'settrace': py_sys.settrace, 'tracer': tracer}
+        vmtest.run_source("""\
+            def gen():
+                yield 1
+                yield 2
+
+            g = gen()
+            next(g)
+            settrace(tracer)
+            next(g)
+            settrace(None)
+            next(g, None)
+            """, globs)
+
+        assert [e for e in events if e[0] == 'gen'] == [
+            ('gen', 'call'), ('gen', 'line'), ('gen', 'return'),
+        ]
+
+    def test_chain_of_yield_from_resumed_while_tracing(self):
+        events = []
+
+        def tracer(frame, what, arg):
+            if what in ('call', 'return'):
+                events.append((frame.f_code.co_name, what))
+            frame.f_trace = tracer
+            return tracer
+
+        globs = {'settrace': py_sys.settrace, 'tracer': tracer}
+        vmtest.run_source("""\
+            def leaf():
+                yield 1
+                yield 2
+
+            def mid():
+                yield from leaf()
+
+            def top():
+                yield from mid()
+
+            g = top()
+            next(g)
+            settrace(tracer)
+            g.send(None)
+            settrace(None)
+            """, globs)
+
+        # Every frame of the chain is resumed and suspended again
+        assert [e for e in events if e[0] != 'settrace'] == [
+            ('top', 'call'), ('mid', 'call'), ('leaf', 'call'),
+            ('leaf', 'return'), ('mid', 'return'), ('top', 'return'),
+        ]
@@ -1,8 +1,9 @@
 """Testing tools for byterun."""
 
-import ast, dis, io, sys, textwrap, types, unittest
+import ast, dis, importlib, io, sys, textwrap, types, unittest
 import pytest
 from bytefall import get_vm, VirtualMachineError
+from bytefall.objects import Function
 
 # Make this false if you need to run the debugger inside a test.
 CAPTURE_STDOUT = (not pytest.custom_cmdopt.show_stdout)
@@ -21,6 +22,83 @@ def dis_code(code):
     dis.dis(code)
 
 
+def compile_source(source, filename='<vmtest>'):
+    """Compile dedented `source` into a code object of module."""
+    return compile(textwrap.dedent(source), filename, 'exec')
+
+
+def run_source(source, globs=None, filename='<vmtest>'):
+    """Run `source` (or a code object compiled from it) in vm with `globs` as
+    its namespace, and return that namespace.
+    """
+    if not isinstance(source, types.CodeType):
+        source = compile_source(source, filename)
+    globs = {} if globs is None else globs
+    get_vm().run_code(source, f_globals=globs)
+    return globs
+
+
+def function_code(source):
+    """Get the code object of the first function defined in `source`."""
+    code = compile_source(source)
+    return [c for c in code.co_consts if hasattr(c, 'co_code')][0]
+
+
+def function_from_source(source):
+    """Make a `Function` of vm from the first function defined in `source`,
+    without running it.
+    """
+    code = function_code(source)
+    globs = {'__builtins__': __builtins__}
+    return Function(code, globs, code.co_name, None, None)
+
+
+def compile_function(tier, func):
+    """Compile the code object of `func` by a compiled tier of vm, e.g.
+    `CompiledCode`, `RegisterCode` or `GeneratedCode`.
+    """
+    vm = get_vm()
+    code = func.__code__
+    return tier(code, vm.get_instructions(code), vm.dispatch_table)
+
+
+def _resolve(path):
+    """Get the owner and name of attribute for a dotted path, which starts
+    with `vm` or the name of a module of `bytefall`.
+    """
+    head, rest = path.split('.', 1)
+    if head == 'vm':
+        owner = get_vm()
+    else:
+        owner = importlib.import_module('bytefall.' + head)
+    names = rest.split('.')
+    for name in names[:-1]:
+        owner = getattr(owner, name)
+    return owner, names[-1]
+
+
+class TierOverrideMixin(object):
+    """Run test cases with attributes controlling the tiers of vm overridden,
+    e.g. thresholds of compilers. `overrides` is a list of (path, value), see
+    `_resolve()` for the format of path.
+
+    Attributes are replaced in `setup_method`, which is called by pytest for
+    both `unittest.TestCase` and plain test classes.
+    """
+    overrides = []
+
+    def setup_method(self, method):
+        self._overridden = []
+        for path, value in self.overrides:
+            owner, name = _resolve(path)
+            self._overridden.append((owner, name, getattr(owner, name)))
+            setattr(owner, name, value)
+
+    def teardown_method(self, method):
+        for owner, name, value in reversed(self._overridden):
+            setattr(owner, name, value)
+
+
 class VmTestCase(unittest.TestCase):
 
     def assert_ok(self, source_code, raises=None, globs=None, locs=None):